@@ -4,16 +4,32 @@ Version: 05/10/2023
 """
 
 from pathlib import Path
+import datetime
+import fnmatch
+import functools
+import hashlib
+import itertools
+import json
+import os
+import struct
+import tempfile
+import traceback
+import warnings
+from collections.abc import ItemsView, KeysView, ValuesView
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.interpolate import splrep, splev
 import pandas as pd
-from settings import upaths
 from tqdm import tqdm
-import cv2
-import pickle as pck
-from pims import Video
-import datetime
+from settings import upaths, video_frame_rate, epoch_protocols, epoch_protocol, stimulus_codes, stimulus_durations
+from bouts import bout_statistics, find_bouts, find_bouts_chunked, long_bouts
+from events import event_epochs, stimulus_times
+from peth import PETH_MEASURES, mouse_peth, peth_tensor
+from polybox import parse_dat_file, read_rec_duration
+from roi import find_roi_file, load_rois, roi_membership, roi_statistics
+from spatial_maps import arena_extent, spatial_maps
+from tables import save_table
+# matplotlib, scipy, cv2, pims and pyarrow are slow to import: they are imported in the
+# functions using them, so that importing this module (e.g. in each worker process) stays fast
 # Note: Camera induces a lot of warpping
 
 def deleting_previous_data(lengths_path=upaths['lengths_path'], dlcpath=upaths['dlcpath']):
@@ -24,51 +40,14 @@ def deleting_previous_data(lengths_path=upaths['lengths_path'], dlcpath=upaths['
     # Get a list of file paths in the folder
     csv_files = list(lengths_path.glob("*.csv"))
     pck_files = list(dlcpath.glob("*.pck"))
+    results_files = list(dlcpath.glob("*.results.json")) + list(dlcpath.glob("*.results.npz"))
 
     # Delete each  file
     for file in csv_files:
         file.unlink()
-    for file in pck_files:
+    for file in pck_files + results_files:
         file.unlink()
 
-deleting_previous_data()
-
-
-def find_video(dlc_filepath):
-    folder = upaths['video_path']
-    all_avi_files = folder.glob('*.avi')
-    for movie in all_avi_files:
-        movie_name = movie.stem
-        if movie_name in dlc_filepath.stem:
-            return movie
-
-
-def find_dat_file(dlc_filename, poly_folder):
-    all_dat_files = poly_folder.rglob('*.dat')
-    for dat_file in all_dat_files:
-        dat_name = dat_file.stem
-        if dat_name in dlc_filename:
-            return dat_file
-
-
-def get_events(dat_path):
-    with open(dat_path, 'r') as fp:
-        n_lines_header = 0
-        for line in fp:
-            n_lines_header += 1
-            line = line.strip()
-            if line == '':
-                break
-    events = np.genfromtxt(dat_path, delimiter='\t', skip_header=n_lines_header, dtype=int)
-    return events
-
-
-def read_rec_duration(events, event_num=11):
-    eleven = events[events[:, 1] == event_num]
-    last_ts = eleven[-2:, 0]
-    is_ttl = np.any(events[:, 1] == 15)  # TTL event should be type 15
-    return last_ts, is_ttl
-
 
 def open_data(data_path, poly_folder, bodypart='center', likelihood_th=0.98):
     """
@@ -100,802 +79,1840 @@ def open_data(data_path, poly_folder, bodypart='center', likelihood_th=0.98):
     y: np.ndarray
         Y coordinates of the bodypart. Starts with a buch of nans, as many as missing frames
     """
-    data_path = Path(data_path)
-    poly_folder = Path(poly_folder)
-    filename = data_path.stem
-    dat_path = find_dat_file(filename, poly_folder)
-    events = get_events(dat_path)
-    last_ts, is_ttl = read_rec_duration(events)
-    video_path = find_video(data_path)
-    v = Video(video_path)
-    frame_rate = int(v.frame_rate)
-    n_frames = len(v)
-    v.close()
-    dlc_data = open_dlc_data(data_path, bodypart, likelihood_th)
-    assert n_frames == dlc_data[0].shape[0]
-    missing_frames = int((last_ts[0] / 1000) * frame_rate - n_frames)
-    nans = np.zeros(missing_frames) + np.nan
-    dlc_data = tuple([np.hstack((nans, c)) for c in dlc_data])
-    return last_ts, frame_rate, missing_frames, dlc_data[0], dlc_data[1]
+    mouse = load_mouse(data_path, poly_folder)
+    x, y = get_bodypart(mouse, bodypart, likelihood_th)
+    return mouse['last_ts'], mouse['frame_rate'], mouse['missing_frames'], x, y
 
 
-# habituation/box ab/20211103_ERC_julia_AStrocytesHPC_Habituation_box ab_01_01_1DLC_resnet50_FearDetectionJun17shuffle1_100000.csv
-# habituation/20211103_ERC_julia_AStrocytesHPC_Habituation_box ab_01_01.dat
-def open_dlc_data(data_path, bodypart='center', likelihood_th=0.98):
+def read_video_metadata(video_path, use_cache=True):
     """
-    Open a file
-    how to run: 
-        open_data(data_path, bodypart='center')
-        
-    Parameters:
+    Read the frame rate and the number of frames of a video, from the headers of the file if
+    possible (see probe_video). The values are kept by path, size and modification time in
+    memory and in the cache folder, so that each video is only probed once.
+
+    Parameters
     ----------
-    data_path
-    path of the folder where the output data of Deeplabcut are
-    
-        
+    video_path: Path or str
+    use_cache: bool
+        Use and update the metadata already read
 
     Returns
     -------
-    It will open the file to be analysed
-
+    frame_rate: int
+    n_frames: int
     """
-    # Done: Given the option to chose a body part and return only the data related to it
-    with open(data_path, 'r') as fp:
-        _ = fp.readline()
-        parts = fp.readline().split(',')
-    parts = [p.strip() for p in parts]
-    if bodypart not in parts:
-        raise ValueError(f'{bodypart} is not a valid bodypart')
-    cols = [ix for ix, p in enumerate(parts) if p == bodypart]
-    # Open a file in data_path
-    dlc_data = np.genfromtxt(data_path, delimiter=',', skip_header=3)
-    dlc_data = dlc_data[:, cols]
-    coords = likelihoodtreshold(dlc_data, False, likelihood_th)
+    video_path = Path(video_path)
+    stat = video_path.stat()
+    signature = [stat.st_size, stat.st_mtime]
+    if not use_cache:
+        return probe_video(video_path)
+    known = load_video_metadata()
+    cached = known.get(str(video_path))
+    if cached is not None and cached['signature'] == signature:
+        return cached['frame_rate'], cached['n_frames']
+    frame_rate, n_frames = probe_video(video_path)
+    known[str(video_path)] = {'signature': signature, 'frame_rate': frame_rate, 'n_frames': n_frames}
+    save_video_metadata()
+    return frame_rate, n_frames
 
-    return coords
 
+# =============================================================================
+# Metadata of the videos
+# =============================================================================
 
-def nan_removal(sig: np.ndarray, t: np.ndarray) -> np.ndarray:
-    """
-    Perform a spline interpolation on a signal to remove missing values
+VIDEO_METADATA = {}  # In-memory copy of the metadata of the videos, by path
 
-    Parameters
-    ----------
-    sig: np.ndarray
-        Signal with missing values
-    t: np.ndarray
-        Time vector
+
+def get_video_metadata_path(cache_path=upaths['cache_path']):
+    return Path(cache_path) / 'video_metadata.json'
+
+
+def load_video_metadata():
+    """
+    Metadata of the videos already probed, read from the cache folder on first use
 
     Returns
     -------
-    sig: np.ndarray
-        Signal with interpolated values and no more nans
+    known: dict
+        {video path: {'signature': [size, mtime], 'frame_rate': int, 'n_frames': int}}
     """
-    sig = sig.copy()
-    is_nan = np.isnan(sig)
-    if not np.any(is_nan):
-        return sig
-    is_not_nan = np.logical_not(is_nan)
-    sig_correct = sig[is_not_nan]
-    t_correct = t[is_not_nan]
-    t_nan = t[is_nan]
-    spline = splrep(t_correct, sig_correct, s=0)
-    filling = splev(t_nan, spline)
-    sig[is_nan] = filling
-    return sig
+    if not VIDEO_METADATA:
+        try:
+            with open(get_video_metadata_path(), 'r') as fp:
+                VIDEO_METADATA.update(json.load(fp))
+        except (OSError, ValueError):
+            pass
+    return VIDEO_METADATA
+
 
+def save_video_metadata():
+    metadata_path = get_video_metadata_path()
+    try:
+        metadata_path.parent.mkdir(parents=True, exist_ok=True)
+        write_atomically(metadata_path, lambda fp: json.dump(VIDEO_METADATA, fp), mode='w')
+    except OSError as err:
+        warnings.warn(f'Could not save the metadata of the videos in {metadata_path}: {err}')
 
-def likelihoodtreshold(dlc_data, show=False, likelihood_th=0.98):
+
+def iter_riff_chunks(data):
     """
-    treshold data using likelihood
-    how to run:
-        likelihoodtreshold(dlc_data, show=False, likelihood_th=0.98)
-    
-    Parameters:
+    Chunks of a block of a RIFF file, entering the LIST chunks
+
+    Parameters
     ----------
-    dlc_data
-    The file to be analised
-    
+    data: bytes
 
     Returns
     -------
-   The x and y coordenates treshold using the likelood lower than 0.5
-
+    chunks: generator of (fourcc, body) tuples
     """
-    # Done: Diagnostic plot
-    # treshold according likelihood the outliers track points in xx coordinate
-    # Done: Simplify using masking with boolean arrays
-    data = dlc_data.copy()
-    # data below the likehood treshold replaced by nan
-    data[dlc_data[:, 2] < likelihood_th, :2] = np.nan
-    nan_frames = np.any(np.isnan(data[:, :2]), axis=1)
-    t = np.arange(data.shape[0])
-    data[:, 0] = nan_removal(data[:, 0], t)  # xx data being interpolated by nan removal function
-    data[:, 1] = nan_removal(data[:, 1], t)  # xx data being interpolated by nan removal function
-    if show:
-        plt.plot(data[:, 0], data[:, 1])
-        if np.sum(nan_frames) > 0:
-            plt.plot(data[nan_frames, 0], data[nan_frames, 1], 'rx')
-    return data[:, 0], data[:, 1]
+    pos = 0
+    while pos + 8 <= len(data):
+        fourcc, size = struct.unpack_from('<4sI', data, pos)
+        body = data[pos + 8:pos + 8 + size]
+        if fourcc == b'LIST':
+            yield from iter_riff_chunks(body[4:])
+        else:
+            yield fourcc, body
+        pos += 8 + size + size % 2
 
 
-def convert_cm(xcoordinate, ycoordinate, xscale=20 / 600, yscale=15 / 450):
+def probe_avi_header(video_path, max_header_size=2 ** 20):
     """
-    convert pixels in cm
-    how to run:
-           convert_cm(xcoordinate, ycoordinate, xscale=20 / 600, yscale=15 / 450)
-    
-    Parameters:
+    Read the frame rate and the number of frames in the headers of an AVI file, without reading
+    any frame: main header (avih), header of the video stream (strh) and, for the files over 1 GB
+    (OpenDML), extended header (dmlh) which is the only one counting all the frames
+
+    Parameters
     ----------
-   xcoordinate
-       coordinate in x axis in pixels
-   ycoordinate
-       coordinate in y axis in pixels
-       
+    video_path: Path or str
+    max_header_size: int
+        Larger header lists are considered corrupted
 
     Returns
     -------
-   The x and y coordenates in centimeters
+    frame_rate: int
+    n_frames: int
+    """
+    with open(video_path, 'rb') as fp:
+        riff = fp.read(20)
+        if len(riff) < 20 or riff[:4] != b'RIFF' or riff[8:12] != b'AVI ':
+            raise ValueError(f'{video_path} is not an AVI file')
+        fourcc, size = struct.unpack_from('<4sI', riff, 12)
+        if fourcc != b'LIST' or size > max_header_size:
+            raise ValueError(f'No header list at the start of {video_path}')
+        hdrl = fp.read(size)
+    if hdrl[:4] != b'hdrl':
+        raise ValueError(f'No header list at the start of {video_path}')
+    headers = {}
+    try:
+        for fourcc, body in iter_riff_chunks(hdrl[4:]):
+            if fourcc == b'avih':
+                headers['us_per_frame'], = struct.unpack_from('<I', body, 0)
+                headers['avih_frames'], = struct.unpack_from('<I', body, 16)
+            elif fourcc == b'strh' and body[:4] == b'vids' and 'rate' not in headers:
+                headers['scale'], headers['rate'], _, headers['strh_frames'] = struct.unpack_from('<4I', body, 20)
+            elif fourcc == b'dmlh':
+                headers['dmlh_frames'], = struct.unpack_from('<I', body, 0)
+    except struct.error as err:
+        raise ValueError(f'Truncated header in {video_path}') from err
+    if headers.get('scale'):
+        frame_rate = headers['rate'] // headers['scale']
+    elif headers.get('us_per_frame'):
+        frame_rate = int(1e6 / headers['us_per_frame'])
+    else:
+        raise ValueError(f'No frame rate in the headers of {video_path}')
+    for key in ('dmlh_frames', 'strh_frames', 'avih_frames'):
+        if headers.get(key):
+            return frame_rate, headers[key]
+    raise ValueError(f'No number of frames in the headers of {video_path}')
 
+
+def probe_cv2(video_path):
     """
-    x_cm = xcoordinate * xscale
-    y_cm = ycoordinate * yscale
-    return x_cm, y_cm
+    Frame rate and number of frames of any video readable by OpenCV, also from the headers
+    """
+    import cv2
 
+    capture = cv2.VideoCapture(str(video_path))
+    try:
+        frame_rate = int(capture.get(cv2.CAP_PROP_FPS)) if capture.isOpened() else 0
+        n_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) if capture.isOpened() else 0
+    finally:
+        capture.release()
+    if frame_rate <= 0 or n_frames <= 0:
+        raise ValueError(f'OpenCV could not read the metadata of {video_path}')
+    return frame_rate, n_frames
 
-# Done: Merge both functions into one
-# Done: Parametrize conversion
-# TODO: Show a frame for user to click on and measure
 
+def probe_pims(video_path):
+    """
+    Frame rate and number of frames read by pims, which may have to read the whole video
+    """
+    from pims import Video
 
-def euclidean_distance(x_cm, y_cm):
+    v = Video(video_path)
+    frame_rate = int(v.frame_rate)
+    n_frames = len(v)
+    v.close()
+    return frame_rate, n_frames
+
+
+def probe_video(video_path):
     """
-    calculate eucidean distance
-    how to run:
-        euclidean_distance(x_cm, y_cm)
+    Read the frame rate and the number of frames of a video with the fastest method that works:
+    headers of the AVI file, OpenCV, then pims
 
-    Parameters:
-    ----------
-   x_cm
-       coordinate in x axis in centimeters
-   y_cm
-       coordinate in y axis in centimeters
-    
-    
     Returns
     -------
-   e_distance
-       The euclidean distance computed using square root of x elevated to 2 +  y elevated to 2 ,
-       where x an y are the difference between pairs of frames in x_cm and y_cm,
-
+    frame_rate: int
+    n_frames: int
     """
-    # calculate the euclidean distance between each pairs of frames
-    x = np.diff(x_cm, axis=0)
-    y = np.diff(y_cm, axis=0)
-    e_distance = np.sqrt((x * x) + (y * y))
-    return e_distance
+    errors = []
+    for probe in (probe_avi_header, probe_cv2):
+        try:
+            return probe(video_path)
+        except (ValueError, ImportError) as err:
+            errors.append(str(err))
+    print(f'Reading the whole video {Path(video_path).name} ({"; ".join(errors)})')
+    return probe_pims(video_path)
 
 
-def speed(e_distance, framerate=25):
+def count_dlc_frames(data_path):
     """
-    calculate speed
-    how to run:
-        speed(e_distance, framerate=25)
-    
+    Number of frames of a DLC file, from its binary copy or by counting the lines of the csv file
+    """
+    _, tracks = load_tracks_cache(data_path)
+    if tracks is not None:
+        return tracks.shape[0]
+    _, n_header = read_dlc_header(data_path)
+    n_lines = 0
+    last = b'\n'
+    with open(data_path, 'rb') as fp:
+        for block in iter(lambda: fp.read(2 ** 20), b''):
+            n_lines += block.count(b'\n')
+            last = block[-1:]
+    if last != b'\n':
+        n_lines += 1
+    return n_lines - n_header
+
+
+def get_video_metadata(data_path, trust_dlc=False):
+    """
+    Frame rate and number of frames of the video of a DLC file
+
     Parameters
     ----------
-    e_distance
-        the euclidean distance
-    framerate
-    
+    data_path: Path
+        DLC file
+    trust_dlc: bool
+        Do not open the video (e.g. if the video folder is offline or slow): the number of frames
+        is the number of rows of the DLC file and the frame rate is video_frame_rate of settings.py
 
     Returns
     -------
-    velocity: np.ndarray
-        the velocity for frame in mm/s
+    frame_rate: int
+    n_frames: int
+    """
+    if trust_dlc:
+        return video_frame_rate, count_dlc_frames(data_path)
+    return read_video_metadata(find_video(data_path))
 
-    -------
 
+def probe_videos(data_paths):
     """
-    convertcm_mm = 10
-    # Done: Parameter
-    # calculate mean velocity
-    velocity = e_distance / (1 / framerate) * convertcm_mm
-    # Done: Maybe this should be velocity = Edistance / (1 / framerate)
-    return velocity
+    Read the metadata of the videos of some DLC files in this process, e.g. before starting
+    worker processes: the workers then find it in the cache and never write the cache file.
+    The videos that cannot be read are skipped, their error comes with the analysis of the mouse
+    """
+    for data_path in data_paths:
+        try:
+            get_video_metadata(data_path)
+        except (OSError, ValueError):
+            pass
 
-def distance_function(e_distance):
+
+def load_mouse(data_path, poly_folder, with_tracks=True, trust_dlc=False):
     """
+    Open, only once, everything needed to analyze one mouse: the DLC file with all its bodyparts,
+    the events of the polybox and the metadata of the video
+
     Parameters
     ----------
-    e_distance
+    data_path: Path or str
+        Path to the DLC file to open
+    poly_folder: Path or str
+        Path to the main folder containing dat files from polyboxes
+    with_tracks: bool
+        Open the DLC file. If False, bodyparts and tracks are not in the output
+    trust_dlc: bool
+        Do not open the video, see get_video_metadata
 
     Returns
     -------
-    velocity: np.ndarray
-        the distance in mm
-
-    -------
-
+    mouse: dict
+        data_path, dat_path, video_path: Path (video_path is None with trust_dlc)
+        events: np.ndarray with the events of the polybox
+        event_times: dict with the timestamps of the events of each code, see parse_dat_file
+        last_ts: np.ndarray, see read_rec_duration
+        is_ttl: bool
+        frame_rate: int
+        n_frames: int
+            Number of frames of the video (and of rows of the DLC file)
+        missing_frames: int
+            How many frames are missing from the beginning of the video
+        bodyparts: tuple of str
+            Bodyparts in the order of the second axis of tracks
+        tracks: np.ndarray
+            (n_frames, n_bodyparts, 3) array with x, y and likelihood of every bodypart.
+            Missing frames are not included
     """
-    convertcm_mm = 10
-    distance = e_distance * convertcm_mm
-    return distance
-
-
-def is_freezing(e_distance, dist_th=0.02):
+    data_path = Path(data_path)
+    poly_folder = Path(poly_folder)
+    filename = data_path.stem
+    dat_path = find_dat_file(filename, poly_folder)
+    dat = parse_dat_file(dat_path)
+    last_ts, is_ttl = read_rec_duration(dat)
+    video_path = None if trust_dlc else find_video(data_path)
+    frame_rate, n_frames = get_video_metadata(data_path, trust_dlc)
+    missing_frames = int((last_ts[0] / 1000) * frame_rate - n_frames)
+    mouse = {'data_path': data_path, 'dat_path': dat_path, 'video_path': video_path,
+             'events': dat['events'], 'event_times': dat['by_code'], 'last_ts': last_ts, 'is_ttl': is_ttl,
+             'frame_rate': frame_rate, 'n_frames': n_frames, 'missing_frames': missing_frames}
+    if with_tracks:
+        bodyparts, tracks = open_dlc_tracks(data_path)
+        assert n_frames == tracks.shape[0]
+        mouse['bodyparts'] = bodyparts
+        mouse['tracks'] = tracks
+    return mouse
+
+
+def get_bodypart(mouse, bodypart='center', likelihood_th=0.98, gap_method='spline', max_gap=None):
     """
-    Freezing detection based on thresholding the e_distance travelled during a pair of frames
-    how to run:
-        is_freezing(e_distance, dist_th=0.02)
+    Coordinates of one bodypart from a mouse loaded with load_mouse, thresholded on the
+    likelihood and padded with nans for the missing frames
 
     Parameters
     ----------
-    e_distance: np.array
-    dist_th: float
-        Distance threshold in cm
+    mouse: dict
+        As returned by load_mouse
+    bodypart: str
+    likelihood_th: float
+        Threshold value on the likelihood given by DLC
+    gap_method: str
+    max_gap: int or None
+        How the frames below the threshold are filled, see nan_removal
 
     Returns
     -------
-    freezing: boolean np.ndarray
-        Indicates if the animal is freezing
-
+    x: np.ndarray
+        X coordinates of the bodypart. Starts with a buch of nans, as many as missing frames
+    y: np.ndarray
+        Y coordinates of the bodypart. Starts with a buch of nans, as many as missing frames
     """
-    return e_distance < dist_th
+    positions, _ = get_bodyparts(mouse, [bodypart], likelihood_th, gap_method, max_gap)
+    x = positions[:, 0, 0].astype(float)
+    y = positions[:, 0, 1].astype(float)
+    return x, y
 
 
-def sliding_freezing(measure, framerate=25, win_size=1, min_duration=2):
+def get_bodyparts(mouse, bodyparts, likelihood_th=0.98, gap_method='spline', max_gap=None):
     """
-    Compute the moving sum of a signal given in input, over a window
-    of size win_size
+    Coordinates of several bodyparts at once, thresholded and gap filled with threshold_tracks
+    and padded with nans for the missing frames
 
     Parameters
     ----------
-    measure: numpy boolean array
-        Boolean array to sum over a sliding window
-    win_size: int
-        Width of the window, in seconds
-        Default to 5
-    min_duration: int
-        Minimum duration during which there must be True's to get a True over a window
-    """
-    win_pts = win_size * framerate
-    min_pts = min_duration * framerate
-    if win_pts > len(measure):
-        # This a special case when input array is shorter than the window
-        # We could: return None, raise an error
-        return np.zeros(measure.shape, dtype=bool)
-    # Summing kernel, here we don't normalize it to get the sum
-    kernel = np.ones(win_pts)
-    # Convolution
-    meas_sum = np.convolve(measure, kernel, 'same')
-    output = (meas_sum > min_pts)
-
-    return output
-
+    mouse: dict
+        As returned by load_mouse
+    bodyparts: list of str
+    likelihood_th: float or dict
+        Threshold value on the likelihood given by DLC, or {bodypart: threshold}
+    gap_method: str
+    max_gap: int or None
+        How the frames below the threshold are filled, see nan_removal
 
-def binning(measure, bin_duration=60, win_duration=20, framerate=25, agg_func=np.sum):
+    Returns
+    -------
+    positions: np.ndarray
+        (missing_frames + n_frames, n_bodyparts, 2) float32 array with the x and y coordinates
+    dropped: dict
+        {bodypart: percentage of the frames below the threshold or without coordinates}
     """
-    Bin a variable with a bin duration of 60 seconds, for a window duration of 20 minutes,
-    framerate of 20 and function default sum
-    how to run:
-        binning(velocity, bin_duration=60, win_duration=20, framerate=25, agg_func=np.sum)
-
+    for bodypart in bodyparts:
+        if bodypart not in mouse['bodyparts']:
+            raise ValueError(f'{bodypart} is not a valid bodypart')
+    if isinstance(likelihood_th, dict):
+        likelihood_th = [likelihood_th[bodypart] for bodypart in bodyparts]
+    ix_bp = [mouse['bodyparts'].index(bodypart) for bodypart in bodyparts]
+    positions, dropped = threshold_tracks(mouse['tracks'][:, ix_bp], likelihood_th, gap_method, max_gap)
+    nans = np.full((mouse['missing_frames'],) + positions.shape[1:], np.nan, dtype=positions.dtype)
+    positions = np.concatenate((nans, positions))
+    return positions, dict(zip(bodyparts, dropped.tolist()))
+
+
+def read_dlc_header(data_path):
+    """
+    Parse the header of a DLC file (scorer, bodyparts and coords rows)
 
     Parameters
     ----------
-    measure: it could be any variable to be analysed by bins - np.ndarray
-    bin_duration :  bin duration of 60 seconds
-    win_duration : duration of the experiment (20 minutes)
-    framerate : frame rate of the videos (25 fps)
-    agg_func : default function
+    data_path: Path or str
+        Path to the DLC file
 
     Returns
     -------
-    arr_meas: bins np.array
-
+    columns: dict
+        {(scorer, bodypart, coord): index of the column in the file}
+    n_header: int
+        Number of header rows
     """
-    bin_size = bin_duration * framerate
-    frame_per_min = 60 * framerate
-    bins = np.arange(0, win_duration * frame_per_min, bin_size)
-    l_meas = []
-    for c_bin in bins:
-        binned_meas = measure[c_bin:c_bin + bin_size]
-        if len(binned_meas) > 0:
-            binned_measure = agg_func(binned_meas)
-        else:
-            binned_measure = np.nan
-        l_meas.append(binned_measure)
-    arr_meas = np.array(l_meas) 
-    return arr_meas
-
-
-def freezing_periods(is_freezed, min_duration=2, framerate=25):
-    w, = np.nonzero(np.diff(is_freezed))
-    n_tr = len(w)
-    if n_tr == 0:
-        return np.array([])
-    if n_tr % 2:
-        if is_freezed[-1]:
-            w = np.hstack((w, len(is_freezed)))
-        else:
-            w = np.hstack((0, w))
-    periods = w.reshape((-1, 2))
-    durations = np.squeeze(np.diff(periods, axis=1))
-    gi = durations > min_duration * framerate
-    periods = periods[gi]
-    return periods
+    header = {}
+    n_header = 0
+    with open(data_path, 'r') as fp:
+        for line in fp:
+            n_header += 1
+            cells = [c.strip() for c in line.split(',')]
+            header[cells[0]] = cells[1:]
+            if cells[0] == 'coords':
+                break
+    columns = {(scorer, bp, coord): ix + 1
+               for ix, (scorer, bp, coord) in enumerate(zip(header['scorer'], header['bodyparts'],
+                                                            header['coords']))}
+    return columns, n_header
 
 
-def freezing_speed_quantif(e_distance, velocity, distance_var, dist_th=0.02, framerate=25,
-                           bin_duration=60, win_duration=20, min_duration=0.5, show=False,
-                           MFD=0.1, MAD=0.5, mouse_id='mouse_id'):
+def dlc_bodyparts(columns):
     """
-    Freezing and speed quantification
-    How to run:
-        freezing_speed_quantif(e_distance, velocity, dist_th=0.02, framerate=25,
-                           bin_duration=60, win_duration=20, show=False)
+    Bodyparts of a DLC header, in the order of the file
 
     Parameters
     ----------
-    e_distance : instantant eucleadian distance - np. array
-    velocity : instant velocity - np.array
-    dist_th : freezing threshold (0.02)
-    framerate : frame rate of the videos (25 fps)
-    bin_duration : bin duration of 60 seconds
-    win_duration : duration of the experiment (20 minutes)
-    min_duration (MFD): float
-        Minimum duration of immobility, in seconds, before it is considered freezing
-    show: boolean
-        Plot or not? Default to False
-    MFD: Minimum Freeze Duration
-    MAD: Minimum Activity Duration
+    columns: dict
+        As returned by read_dlc_header
 
     Returns
     -------
-    res: dict
-        dur_freezing: Total duration of freezing in seconds (float)
-        freezing_bin : freezing by bins - np.array
-        speed: Velocity - np.ndarray
-        speed_bin : speed by bins - np.array
-        speed_freezing : speed during freezing
-        speed_moving : speed out of the freezing period
-        perc_freezing: Percentage of total time spent freezing - float
+    bodyparts: tuple of str
+    """
+    return tuple(dict.fromkeys(bp for _, bp, _ in columns))
 
+
+def dlc_columns(columns, bodyparts, coords=('x', 'y', 'likelihood')):
     """
-    
- 
-    n_frames = len(e_distance)
-    freezing = is_freezing(e_distance, dist_th)
-    # freezing = freezing_blocks(freez, framerate)
-    # freezing = sliding_freezing(freez, framerate, win_size=5, min_duration=1)
-    
-    # =============================================================================
-    # A function useful for both MFD and MAD
-    # =============================================================================   
-    
-    def moving_window(lst, window_size):
-        window = []
-        result = []
-        for i in range(len(lst)):
-            window.append(lst[i])
-            if len(window) == window_size:
-                result.append(tuple(window))
-                window.pop(0)
-        return result
-    
-    # =============================================================================
-    # Applying a MFD to the freezing
-    # =============================================================================   
-    
-    window_MFD = round(MFD * framerate)
-    
-    list_of_windows = moving_window(freezing, window_MFD)
-    boolean_list_of_windows = []
-    for value in list_of_windows:
-        boolean_list_of_windows.append(all(value))
-    
-    list_of_indexes = [x for x in range(len(freezing))]
-    list_of_windows_indexes = moving_window(list_of_indexes, window_MFD)
+    Index of the columns of the file holding the given bodyparts and coordinates
 
-    dictionary = dict(zip(list_of_windows_indexes, boolean_list_of_windows))
+    Parameters
+    ----------
+    columns: dict
+        As returned by read_dlc_header
+    bodyparts: iterable of str
+    coords: iterable of str
 
-    true_index_list = []
-    for key, value in dictionary.items():
-        if value == True:
-            true_index_list.append(key)
+    Returns
+    -------
+    cols: list of int
+        Columns ordered by bodypart, then by coordinate
+    """
+    by_part = {(bp, coord): ix for (_, bp, coord), ix in columns.items()}
+    cols = []
+    for bp in bodyparts:
+        for coord in coords:
+            if (bp, coord) not in by_part:
+                raise ValueError(f'{bp} is not a valid bodypart')
+            cols.append(by_part[(bp, coord)])
+    return cols
 
-    new_true_index_list = [item for sublist in true_index_list for item in sublist]
-    new_true_index_list = list(set(new_true_index_list))
 
-    new_freezing = []
-    for new_index in range(len(freezing)):
-        if new_index in new_true_index_list:
-            new_freezing.append(True)
-        if new_index not in new_true_index_list:
-            new_freezing.append(False)
-    
-    # freezing = np.array(new_freezing)
-    
-    # =============================================================================
-    # Applying a MAD to the freezing
-    # =============================================================================   
-    
-    window_MAD = round(MAD * framerate)
-    
-    list_of_windows_MAD = moving_window(freezing, window_MAD)
-    boolean_list_of_windows_MAD = []
-    
-    def all_false(lst):
-        for elem in lst:
-            if elem:
-                return False
-        return True
-    
-    for value in list_of_windows_MAD:
-        boolean_list_of_windows_MAD.append(all_false(value))
-    
-    list_of_indexes_MAD = [x for x in range(len(freezing))]
-    list_of_windows_indexes_MAD = moving_window(list_of_indexes_MAD, window_MAD)
+def import_pyarrow_csv():
+    """
+    Import pyarrow.csv on first use
 
-    dictionary_MAD = dict(zip(list_of_windows_indexes_MAD, boolean_list_of_windows_MAD))
+    Returns
+    -------
+    pa_csv: module or None
+        None if pyarrow is not installed
+    """
+    try:
+        import pyarrow.csv as pa_csv
+    except ImportError:
+        return None
+    return pa_csv
 
-    true_index_list_MAD = []
-    for key, value in dictionary_MAD.items():
-        if value == True:
-            true_index_list_MAD.append(key)
 
-    new_true_index_list_MAD = [item for sublist in true_index_list_MAD for item in sublist]
-    new_true_index_list_MAD = list(set(new_true_index_list_MAD))
+def read_dlc_columns(data_path, cols, n_header=3, engine=None):
+    """
+    Load only some columns of a DLC file
 
-    new_freezing = []
-    for new_index in range(len(freezing)):
-        if new_index in new_true_index_list_MAD:
-            new_freezing.append(False)
-        if new_index not in new_true_index_list_MAD:
-            new_freezing.append(True)
-    
-    # freezing = np.array(new_freezing)
+    Parameters
+    ----------
+    data_path: Path or str
+        Path to the DLC file
+    cols: list of int
+        Columns to load, as given by dlc_columns
+    n_header: int
+        Number of header rows to skip
+    engine: str or None
+        'pyarrow', 'c' (pandas C parser) or 'genfromtxt' (numpy, slow but always there).
+        If None, use pyarrow if installed, the pandas C parser otherwise
 
-    # =============================================================================
-    # Calculating the duration of the freezing events
-    # =============================================================================
-    
-    freezing_list = list(freezing)
-    
-    # To count the freezing events of a particular period
-    def slicer_in_periods(lst, begining_min=0, ending_min=3, framerate=25):
-        b = round(begining_min * 60 * framerate)
-        e = round(ending_min * 60 * framerate)
-        new_lst = lst[b:e]
-        return new_lst
-    
-    master_lst = {}
-    
-        # OFF PERIOD
-    # off = slicer_in_periods(freezing_list, 0, 3, framerate)
-    # if not off:
-    #     master_lst['lengths_off'] = [False, False]
-    # else:
-    #     master_lst['lengths_off'] = off
-        
-        # ON PERIOD
-    # on = slicer_in_periods(freezing_list, 3, 8, framerate)
-    # if not on:
-    #     master_lst['lengths_on'] = [False, False]
-    # else:
-    #     master_lst['lengths_on'] = on
-        
-        # OFF PERIOD (1st min)
-    # first_off = slicer_in_periods(freezing_list, 0, 1, framerate)
-    # if not first_off:
-    #     master_lst['lengths_first_off'] = [False, False]
-    # else:
-    #     master_lst['lengths_first_off'] = first_off
-    
-        # OFF PERIOD (last min)
-    last_off = slicer_in_periods(freezing_list, 2, 3, framerate)
-    if not last_off:
-        master_lst['lengths_last_off'] = [False, False]
-    else:
-        master_lst['lengths_last_off'] = last_off
-    
-        # ON PERIOD (1st min)
-    first_on = slicer_in_periods(freezing_list, 3, 4, framerate)
-    if not first_on:
-        master_lst['lengths_first_on'] = [False, False]
-    else:
-        master_lst['lengths_first_on'] = first_on
-    
+    Returns
+    -------
+    dlc_data: np.ndarray
+        (n_frames, len(cols)) array, in the order of cols
+    """
+    if engine is None:
+        engine = 'pyarrow' if import_pyarrow_csv() is not None else 'c'
+    try:
+        if engine == 'pyarrow':
+            import pyarrow as pa
+            import pyarrow.csv as pa_csv
+
+            names = [f'f{c}' for c in cols]  # Names autogenerated by pyarrow
+            table = pa_csv.read_csv(data_path,
+                                    read_options=pa_csv.ReadOptions(skip_rows=n_header,
+                                                                    autogenerate_column_names=True),
+                                    convert_options=pa_csv.ConvertOptions(
+                                        include_columns=names,
+                                        column_types={name: pa.float64() for name in names}))
+            return np.column_stack([table.column(name).to_numpy() for name in names])
+        if engine == 'c':
+            data = pd.read_csv(data_path, header=None, skiprows=n_header, usecols=cols,
+                               dtype=np.float64, engine='c')
+            return data[cols].to_numpy()
+    except ValueError as err:  # Also catches pyarrow.ArrowInvalid
+        warnings.warn(f'Fast reading of {data_path} failed ({err}), falling back to genfromtxt')
+    dlc_data = np.genfromtxt(data_path, delimiter=',', skip_header=n_header, usecols=cols)
+    return dlc_data.reshape((-1, len(cols)))
 
-    # ATTENTION: From this point, the functions become compiled and iterated in the end
-    
-    # To extract the amount of freezing
-    def extract_sequences(lst):    
-        """
-        This function takes a list lst as an argument and returns a list of
-        tuples representing the start and end indices of non-empty sequences
-        in the input list.
-        """
-        
-        sequences = []
-        start = None
-    
-        for i in range(len(lst)):
-            if lst[i]:
-                if start is None:
-                    start = i
-            else:
-                if start is not None:
-                    sequences.append((start, i))
-                    start = None
-                
-        if start is not None:
-            sequences.append((start, len(lst)))
-      
-        return sequences
-    
-    def get_lengths(sequences):
-        """
-        This function takes a list of tuples sequences as an argument, where
-        each tuple represents the start and end indices of a non-empty sequence
-        in a list. The function returns a list of lengths of the non-empty
-        sequences in sequences.
-        """
-        
-        lengths = []
-        for start, end in sequences:
-            length = end - start
-            lengths.append(length)
-        return lengths
-    
-    def divide_list(lst, value):
-        """
-        This function takes a list lst and a number value as inputs and
-        returns a new list where each element of the input list is divided by
-        the input value.
-        """
-        
-        result = []
-        for item in lst:
-            result.append(item / value)
-        return result
-    
-    # def count_numbers(numbers):
-    #     """
-    #     This function takes a list of numbers numbers as an argument and
-    #     returns a dictionary where each key is a unique number from the input
-    #     list and its corresponding value is the count of that number in the
-    #     input list.
-    #     """
-        
-    #     counts = {}
-    #     for num in numbers:
-    #         if num in counts:
-    #             counts[num] += 1
-    #         else:
-    #             counts[num] = 1
-    #     return counts
-    
-    # def sum_values_interval(counts, interval):
-    #     """
-    #     This function takes two arguments: a dictionary counts where each key
-    #     is a number and its corresponding value is the count of that number,
-    #     and an interval represented as a tuple of two numbers. The function
-    #     returns the sum of the counts of all the numbers in the input
-    #     dictionary that fall within the input interval.
-    #     """
-        
-    #     total = 0
-    #     for key in counts:
-    #         if interval[0] <= key < interval[1]:
-    #             total += counts[key]
-    #     return total    
-    
-    # def dictionary_sum_values_interval(lst, tag):
-    #     """
-    #     This function takes two arguments: a list lst of numbers and a string tag.
-    #     The function divides the range of numbers in the input list into ? bins
-    #     of width ?, and for each bin, it calculates the sum of the numbers
-    #     that fall within that bin using the sum_values_interval function.
-    #     The function then returns a dictionary where each key is a string
-    #     representing a bin interval and the corresponding value is the sum of
-    #     the numbers in that interval.
-    #     """
-        
-    #     results_dict = {}
-    #     length_of_each_bin = 0.1 # Change this number to modify the number of bins
-    #     total_length = 7
-    #     number_of_bins = int(total_length / length_of_each_bin)
-        
-    #     for i in range(number_of_bins): 
-    #         interval_start = i * length_of_each_bin
-    #         interval_end = interval_start + length_of_each_bin
-    #         interval = (interval_start, interval_end)
-    #         result = sum_values_interval(lst, interval)
-    #         results_dict[tag + ' ' + str(interval_start) + '-' + str(interval_end)] = result
-    #     return results_dict
+
+# habituation/box ab/20211103_ERC_julia_AStrocytesHPC_Habituation_box ab_01_01_1DLC_resnet50_FearDetectionJun17shuffle1_100000.csv
+# habituation/20211103_ERC_julia_AStrocytesHPC_Habituation_box ab_01_01.dat
+def open_dlc_data(data_path, bodypart='center', likelihood_th=0.98):
+    """
+    Open a file
+    how to run: 
+        open_data(data_path, bodypart='center')
         
+    Parameters:
+    ----------
+    data_path
+    path of the folder where the output data of Deeplabcut are
     
-    # AFTER DEFINING THE FUNTIONS: Create a function to iterate through all the
-    # functions created to cound duration of freezing
-    def iterate_freeze_duration(lst_of_lsts, framerate):
-        dicts = {}
         
-        for tag, lst in lst_of_lsts.items():
-            lst_2 = extract_sequences(lst)
-            lst_3 = get_lengths(lst_2)
-            lst_4 = divide_list(lst_3, framerate)
-            # lst_5 = count_numbers(lst_4)
-            
-            # lst_6 = dictionary_sum_values_interval(lst_5, tag)
-
-            # dicts.append(lst_6)
-            
-            dicts[tag] = [lst_4]
-                    
-        return dicts
-    
-    
-    # Create the list of dictionaries based on the previous functions
-    my_dicts = iterate_freeze_duration(master_lst, framerate)
 
-    
-    # =============================================================================           
-    
-    empty_bins = binning(np.ones(n_frames), bin_duration, win_duration, framerate, np.sum) == 0
-    n_freezing_frames = binning(freezing, bin_duration, win_duration, framerate, np.sum)
-    sec_freezing = n_freezing_frames / framerate  # Freezing duration, binned
-    sec_freezing[empty_bins] = np.nan
-    speed_bin = binning(velocity, bin_duration, win_duration, framerate, np.mean)  # Speed binned
-    distance_bin = binning(distance_var, bin_duration, win_duration, framerate)  # Distance binned
-    speed_bin[empty_bins] = np.nan
-    distance_bin[empty_bins] = np.nan
-    speed_freezing = np.mean(velocity[freezing])
-    speed_moving = np.mean(velocity[np.logical_not(freezing)])
-    perc_freezing = 100 * np.nansum(n_freezing_frames) / n_frames
-    no_freezing_velocity = velocity.copy()
-    no_freezing_velocity[freezing] = np.nan
-    speed_moving_bin = binning(no_freezing_velocity, bin_duration, win_duration, framerate, np.nanmean) #speed moving binned
-    speed_moving_bin[empty_bins] = np.nan 
-    if show:
-        speed_color = 'darkred'
-        freezing_color = 'darkblue'
-        fig, ax_fr = plt.subplots()
-        t = np.arange(0, win_duration * 60, bin_duration)
-        ax_sp = ax_fr.twinx()
-        ax_fr.plot(t, sec_freezing, c=freezing_color)
-        ax_fr.set_ylabel('Binned time (s)', color=freezing_color)
-        ax_fr.tick_params(axis='y', labelcolor=freezing_color)
-        ax_sp.plot(t, speed_bin, c=speed_color)
-        ax_sp.set_ylabel('Animal velocity (mm/s)', color=speed_color)
-        ax_sp.tick_params(axis='y', labelcolor=speed_color)
-        fig.set_tight_layout(True)
-    res = {'dur_freezing': np.nansum(sec_freezing), 'freezing_bin': sec_freezing*100/bin_duration,
-           'velocity': velocity, 'speed_bin': speed_bin, 'distance_bin': distance_bin, 'speed_freezing': speed_freezing,
-           'speed_moving': speed_moving, 'perc_freezing': perc_freezing, 'speed': np.mean(velocity),
-           'distance': np.sum(e_distance), 'freezing': freezing, 'dist': e_distance,
-           'freeze_periods': freezing_periods(freezing, min_duration=min_duration, framerate=framerate),
-           'speedmoving_bin': speed_moving_bin, } # attention dont call binned variables like speed_moving_bin
-    # being that the function of analyse all data is searching for _bin wil skip this variable because have a _ before_bin
-    
-    # res.update(my_dicts)
-    
-    mouse_id.update(my_dicts)
-    lengths_df = pd.DataFrame.from_dict(mouse_id)
-    
-    directory_path = 'C:/Users/mcanela/Desktop/Python/Freezing periods'
-    filename = 'lengths_' + mouse_id['file'] + '.csv'
-    filepath = directory_path + '/' + filename
-    lengths_df.to_csv(filepath, index=False)
-    
-    return res
+    Returns
+    -------
+    It will open the file to be analysed
+
+    """
+    # Done: Given the option to chose a body part and return only the data related to it
+    bodyparts, tracks = load_tracks_cache(data_path)
+    if tracks is not None:
+        if bodypart not in bodyparts:
+            raise ValueError(f'{bodypart} is not a valid bodypart')
+        dlc_data = tracks[:, bodyparts.index(bodypart), :]
+    else:
+        columns, n_header = read_dlc_header(data_path)
+        cols = dlc_columns(columns, [bodypart])
+        # Open only the columns of the bodypart
+        dlc_data = read_dlc_columns(data_path, cols, n_header)
+    coords = likelihoodtreshold(dlc_data, False, likelihood_th)
+
+    return coords
 
 
-def create_velocity_map(results, bin_size=.5):
+def read_dlc_tracks(data_path):
     """
-    velocity map, color coded by the color in the x and y map
-    how to run:
-        create_velocity_map(results, bin_size=.5)
+    Read all the bodyparts of a DLC CSV file at once
 
     Parameters
     ----------
-    results: dict
-    bin_size: float
-        In cm (this bin size is the spatial window that we selected to average the speed)
+    data_path: Path or str
+        Path to the DLC file
 
     Returns
     -------
-    v_binned:  np.ndarray
-        2D array with average speed for each bin
+    bodyparts: tuple of str
+        Bodyparts found in the header, in the order of the file
+    tracks: np.ndarray
+        (n_frames, n_bodyparts, 3) array with x, y and likelihood of each bodypart
+    """
+    columns, n_header = read_dlc_header(data_path)
+    bodyparts = dlc_bodyparts(columns)
+    dlc_data = read_dlc_columns(data_path, dlc_columns(columns, bodyparts), n_header)
+    tracks = dlc_data.reshape((dlc_data.shape[0], len(bodyparts), 3))
+    return bodyparts, tracks
+
+
+def open_dlc_tracks(data_path, use_cache=True):
+    """
+    Open all the bodyparts of a DLC file at once, from its binary copy when possible
+
+    Parameters
+    ----------
+    data_path: Path or str
+        Path to the DLC file
+    use_cache: bool
+        Read (and write if needed) the binary copy of the file, see convert_dlc_file
 
+    Returns
+    -------
+    bodyparts: tuple of str
+        Bodyparts found in the header, in the order of the file
+    tracks: np.ndarray
+        (n_frames, n_bodyparts, 3) array with x, y and likelihood of each bodypart
     """
-    x, y = results['x'][:-1], results['y'][:-1]
-    v = results['velocity']
-    xmin, xmax = x.min(), x.max()
-    ymin, ymax = y.min(), y.max()
+    if use_cache:
+        return convert_dlc_file(data_path)
+    return read_dlc_tracks(data_path)
 
-    xbins = np.arange(xmin, xmax, bin_size)  # bins in xx dimension
-    ybins = np.arange(ymin, ymax, bin_size)  # bins in yy dimension
-    v_binned = np.zeros((len(ybins), len(xbins))) + np.nan  # v_binned empty with the proper size
 
-    for ix_xb, xb in enumerate(xbins[:-1]):
-        xn = xbins[ix_xb + 1]
-        for ix_yb, yb in enumerate(ybins[:-1]):
-            yn = ybins[ix_yb + 1]
-            x_cond = np.logical_and(x >= xb, x < xn)
-            y_cond = np.logical_and(y >= yb, y < yn)
-            mask = np.logical_and(x_cond, y_cond)
-            if np.sum(mask) == 0:
-                continue
-            avg_speed = np.mean(v[mask])  # compute the average speed in each spatial bin
-            v_binned[ix_yb, ix_xb] = avg_speed
-    return v_binned
+# =============================================================================
+# Binary copies of the DLC files
+# =============================================================================
 
+TRACKS_CACHE_VERSION = 1
 
-def split_by_freezing(measurement, freezing):
+
+def file_digest(file_path, chunk_size=2 ** 20):
     """
-    this function split a variable during freezing and moving periods
+    SHA1 of the content of a file
 
     Parameters
     ----------
-    measurement: np.ndarray
-        variable to be splitted
-    freezing: np.ndarray
-        Boolean variable that contain the information if the animal is in freezing for each frame
+    file_path: Path or str
+    chunk_size: int
+        Number of bytes read at once
 
     Returns
-    --------
-    averages: dict
-        the average of the variable (in measurement) during freezing and moving
-        {'avg': np.ndarray, 'freezing': np.ndarray, 'moving': np.ndarray}
-
     -------
+    digest: str
+    """
+    sha = hashlib.sha1()
+    with open(file_path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
 
+
+def get_tracks_filepaths(data_path):
     """
-    if len(measurement) == len(freezing) + 1:
-        measurement = measurement[1:]
-    in_freezing = measurement[freezing]  # filter the variable to the moments in freezing
-    out_freezing = measurement[
-        np.logical_not(freezing)]  # filter the variable to the moments moving
-    averages = {'avg': np.nanmean(measurement),  # average of the variable without filters
-                'freezing': np.nanmean(in_freezing),  # average of the variable filtered by freezing
-                'moving': np.nanmean(out_freezing)}  # average of the variable filtered by moving
-    return averages
+    Paths of the binary copy of a DLC file: the array (.npy) and its metadata (.json),
+    stored next to the CSV file
+    """
+    data_path = Path(data_path)
+    npy_file = data_path.parent / f'{data_path.stem}.tracks.npy'
+    meta_file = data_path.parent / f'{data_path.stem}.tracks.json'
+    return npy_file, meta_file
 
 
-def pose(data_path, poly_folder, dist_th=0.02):
+def write_atomically(file_path, write_func, mode='wb'):
     """
-    Calculate the pose of the animal (each bodyparts distance or all body) during all time
-    or splited by freezing or moving time
-    how to run:
-        create_velocity_map(results, bin_size=.5)
+    Write a file through a temporary file, so that an interrupted writing never leaves
+    a half written file behind. Each writing has its own temporary file, so that processes
+    writing the same file at the same time do not mix their content: the last one wins
 
     Parameters
     ----------
-    data_path: variable to be splitted
-    dist_th : freezing treshold (0.02)
+    file_path: Path
+    write_func: callable
+        Called with the opened temporary file
+    mode: str
+        'wb' or 'w'
+    """
+    with tempfile.NamedTemporaryFile(mode, dir=file_path.parent, prefix=f'{file_path.name}.',
+                                     suffix='.tmp', delete=False) as fp:
+        tmp_file = fp.name
+        try:
+            write_func(fp)
+        except BaseException:
+            fp.close()
+            os.remove(tmp_file)
+            raise
+    os.replace(tmp_file, file_path)
+
+
+def load_tracks_cache(data_path):
+    """
+    Open the binary copy of a DLC file, if it is still valid. The copy is valid if the CSV file
+    has the same size and modification time as when it was converted. If only the modification
+    time changed (e.g. the file was copied again), the content hash is checked.
+
+    Parameters
+    ----------
+    data_path: Path or str
+        Path to the DLC CSV file
 
     Returns
-    --------
-    pose_results: dict.
+    -------
+    bodyparts: tuple of str or None
+    tracks: np.memmap or None
+        (n_frames, n_bodyparts, 3) float32 array, memory-mapped. None if there is no valid copy
+    """
+    data_path = Path(data_path)
+    npy_file, meta_file = get_tracks_filepaths(data_path)
+    if not npy_file.exists() or not meta_file.exists():
+        return None, None
+    with open(meta_file, 'r') as fp:
+        meta = json.load(fp)
+    stat = data_path.stat()
+    if meta.get('version') != TRACKS_CACHE_VERSION or meta['size'] != stat.st_size:
+        return None, None
+    if meta['mtime'] != stat.st_mtime:
+        if meta['sha1'] != file_digest(data_path):
+            return None, None
+        meta['mtime'] = stat.st_mtime
+        try:
+            write_atomically(meta_file, lambda fp: json.dump(meta, fp), 'w')
+        except OSError:
+            pass  # Read-only folder: the hash will be checked again next time
+    tracks = np.load(npy_file, mmap_mode='r')
+    return tuple(meta['bodyparts']), tracks
+
+
+def convert_dlc_file(data_path, force=False):
+    """
+    Convert a DLC CSV file into a float32 binary copy (see get_tracks_filepaths), unless
+    a valid copy already exists, and open it
+
+    Parameters
+    ----------
+    data_path: Path or str
+        Path to the DLC CSV file
+    force: bool
+        Convert even if there is a valid copy
 
+    Returns
+    -------
+    bodyparts: tuple of str
+    tracks: np.ndarray
+        (n_frames, n_bodyparts, 3) float32 array, memory-mapped when the copy could be written
     """
     data_path = Path(data_path)
-    bodyparts = ('nose', 'head', 'center', 'tail')  # bodyparts to be extracted
-    part_pairs = list(zip(bodyparts, bodyparts[1:]))  # iterate 2 list to do the pairs of bodyparts
-    bp_pos = {}
-    # for each bodypart open the file, interpolate by likelihood and convert coordinate pixels in cm
-    for bp in bodyparts:
-        _, _, _, x, y = open_data(data_path, poly_folder, bp, likelihood_th=0.99)
-        # x, y = likelihoodtreshold(bp_data, show=False, likelihood_th=0.99)
-        x, y = convert_cm(x, y)
-        bp_pos[bp] = (x, y)
+    if not force:
+        bodyparts, tracks = load_tracks_cache(data_path)
+        if tracks is not None:
+            return bodyparts, tracks
+    stat = data_path.stat()
+    bodyparts, tracks = read_dlc_tracks(data_path)
+    tracks = tracks.astype(np.float32)
+    meta = {'version': TRACKS_CACHE_VERSION, 'size': stat.st_size, 'mtime': stat.st_mtime,
+            'sha1': file_digest(data_path), 'bodyparts': list(bodyparts), 'shape': list(tracks.shape)}
+    npy_file, meta_file = get_tracks_filepaths(data_path)
+    try:
+        # Metadata last: the copy is only considered once the array is complete
+        write_atomically(npy_file, lambda fp: np.save(fp, tracks))
+        write_atomically(meta_file, lambda fp: json.dump(meta, fp), 'w')
+    except OSError as err:
+        warnings.warn(f'Could not save a binary copy of {data_path.name}: {err}')
+        return bodyparts, tracks
+    return bodyparts, np.load(npy_file, mmap_mode='r')
+
+
+def convert_dlc_files(data_paths, force=False):
+    """
+    Conversion stage: make sure that every DLC file has a valid binary copy
 
-    bp_dist = {}
-    total_pose = np.zeros(
-        len(bp_pos['nose'][0]) - 1)  # create the total pose with the proper size filled of zeros
-    for pair in part_pairs:  # calculate the euclidean distance between each pair of body parts
+    Parameters
+    ----------
+    data_paths: iterable of Path
+        Paths to the DLC CSV files. Files that do not exist are skipped
+    force: bool
+        Convert again all the files
+    """
+    for data_path in tqdm(list(data_paths), desc='Converting DLC files'):
+        if Path(data_path).exists():
+            convert_dlc_file(data_path, force)
+
+
+# =============================================================================
+# Indexes of the dat and video folders
+# =============================================================================
+
+FILE_INDEXES = {}  # In-memory copy of the indexes, by (folder, pattern, recursive)
+
+
+def build_file_index(folder, pattern='*.dat', recursive=True):
+    """
+    Walk a folder once and index the files matching a pattern by their stem
+
+    Parameters
+    ----------
+    folder: Path or str
+    pattern: str
+        Pattern of the file names, as in glob
+    recursive: bool
+        Also index the subfolders
+
+    Returns
+    -------
+    file_index: dict
+        root: [folder, its modification time or None if it does not exist]
+        dirs: {folder: modification time} of all the walked folders, to validate the index
+        files: {stem: [paths]} of the matching files
+    """
+    file_index = {'root': [str(folder), folder_mtime(folder)], 'dirs': {}, 'files': {}}
+    for dirpath, dirnames, filenames in os.walk(folder):
+        file_index['dirs'][dirpath] = os.stat(dirpath).st_mtime
+        for filename in fnmatch.filter(filenames, pattern):
+            file_path = Path(dirpath) / filename
+            file_index['files'].setdefault(file_path.stem, []).append(str(file_path))
+        if not recursive:
+            break
+    return file_index
+
+
+def folder_mtime(folder):
+    """Modification time of a folder, None if it does not exist"""
+    try:
+        return os.stat(folder).st_mtime
+    except OSError:
+        return None
+
+
+def is_index_valid(file_index):
+    """
+    An index is valid while none of its folders has been modified (adding, removing or renaming
+    a file changes the modification time of its folder). The indexed folder itself is checked
+    too, so that the index of a folder missing when it was built is rebuilt once it exists
+    """
+    if 'root' not in file_index:
+        return False
+    root, root_mtime = file_index['root']
+    if folder_mtime(root) != root_mtime:
+        return False
+    for dirpath, mtime in file_index['dirs'].items():
+        try:
+            if os.stat(dirpath).st_mtime != mtime:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def load_file_index(folder, pattern='*.dat', recursive=True, refresh=False,
+                    cache_path=upaths['cache_path']):
+    """
+    Index of a folder (see build_file_index). The index is kept in memory and on disk in the
+    cache folder, and only rebuilt when one of the indexed folders was modified.
+
+    Parameters
+    ----------
+    folder: Path or str
+    pattern: str
+    recursive: bool
+    refresh: bool
+        Check that the index kept in memory is still valid. Otherwise the in-memory index is
+        used as is, which is what we want while analysing a batch
+    cache_path: Path or str
+        Folder where to save the indexes
+
+    Returns
+    -------
+    file_index: dict
+    """
+    key = (str(folder), pattern, recursive)
+    if key in FILE_INDEXES and not (refresh and not is_index_valid(FILE_INDEXES[key])):
+        return FILE_INDEXES[key]
+    cache_file = Path(cache_path) / f'index_{hashlib.sha1(repr(key).encode()).hexdigest()[:12]}.json'
+    file_index = None
+    if cache_file.exists():
+        with open(cache_file, 'r') as fp:
+            file_index = json.load(fp)
+        if not is_index_valid(file_index):
+            file_index = None
+    if file_index is None:
+        file_index = build_file_index(folder, pattern, recursive)
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            write_atomically(cache_file, lambda fp: json.dump(file_index, fp), 'w')
+        except OSError as err:
+            warnings.warn(f'Could not save the index of {folder}: {err}')
+    FILE_INDEXES[key] = file_index
+    return file_index
+
+
+def match_file(file_index, name):
+    """
+    Find the indexed file whose stem is the longest prefix of a name
+
+    Parameters
+    ----------
+    file_index: dict
+        As returned by load_file_index
+    name: str
+        Typically the stem of a DLC file
+
+    Returns
+    -------
+    candidates: list of Path
+        Files matching the longest prefix: empty if nothing matches, more than one element
+        if the match is ambiguous
+    """
+    files = file_index['files']
+    for end in range(len(name), 0, -1):
+        if name[:end] in files:
+            return [Path(p) for p in files[name[:end]]]
+    return []
+
+
+def find_file(file_index, name, kind='file'):
+    """
+    Single file from match_file, raising an error if there is no match or several ones
+    """
+    candidates = match_file(file_index, name)
+    if len(candidates) == 0:
+        raise FileNotFoundError(f'No {kind} found for {name}')
+    if len(candidates) > 1:
+        raise FileNotFoundError(f'Several {kind}s found for {name}: {[str(c) for c in candidates]}')
+    return candidates[0]
+
+
+def find_video(dlc_filepath):
+    folder = upaths['video_path']
+    file_index = load_file_index(folder, '*.avi', recursive=False)
+    return find_file(file_index, Path(dlc_filepath).stem, 'video')
+
+
+def find_dat_file(dlc_filename, poly_folder):
+    file_index = load_file_index(poly_folder, '*.dat', recursive=True)
+    return find_file(file_index, dlc_filename, 'dat file')
+
+
+def check_input_files(data_paths, poly_folder, video_folder=upaths['video_path'], check_videos=True):
+    """
+    Check, before starting a batch, that every DLC file exists and has exactly one dat file
+    and one video. The indexes of the folders are refreshed here.
+
+    Parameters
+    ----------
+    data_paths: iterable of Path
+        DLC files
+    poly_folder: Path or str
+    video_folder: Path or str
+    check_videos: bool
+        If False, the video folder is not read (see trust_dlc in get_video_metadata)
+
+    Returns
+    -------
+    problems: dict
+        {data_path: description of the problem}, only for the files with a problem
+    """
+    dat_index = load_file_index(poly_folder, '*.dat', recursive=True, refresh=True)
+    indexes = [('dat file', dat_index)]
+    if check_videos:
+        indexes.append(('video', load_file_index(video_folder, '*.avi', recursive=False, refresh=True)))
+    problems = {}
+    for data_path in data_paths:
+        data_path = Path(data_path)
+        if not data_path.exists():
+            problems[data_path] = 'DLC file not found'
+            continue
+        for kind, file_index in indexes:
+            candidates = match_file(file_index, data_path.stem)
+            if len(candidates) != 1:
+                problems[data_path] = f'{len(candidates)} {kind}s found {[c.name for c in candidates]}'
+                break
+    return problems
+
+
+GAP_METHODS = ('spline', 'linear', 'local-cubic')
+
+
+def nan_removal(sig: np.ndarray, t: np.ndarray, method='spline', max_gap=None) -> np.ndarray:
+    """
+    Perform an interpolation on a signal to remove missing values
+
+    Parameters
+    ----------
+    sig: np.ndarray
+        Signal with missing values
+    t: np.ndarray
+        Time vector
+    method: str
+        'spline': interpolating spline fitted on the whole signal (slow, can oscillate on long gaps)
+        'linear': straight line between the values around each gap
+        'local-cubic': cubic curve between the values around each gap, with the slopes of the
+        signal on each side of the gap (see fill_gaps)
+    max_gap: int or None
+        Gaps longer than max_gap samples are not filled and stay nan
+
+    Returns
+    -------
+    sig: np.ndarray
+        Signal with interpolated values and no more nans (except in gaps longer than max_gap)
+    """
+    if method not in GAP_METHODS:
+        raise ValueError(f'Unknown gap filling method {method}, use one of {GAP_METHODS}')
+    if method != 'spline':
+        return fill_gaps(sig[:, np.newaxis], t, method, max_gap)[:, 0]
+    sig = sig.copy()
+    is_nan = np.isnan(sig)
+    if not np.any(is_nan):
+        return sig
+    to_fill = is_nan
+    if max_gap is not None:
+        # The gaps longer than max_gap are the runs of nans kept by an opening of max_gap + 1
+        to_fill = is_nan & np.logical_not(morphological_opening(is_nan, max_gap + 1))
+        if not np.any(to_fill):
+            return sig
+    is_not_nan = np.logical_not(is_nan)
+    sig_correct = sig[is_not_nan]
+    t_correct = t[is_not_nan]
+    t_nan = t[to_fill]
+    from scipy.interpolate import splrep, splev
+
+    spline = splrep(t_correct, sig_correct, s=0)
+    sig[to_fill] = splev(t_nan, spline)
+    return sig
+
+
+def fill_gaps(values, t=None, method='linear', max_gap=None):
+    """
+    Fill the nans of all the columns of a 2D array at once, along the first axis, without loops
+    (except for the 'spline' method, column by column with nan_removal).
+    For each missing sample, the valid samples before and after the gap are found with a binary
+    search in the indexes of the valid samples.
+    'local-cubic' is a cubic Hermite interpolation: inside each gap, a cubic curve joins the values
+    on both sides of the gap with the slopes of the signal there, given by the next valid sample
+    away from the gap. Each gap only depends on the 4 samples around it, so a long gap cannot
+    make the whole signal oscillate.
+    Before the first and after the last valid sample, the nearest valid value is used, as in np.interp.
+
+    Parameters
+    ----------
+    values: np.ndarray
+        (n_samples, n_columns) array with missing values
+    t: np.ndarray or None
+        Time of each sample, the index of the samples if None
+    method: str
+        See nan_removal
+    max_gap: int or None
+        Gaps longer than max_gap samples are not filled and stay nan
+
+    Returns
+    -------
+    filled: np.ndarray
+        Copy of values, with the same dtype, with the gaps filled.
+        Columns without any valid value stay nan
+    """
+    if method not in GAP_METHODS:
+        raise ValueError(f'Unknown gap filling method {method}, use one of {GAP_METHODS}')
+    filled = np.array(values)
+    is_nan = np.isnan(filled)
+    if not np.any(is_nan):
+        return filled
+    n_samples = len(filled)
+    t = np.arange(n_samples, dtype=float) if t is None else np.asarray(t, dtype=float)
+    if method == 'spline':
+        for col in range(filled.shape[1]):
+            if not np.all(is_nan[:, col]):
+                filled[:, col] = nan_removal(filled[:, col], t, method, max_gap)
+        return filled
+    # Samples numbered column by column: the valid samples around each missing sample are
+    # found with a binary search, and belong to the same column or to none
+    valid = np.flatnonzero(np.logical_not(is_nan).T)
+    if len(valid) == 0:
+        return filled
+    missing = np.flatnonzero(is_nan.T)
+    col, row = np.divmod(missing, n_samples)
+    ix = np.searchsorted(valid, missing)
+
+    def valid_row(ix_valid, col):
+        """Row of the valid samples number ix_valid if they are in the column col, else -1"""
+        inside = (ix_valid >= 0) & (ix_valid < len(valid))
+        valid_col, vrow = np.divmod(valid[np.clip(ix_valid, 0, len(valid) - 1)], n_samples)
+        return np.where(inside & (valid_col == col), vrow, -1)
+
+    p, q = valid_row(ix - 1, col), valid_row(ix, col)  # Before and after the gap
+    to_fill = (p >= 0) | (q >= 0)
+    if max_gap is not None:
+        to_fill &= (np.where(q < 0, n_samples, q) - p - 1) <= max_gap
+    row, col, ix, p, q = row[to_fill], col[to_fill], ix[to_fill], p[to_fill], q[to_fill]
+    filling = np.empty(len(row))
+    before = p < 0
+    after = q < 0
+    filling[before] = filled[q[before], col[before]]
+    filling[after] = filled[p[after], col[after]]
+    inner = np.logical_not(before | after)
+    t0, t1 = t[p[inner]], t[q[inner]]
+    y0, y1 = filled[p[inner], col[inner]].astype(float), filled[q[inner], col[inner]].astype(float)
+    slope = (y1 - y0) / (t1 - t0)
+    t_nan = t[row[inner]]
+    if method == 'linear':
+        filling[inner] = slope * (t_nan - t0) + y0  # Same operations as np.interp
+    else:
+        # Slopes of the signal around the gap, given by the next valid samples away from the gap
+        ix, col_inner = ix[inner], col[inner]
+        pp, qq = valid_row(ix - 2, col_inner), valid_row(ix + 1, col_inner)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            m0 = np.where(pp >= 0, (y0 - filled[pp, col_inner]) / (t0 - t[pp]), slope)
+            m1 = np.where(qq >= 0, (filled[qq, col_inner] - y1) / (t[qq] - t1), slope)
+        h = t1 - t0
+        s = (t_nan - t0) / h
+        filling[inner] = ((2 * s ** 3 - 3 * s ** 2 + 1) * y0 + (s ** 3 - 2 * s ** 2 + s) * h * m0
+                          + (-2 * s ** 3 + 3 * s ** 2) * y1 + (s ** 3 - s ** 2) * h * m1)
+    filled[row, col] = filling
+    return filled
+
+
+def threshold_tracks(tracks, likelihood_th=0.98, gap_method='spline', max_gap=None):
+    """
+    Threshold on the likelihood and fill the gaps of all the bodyparts of a DLC file in one pass
+
+    Parameters
+    ----------
+    tracks: np.ndarray
+        (n_frames, n_bodyparts, 3) array of x, y, likelihood, as given by open_dlc_tracks
+    likelihood_th: float or sequence of float
+        Threshold value on the likelihood, for all the bodyparts or one per bodypart
+    gap_method, max_gap:
+        How the frames below the threshold are filled, see nan_removal
+
+    Returns
+    -------
+    positions: np.ndarray
+        (n_frames, n_bodyparts, 2) contiguous float32 array of the x and y coordinates
+    dropped: np.ndarray
+        Percentage of the frames of each bodypart below the threshold or without coordinates
+    """
+    # Thresholds in the dtype of the tracks, to compare the likelihoods as likelihoodtreshold does
+    likelihood_th = np.broadcast_to(np.asarray(likelihood_th, dtype=tracks.dtype), tracks.shape[1:2])
+    positions = np.array(tracks[:, :, :2], dtype=np.float32, order='C')
+    positions[tracks[:, :, 2] < likelihood_th] = np.nan
+    is_nan = np.isnan(positions)
+    is_dropped = is_nan[:, :, 0] | is_nan[:, :, 1]
+    dropped = 100 * np.mean(is_dropped, axis=0) if len(positions) else np.zeros(positions.shape[1])
+    if np.any(is_dropped):
+        # x and y of all the bodyparts are the columns of a 2D view
+        n_frames, n_bodyparts, _ = positions.shape
+        filled = fill_gaps(positions.reshape(n_frames, -1), None, gap_method, max_gap)
+        positions = filled.reshape(n_frames, n_bodyparts, 2)
+    return positions, dropped
+
+
+def likelihoodtreshold(dlc_data, show=False, likelihood_th=0.98, gap_method='spline', max_gap=None):
+    """
+    treshold data using likelihood
+    how to run:
+        likelihoodtreshold(dlc_data, show=False, likelihood_th=0.98)
+    
+    Parameters:
+    ----------
+    dlc_data
+    The file to be analised
+    gap_method, max_gap
+    How the frames below the threshold are filled, see nan_removal
+    
+
+    Returns
+    -------
+   The x and y coordenates treshold using the likelood lower than 0.5
+
+    """
+    # Done: Diagnostic plot
+    # treshold according likelihood the outliers track points in xx coordinate
+    # Done: Simplify using masking with boolean arrays
+    data = dlc_data.copy()
+    # data below the likehood treshold replaced by nan
+    data[dlc_data[:, 2] < likelihood_th, :2] = np.nan
+    nan_frames = np.any(np.isnan(data[:, :2]), axis=1)
+    t = np.arange(data.shape[0])
+    data[:, 0] = nan_removal(data[:, 0], t, gap_method, max_gap)  # xx data being interpolated by nan removal function
+    data[:, 1] = nan_removal(data[:, 1], t, gap_method, max_gap)  # xx data being interpolated by nan removal function
+    if show:
+        import matplotlib.pyplot as plt
+
+        plt.plot(data[:, 0], data[:, 1])
+        if np.sum(nan_frames) > 0:
+            plt.plot(data[nan_frames, 0], data[nan_frames, 1], 'rx')
+    return data[:, 0], data[:, 1]
+
+
+def convert_cm(xcoordinate, ycoordinate, xscale=20 / 600, yscale=15 / 450):
+    """
+    convert pixels in cm
+    how to run:
+           convert_cm(xcoordinate, ycoordinate, xscale=20 / 600, yscale=15 / 450)
+    
+    Parameters:
+    ----------
+   xcoordinate
+       coordinate in x axis in pixels
+   ycoordinate
+       coordinate in y axis in pixels
+       
+
+    Returns
+    -------
+   The x and y coordenates in centimeters
+
+    """
+    x_cm = xcoordinate * xscale
+    y_cm = ycoordinate * yscale
+    return x_cm, y_cm
+
+
+# Done: Merge both functions into one
+# Done: Parametrize conversion
+# TODO: Show a frame for user to click on and measure
+
+
+def euclidean_distance(x_cm, y_cm):
+    """
+    calculate eucidean distance
+    how to run:
+        euclidean_distance(x_cm, y_cm)
+
+    Parameters:
+    ----------
+   x_cm
+       coordinate in x axis in centimeters
+   y_cm
+       coordinate in y axis in centimeters
+    
+    
+    Returns
+    -------
+   e_distance
+       The euclidean distance computed using square root of x elevated to 2 +  y elevated to 2 ,
+       where x an y are the difference between pairs of frames in x_cm and y_cm,
+
+    """
+    # calculate the euclidean distance between each pairs of frames
+    x = np.diff(x_cm, axis=0)
+    y = np.diff(y_cm, axis=0)
+    e_distance = np.sqrt((x * x) + (y * y))
+    return e_distance
+
+
+def speed(e_distance, framerate=25):
+    """
+    calculate speed
+    how to run:
+        speed(e_distance, framerate=25)
+    
+    Parameters
+    ----------
+    e_distance
+        the euclidean distance
+    framerate
+    
+
+    Returns
+    -------
+    velocity: np.ndarray
+        the velocity for frame in mm/s
+
+    -------
+
+    """
+    convertcm_mm = 10
+    # Done: Parameter
+    # calculate mean velocity
+    velocity = e_distance / (1 / framerate) * convertcm_mm
+    # Done: Maybe this should be velocity = Edistance / (1 / framerate)
+    return velocity
+
+def distance_function(e_distance):
+    """
+    Parameters
+    ----------
+    e_distance
+
+    Returns
+    -------
+    velocity: np.ndarray
+        the distance in mm
+
+    -------
+
+    """
+    convertcm_mm = 10
+    distance = e_distance * convertcm_mm
+    return distance
+
+
+def is_freezing(e_distance, dist_th=0.02):
+    """
+    Freezing detection based on thresholding the e_distance travelled during a pair of frames
+    how to run:
+        is_freezing(e_distance, dist_th=0.02)
+
+    Parameters
+    ----------
+    e_distance: np.array
+    dist_th: float
+        Distance threshold in cm
+
+    Returns
+    -------
+    freezing: boolean np.ndarray
+        Indicates if the animal is freezing
+
+    """
+    return e_distance < dist_th
+
+
+def sliding_freezing(measure, framerate=25, win_size=1, min_duration=2):
+    """
+    Compute the moving sum of a signal given in input, over a window
+    of size win_size
+
+    Parameters
+    ----------
+    measure: numpy boolean array
+        Boolean array to sum over a sliding window
+    win_size: int
+        Width of the window, in seconds
+        Default to 5
+    min_duration: int
+        Minimum duration during which there must be True's to get a True over a window
+    """
+    win_pts = win_size * framerate
+    min_pts = min_duration * framerate
+    if win_pts > len(measure):
+        # This a special case when input array is shorter than the window
+        # We could: return None, raise an error
+        return np.zeros(measure.shape, dtype=bool)
+    # Summing kernel, here we don't normalize it to get the sum
+    kernel = np.ones(win_pts)
+    # Convolution
+    meas_sum = np.convolve(measure, kernel, 'same')
+    output = (meas_sum > min_pts)
+
+    return output
+
+
+BIN_AGGREGATES = ('sum', 'mean', 'nanmean', 'count')
+
+
+def bin_edges(bin_duration=60, win_duration=20, framerate=25):
+    """
+    Frames limiting the bins of bin_duration seconds in a window of win_duration minutes.
+    The frame rate can be fractional: the limits are rounded to the nearest frame
+
+    Returns
+    -------
+    edges: np.ndarray
+        n_bins + 1 frame indexes, bin i is edges[i]:edges[i + 1]
+    """
+    bin_size = bin_duration * framerate
+    starts = np.arange(0, win_duration * 60 * framerate, bin_size)
+    return np.round(np.append(starts, starts[-1] + bin_size if len(starts) else 0)).astype(int)
+
+
+def bin_measures(measures, edges):
+    """
+    Aggregate several measures in the same bins in one pass: the measures are stacked as the
+    columns of one array, summed bin by bin with np.add.reduceat
+
+    Parameters
+    ----------
+    measures: dict
+        {name: (vector, aggregate)}, vectors of the same length, with aggregate in
+        BIN_AGGREGATES. 'mean' is nan if the bin
+        contains a nan, 'nanmean' ignores them, 'count' is the number of non nan values
+    edges: np.ndarray
+        Sorted frame indexes limiting the bins, e.g. from bin_edges. Bins beyond the end of the
+        vectors are empty
+
+    Returns
+    -------
+    binned: dict
+        {name: np.ndarray of n_bins values}, nan for the empty bins (except for counts)
+    empty_bins: boolean np.ndarray
+    """
+    for _, aggregate in measures.values():
+        if aggregate not in BIN_AGGREGATES:
+            raise ValueError(f'Unknown aggregate {aggregate}, use one of {BIN_AGGREGATES}')
+    n_frames = min((len(vector) for vector, _ in measures.values()), default=0)
+    edges = np.clip(np.asarray(edges, dtype=int), 0, n_frames)
+    counts = np.diff(edges)
+    empty_bins = counts == 0
+    columns = []
+    for vector, aggregate in measures.values():
+        vector = np.asarray(vector[:n_frames], dtype=float)
+        if aggregate in ('sum', 'mean'):
+            columns.append(vector)
+        else:
+            is_nan = np.isnan(vector)
+            columns.append(np.logical_not(is_nan))
+            if aggregate == 'nanmean':
+                columns.append(np.where(is_nan, 0, vector))
+    sums = np.zeros((len(counts), len(columns)))
+    if columns and not np.all(empty_bins):
+        # Consecutive bins: each non empty bin is summed up to the start of the next one
+        stacked = np.column_stack(columns)[:edges[-1]]
+        sums[np.logical_not(empty_bins)] = np.add.reduceat(stacked, edges[:-1][np.logical_not(empty_bins)])
+    binned = {}
+    col = 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for name, (_, aggregate) in measures.items():
+            if aggregate == 'sum':
+                binned[name] = sums[:, col]
+            elif aggregate == 'mean':
+                binned[name] = sums[:, col] / counts
+            elif aggregate == 'count':
+                binned[name] = sums[:, col]
+            else:
+                binned[name] = sums[:, col + 1] / sums[:, col]
+            col += 1 if aggregate in ('sum', 'mean', 'count') else 2
+            if aggregate != 'count':
+                binned[name][empty_bins] = np.nan
+    return binned, empty_bins
+
+
+def binning(measure, bin_duration=60, win_duration=20, framerate=25, agg_func=np.sum):
+    """
+    Bin a variable with a bin duration of 60 seconds, for a window duration of 20 minutes,
+    framerate of 20 and function default sum
+    how to run:
+        binning(velocity, bin_duration=60, win_duration=20, framerate=25, agg_func=np.sum)
+
+
+    Parameters
+    ----------
+    measure: it could be any variable to be analysed by bins - np.ndarray
+    bin_duration :  bin duration of 60 seconds
+    win_duration : duration of the experiment (20 minutes)
+    framerate : frame rate of the videos (25 fps)
+    agg_func : default function. np.sum, np.mean and np.nanmean are computed with bin_measures
+
+    Returns
+    -------
+    arr_meas: bins np.array
+
+    """
+    edges = bin_edges(bin_duration, win_duration, framerate)
+    aggregate = {np.sum: 'sum', np.mean: 'mean', np.nanmean: 'nanmean'}.get(agg_func)
+    if aggregate is not None:
+        binned, _ = bin_measures({'measure': (measure, aggregate)}, edges)
+        return binned['measure']
+    l_meas = []
+    for start, stop in zip(edges[:-1], edges[1:]):
+        binned_meas = measure[start:stop]
+        if len(binned_meas) > 0:
+            binned_measure = agg_func(binned_meas)
+        else:
+            binned_measure = np.nan
+        l_meas.append(binned_measure)
+    arr_meas = np.array(l_meas) 
+    return arr_meas
+
+
+def morphological_opening(mask, window):
+    """
+    Opening of a boolean vector by a flat segment of `window` frames: only the runs of True
+    lasting at least `window` frames are kept. Works in linear time using the run lengths
+    (see bouts.find_bouts).
+
+    Parameters
+    ----------
+    mask: np.ndarray
+        Boolean vector
+    window: int
+        Length of the structuring segment, in frames.
+        If it is smaller than 1 or longer than the vector, there is no complete window and
+        the output is all False
+
+    Returns
+    -------
+    opened: boolean np.ndarray
+    """
+    mask = np.asarray(mask, dtype=bool)
+    opened = np.zeros(mask.shape, dtype=bool)
+    if window < 1 or window > len(mask):
+        return opened
+    bouts = find_bouts(mask)
+    starts, stops = bouts['starts'], bouts['ends']
+    keep = bouts['durations'] >= window
+    # Paint the kept runs with a cumulative sum of +1 at starts and -1 at stops
+    delta = np.zeros(len(mask) + 1, dtype=int)
+    delta[starts[keep]] = 1
+    delta[stops[keep]] = -1
+    opened = np.cumsum(delta[:-1]) > 0
+    return opened
+
+
+def morphological_closing(mask, window):
+    """
+    Closing of a boolean vector by a flat segment of `window` frames: the runs of False
+    shorter than `window` frames are filled with True. Dual of morphological_opening.
+
+    Parameters
+    ----------
+    mask: np.ndarray
+        Boolean vector
+    window: int
+        Length of the structuring segment, in frames
+
+    Returns
+    -------
+    closed: boolean np.ndarray
+    """
+    mask = np.asarray(mask, dtype=bool)
+    return np.logical_not(morphological_opening(np.logical_not(mask), window))
+
+
+def minimum_freeze_duration(freezing, window_MFD):
+    """
+    Apply a Minimum Freeze Duration: a frame is kept as freezing only if it belongs to a
+    window of `window_MFD` consecutive frames that are all freezing
+
+    Parameters
+    ----------
+    freezing: boolean np.ndarray
+    window_MFD: int
+        MFD in frames
+
+    Returns
+    -------
+    freezing: boolean np.ndarray
+    """
+    return morphological_opening(freezing, window_MFD)
+
+
+def minimum_activity_duration(freezing, window_MAD):
+    """
+    Apply a Minimum Activity Duration: a frame is considered as not freezing only if it belongs
+    to a window of `window_MAD` consecutive frames that are all not freezing
+
+    Parameters
+    ----------
+    freezing: boolean np.ndarray
+    window_MAD: int
+        MAD in frames
+
+    Returns
+    -------
+    freezing: boolean np.ndarray
+    """
+    return morphological_closing(freezing, window_MAD)
+
+
+def freezing_periods(is_freezed, min_duration=2, framerate=25, bouts=None):
+    """
+    Freezing periods longer than min_duration
+
+    Parameters
+    ----------
+    is_freezed: boolean np.ndarray
+    min_duration: float
+        In seconds
+    bouts: dict or None
+        Bouts of is_freezed, if already computed with find_bouts
+
+    Returns
+    -------
+    periods: np.ndarray
+        (n_periods, 2) array with the first frame of each period and the frame after its last frame
+    """
+    if bouts is None:
+        bouts = find_bouts(is_freezed)
+    return long_bouts(bouts, min_duration * framerate)
+
+
+# Windows of the session, in minutes, where the durations of the freezing events are measured
+LENGTHS_WINDOWS = {
+    # 'off': (0, 3),  # OFF PERIOD
+    # 'on': (3, 8),  # ON PERIOD
+    # 'first_off': (0, 1),  # OFF PERIOD (1st min)
+    'last_off': (2, 3),  # OFF PERIOD (last min)
+    'first_on': (3, 4),  # ON PERIOD (1st min)
+}
+
+
+def freezing_bouts(freezing, framerate=25, windows=LENGTHS_WINDOWS):
+    """
+    Statistics of the freezing events in some windows of the session, see bouts.bout_statistics.
+    A freezing event overlapping the limit of a window is cut
+
+    Parameters
+    ----------
+    freezing: boolean np.ndarray
+        Can be a memmap: only the frames up to the end of the last window are read
+    framerate: int
+    windows: dict
+        {name: (beginning, end)} in minutes
+
+    Returns
+    -------
+    stats: dict
+        {name: {'lengths', 'n_bouts', 'mean', 'median', 'hist'}}
+    """
+    frames = {name: (round(begining * 60 * framerate), round(ending * 60 * framerate))
+              for name, (begining, ending) in windows.items()}
+    stop = max((ending for _, ending in frames.values()), default=0)
+    return bout_statistics(find_bouts(freezing[:stop]), frames, framerate)
+
+
+def freezing_lengths(freezing, framerate=25, bout_stats=None):
+    """
+    Durations of the freezing events in some periods of the session
+
+    Parameters
+    ----------
+    freezing: boolean np.ndarray
+    framerate: int
+    bout_stats: dict or None
+        Output of freezing_bouts, if already computed
+
+    Returns
+    -------
+    my_dicts: dict
+        {'lengths_<period>': [list of the durations in seconds of the freezing events]}
+    """
+    if bout_stats is None:
+        bout_stats = freezing_bouts(freezing, framerate)
+    return {f'lengths_{name}': [stats['lengths'].tolist()] for name, stats in bout_stats.items()}
+
+
+def add_bout_measurements(res, bout_stats):
+    """
+    Number, mean and median duration (s) and histogram of the durations of the freezing events
+    in each window of freezing_bouts, added to the results
+    """
+    for name, stats in bout_stats.items():
+        res[f'n_bouts_{name}'] = stats['n_bouts']
+        res[f'mean_bout_{name}'] = stats['mean']
+        res[f'median_bout_{name}'] = stats['median']
+        res[f'bout_hist_{name}'] = stats['hist']
+
+
+def save_freezing_lengths(my_dicts, mouse_id, lengths_path=upaths['lengths_path']):
+    """
+    Save the durations of the freezing events of a mouse, as computed by freezing_lengths,
+    in a CSV file along with the information about the mouse
+
+    Parameters
+    ----------
+    my_dicts: dict
+    mouse_id: dict
+        Row of the mice file. It is updated with my_dicts
+    lengths_path: str or Path
+        Folder of the freezing lengths files
+    """
+    mouse_id.update(my_dicts)
+    lengths_df = pd.DataFrame.from_dict(mouse_id)
+    
+    filename = 'lengths_' + str(mouse_id['file']) + '.csv'
+    filepath = Path(lengths_path) / filename
+    lengths_df.to_csv(filepath, index=False)
+
+
+def freezing_speed_quantif(e_distance, velocity, distance_var, dist_th=0.02, framerate=25,
+                           bin_duration=60, win_duration=20, min_duration=0.5, show=False,
+                           MFD=None, MAD=None, mouse_id='mouse_id'):
+    """
+    Freezing and speed quantification
+    How to run:
+        freezing_speed_quantif(e_distance, velocity, dist_th=0.02, framerate=25,
+                           bin_duration=60, win_duration=20, show=False)
+
+    Parameters
+    ----------
+    e_distance : instantant eucleadian distance - np. array
+    velocity : instant velocity - np.array
+    dist_th : freezing threshold (0.02)
+    framerate : frame rate of the videos (25 fps)
+    bin_duration : bin duration of 60 seconds
+    win_duration : duration of the experiment (20 minutes)
+    min_duration (MFD): float
+        Minimum duration of immobility, in seconds, before it is considered freezing
+    show: boolean
+        Plot or not? Default to False
+    MFD: float or None
+        Minimum Freeze Duration in seconds: shorter freezing events are dropped
+        (see minimum_freeze_duration). Not applied if None
+    MAD: float or None
+        Minimum Activity Duration in seconds: shorter movements between freezing events are
+        counted as freezing (see minimum_activity_duration). Not applied if None
+
+    Returns
+    -------
+    res: dict
+        dur_freezing: Total duration of freezing in seconds (float)
+        freezing_bin : freezing by bins - np.array
+        speed: Velocity - np.ndarray
+        speed_bin : speed by bins - np.array
+        speed_freezing : speed during freezing
+        speed_moving : speed out of the freezing period
+        perc_freezing: Percentage of total time spent freezing - float
+
+    """
+    
+ 
+    n_frames = len(e_distance)
+    freezing = is_freezing(e_distance, dist_th)
+    # freezing = freezing_blocks(freez, framerate)
+    # freezing = sliding_freezing(freez, framerate, win_size=5, min_duration=1)
+    
+    # =============================================================================
+    # Applying a MFD and a MAD to the freezing
+    # =============================================================================   
+    
+    if MFD is not None:
+        freezing = minimum_freeze_duration(freezing, round(MFD * framerate))
+    if MAD is not None:
+        freezing = minimum_activity_duration(freezing, round(MAD * framerate))
+
+    # =============================================================================
+    # Calculating the duration of the freezing events
+    # =============================================================================
+    
+    bout_stats = freezing_bouts(freezing, framerate)
+    my_dicts = freezing_lengths(freezing, framerate, bout_stats)
+
+    
+    # =============================================================================           
+    
+    no_freezing_velocity = velocity.copy()
+    no_freezing_velocity[freezing] = np.nan
+    # All the binned measures at once, nan in the empty bins
+    binned, empty_bins = bin_measures({'freezing': (freezing, 'sum'),
+                                       'speed': (velocity, 'mean'),  # Speed binned
+                                       'distance': (distance_var, 'sum'),  # Distance binned
+                                       'speed_moving': (no_freezing_velocity, 'nanmean')},  #speed moving binned
+                                      bin_edges(bin_duration, win_duration, framerate))
+    n_freezing_frames = binned['freezing']
+    sec_freezing = n_freezing_frames / framerate  # Freezing duration, binned
+    speed_bin = binned['speed']
+    distance_bin = binned['distance']
+    speed_moving_bin = binned['speed_moving']
+    speed_freezing = np.mean(velocity[freezing])
+    speed_moving = np.mean(velocity[np.logical_not(freezing)])
+    perc_freezing = 100 * np.nansum(n_freezing_frames) / n_frames
+    if show:
+        import matplotlib.pyplot as plt
+
+        speed_color = 'darkred'
+        freezing_color = 'darkblue'
+        fig, ax_fr = plt.subplots()
+        t = np.arange(0, win_duration * 60, bin_duration)
+        ax_sp = ax_fr.twinx()
+        ax_fr.plot(t, sec_freezing, c=freezing_color)
+        ax_fr.set_ylabel('Binned time (s)', color=freezing_color)
+        ax_fr.tick_params(axis='y', labelcolor=freezing_color)
+        ax_sp.plot(t, speed_bin, c=speed_color)
+        ax_sp.set_ylabel('Animal velocity (mm/s)', color=speed_color)
+        ax_sp.tick_params(axis='y', labelcolor=speed_color)
+        fig.set_tight_layout(True)
+    res = {'dur_freezing': np.nansum(sec_freezing), 'freezing_bin': sec_freezing*100/bin_duration,
+           'velocity': velocity, 'speed_bin': speed_bin, 'distance_bin': distance_bin, 'speed_freezing': speed_freezing,
+           'speed_moving': speed_moving, 'perc_freezing': perc_freezing, 'speed': np.mean(velocity),
+           'distance': np.sum(e_distance), 'freezing': freezing, 'dist': e_distance,
+           'freeze_periods': freezing_periods(freezing, min_duration=min_duration, framerate=framerate),
+           'speedmoving_bin': speed_moving_bin, } # attention dont call binned variables like speed_moving_bin
+    # being that the function of analyse all data is searching for _bin wil skip this variable because have a _ before_bin
+    add_bout_measurements(res, bout_stats)
+    
+    # res.update(my_dicts)
+    
+    save_freezing_lengths(my_dicts, mouse_id)
+    
+    return res
+
+
+def create_velocity_map(results, bin_size=.5, extent=None):
+    """
+    velocity map, color coded by the color in the x and y map
+    how to run:
+        create_velocity_map(results, bin_size=.5)
+
+    Parameters
+    ----------
+    results: dict
+    bin_size: float
+        In cm (this bin size is the spatial window that we selected to average the speed)
+    extent: tuple or None
+        (xmin, xmax, ymin, ymax) in cm, see spatial_maps.spatial_maps
+
+    Returns
+    -------
+    v_binned:  np.ndarray
+        2D array with average speed for each bin
+
+    """
+    maps = spatial_maps(results['x'], results['y'], results['velocity'], results['freezing'],
+                        bin_size=bin_size, extent=extent)
+    return maps['speed']
+
+
+def split_by_freezing(measurement, freezing):
+    """
+    this function split a variable during freezing and moving periods
+
+    Parameters
+    ----------
+    measurement: np.ndarray
+        variable to be splitted
+    freezing: np.ndarray
+        Boolean variable that contain the information if the animal is in freezing for each frame
+
+    Returns
+    --------
+    averages: dict
+        the average of the variable (in measurement) during freezing and moving
+        {'avg': np.ndarray, 'freezing': np.ndarray, 'moving': np.ndarray}
+
+    -------
+
+    """
+    if len(measurement) == len(freezing) + 1:
+        measurement = measurement[1:]
+    in_freezing = measurement[freezing]  # filter the variable to the moments in freezing
+    out_freezing = measurement[
+        np.logical_not(freezing)]  # filter the variable to the moments moving
+    averages = {'avg': np.nanmean(measurement),  # average of the variable without filters
+                'freezing': np.nanmean(in_freezing),  # average of the variable filtered by freezing
+                'moving': np.nanmean(out_freezing)}  # average of the variable filtered by moving
+    return averages
+
+
+def pose(data_path, poly_folder, dist_th=0.02, mouse=None, xscale=20 / 600, yscale=15 / 450,
+         gap_method='spline', max_gap=None):
+    """
+    Calculate the pose of the animal (each bodyparts distance or all body) during all time
+    or splited by freezing or moving time
+    how to run:
+        create_velocity_map(results, bin_size=.5)
+
+    Parameters
+    ----------
+    data_path: variable to be splitted
+    dist_th : freezing treshold (0.02)
+    mouse: dict
+        Data already opened with load_mouse. If None, the files are opened here
+    xscale, yscale: float
+        Conversion from pixels to cm, see convert_cm
+    gap_method, max_gap:
+        How the frames below the likelihood threshold are filled, see nan_removal
+
+    Returns
+    --------
+    pose_results: dict.
+
+    """
+    data_path = Path(data_path)
+    if mouse is None:
+        mouse = load_mouse(data_path, poly_folder)
+    bodyparts = ('nose', 'head', 'center', 'tail')  # bodyparts to be extracted
+    part_pairs = list(zip(bodyparts, bodyparts[1:]))  # iterate 2 list to do the pairs of bodyparts
+    bp_pos = {}
+    # interpolate all the bodyparts by likelihood at once and convert coordinate pixels in cm
+    positions, dropped = get_bodyparts(mouse, bodyparts, 0.99, gap_method, max_gap)
+    for i_bp, bp in enumerate(bodyparts):
+        # x, y = likelihoodtreshold(bp_data, show=False, likelihood_th=0.99)
+        x, y = convert_cm(positions[:, i_bp, 0].astype(float), positions[:, i_bp, 1].astype(float),
+                          xscale, yscale)
+        bp_pos[bp] = (x, y)
+
+    bp_dist = {}
+    total_pose = np.zeros(
+        len(bp_pos['nose'][0]) - 1)  # create the total pose with the proper size filled of zeros
+    for pair in part_pairs:  # calculate the euclidean distance between each pair of body parts
         p1 = bp_pos[pair[0]]
         p2 = bp_pos[pair[1]]
         dist = np.sqrt((p1[0] - p2[0]) ** 2 + (p1[1] - p2[1]) ** 2)
@@ -911,271 +1928,1258 @@ def pose(data_path, poly_folder, dist_th=0.02):
         bp_len_freezing[pair] = avgs
     bp_len_freezing['total'] = total_pose_avg
     pose_results = {'bodyparts_lengths': bp_dist, 'animal_length': total_pose,
-                    'pose_freezing': bp_len_freezing}
+                    'pose_freezing': bp_len_freezing, 'dropped_frames': dropped}
     return pose_results
 
 
-def save_data(results, data_file):
+# =============================================================================
+# Results store
+# =============================================================================
+
+RESULTS_VERSION = 1
+
+
+def get_saved_filepaths(data_path):
+    """
+    Paths of the saved results of a DLC file, next to it:
+    a JSON file with the parameters and the summaries (scalars and binned values) and
+    a NPZ file with the full length arrays
+    """
+    data_path = Path(data_path)
+    meta_file = data_path.parent / f'{data_path.stem}.results.json'
+    arrays_file = data_path.parent / f'{data_path.stem}.results.npz'
+    return meta_file, arrays_file
+
+
+def to_json_value(value):
+    """Convert numpy scalars and arrays to values that can be written in a JSON file"""
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    return value
+
+
+def split_results(results, prefix=''):
+    """
+    Split results between summaries (scalars and binned arrays of the first level) and bulk
+    arrays. Nested dictionaries are flattened with '/' in the keys, and their scalars are
+    kept along the arrays.
+
+    Returns
+    -------
+    summary: dict
+    arrays: dict
+        {key: np.ndarray}
+    """
+    summary, arrays = {}, {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            _, nested = split_results(value, prefix=f'{prefix}{key}/')
+            arrays.update(nested)
+        elif prefix == '' and (not isinstance(value, np.ndarray) or '_bin' in key):
+            summary[key] = value
+        else:
+            arrays[f'{prefix}{key}'] = np.asarray(value)
+    return summary, arrays
+
+
+class SavedResults(dict):
+    """
+    Results reloaded from the store. Summaries are loaded at once, arrays only when they are
+    accessed: res['freezing'] reads the array from the NPZ file the first time.
+    Nested dictionaries (e.g. res['pose']) are rebuilt the same way.
+    The arrays not loaded yet are still keys: `in`, len, get, keys, values and items see them,
+    and values, items and get load them.
+    """
+
+    def __init__(self, summary, arrays_file, array_keys):
+        super().__init__(summary)
+        self.summary_keys = list(summary)
+        self.arrays_file = arrays_file
+        self.array_keys = list(array_keys)
+
+    def __missing__(self, key):
+        prefix = f'{key}/'
+        if key in self.array_keys:
+            with np.load(self.arrays_file) as data:
+                value = data[key]
+        elif any(k.startswith(prefix) for k in self.array_keys):
+            value = {}
+            with np.load(self.arrays_file) as data:
+                for k in self.array_keys:
+                    if not k.startswith(prefix):
+                        continue
+                    *parents, leaf = k[len(prefix):].split('/')
+                    node = value
+                    for parent in parents:
+                        node = node.setdefault(parent, {})
+                    node[leaf] = data[k] if data[k].ndim > 0 else data[k][()]
+        else:
+            raise KeyError(key)
+        self[key] = value
+        return value
+
+    def lazy_keys(self):
+        """Keys of the arrays not loaded yet"""
+        keys = dict.fromkeys(k.split('/')[0] for k in self.array_keys)
+        return [key for key in keys if not dict.__contains__(self, key)]
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self.lazy_keys()
+
+    def __iter__(self):
+        # A copy of the keys: loading an array while iterating changes the dictionary
+        return iter(list(dict.keys(self)) + self.lazy_keys())
+
+    def __len__(self):
+        return dict.__len__(self) + len(self.lazy_keys())
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def keys(self):
+        return KeysView(self)
+
+    def values(self):
+        return ValuesView(self)
+
+    def items(self):
+        return ItemsView(self)
+
+    def summary_items(self):
+        """Items of the summary (scalars and binned arrays), without loading the arrays"""
+        return [(key, dict.__getitem__(self, key)) for key in self.summary_keys]
+
+    def load_all(self):
+        """Load all the arrays, to get the same dictionary as returned by the analysis"""
+        for key in self.lazy_keys():
+            self[key]
+        return self
+
+
+def save_data(results, data_file, cache_key=None):
+    """
+
+    Parameters
+    ----------
+    results: dict
+        Dictionary with computed data as returned from analyze_mouse
+    data_file: Path
+    cache_key: str
+        Key of the analysis, see get_cache_key
+
+    Returns
+    -------
+    outputfile with all this data, see get_saved_filepaths
+    format .json for the parameters and summaries, .npz for the arrays
+
+    -------
+
+    """
+    # Done: Change name according to raw data file name
+    # create a output file with the data
+
+    meta_file, arrays_file = get_saved_filepaths(data_file)
+    results = dict(results)
+    params = results.pop('params', {})
+    summary, arrays = split_results(results)
+    meta = {'version': RESULTS_VERSION, 'cache_key': cache_key, 'params': params, 'summary': summary,
+            'bins': [k for k, v in summary.items() if isinstance(v, np.ndarray)],
+            'arrays': list(arrays)}
+    # Metadata last: results are only considered once the arrays are complete
+    write_atomically(arrays_file, lambda fp: np.savez(fp, **arrays))
+    write_atomically(meta_file, lambda fp: json.dump(meta, fp, default=to_json_value), 'w')
+
+
+def read_saved_meta(data_path):
+    """
+    Read the metadata of the saved results of a DLC file (parameters and summaries),
+    without touching the arrays
+
+    Returns
+    -------
+    meta: dict or None
+        None if there are no results saved, or if they were saved by another version
+    """
+    meta_file, _ = get_saved_filepaths(data_path)
+    if not meta_file.exists():
+        return None
+    with open(meta_file, 'r') as fp:
+        meta = json.load(fp)
+    if meta.get('version') != RESULTS_VERSION:
+        return None
+    return meta
+
+
+def load_saved_results(data_path, meta=None):
+    """
+    Reload the results saved by save_data
+
+    Parameters
+    ----------
+    data_path: str or Path
+        Path to the DLC file that was analysed
+    meta: dict
+        Metadata if already read with read_saved_meta
+
+    Returns
+    -------
+    res: SavedResults
+        dur_freezing: Total duration of freezing in seconds (float)
+        freezing_bin : freezing by bins - np.array
+        speed: Velocity - np.ndarray
+        speed_bin : speed by bins - np.array
+        speed_freezing : speed during freezing
+        speed_moving : speed out of the freezing period
+        perc_freezing: Percentage of total time spent freezing - float
+        x xx coordinates
+        y yy cooordinates
+        time timecourse
+        pose length of body
+        params parameters of the analysis
+        Arrays (x, y, time, pose...) are read from disk when accessed
+    """
+    if meta is None:
+        meta = read_saved_meta(data_path)
+    _, arrays_file = get_saved_filepaths(data_path)
+    summary = meta['summary']
+    for key in meta['bins']:
+        summary[key] = np.array(summary[key], dtype=float)
+    summary['params'] = meta['params']
+    return SavedResults(summary, arrays_file, meta['arrays'])
+
+
+def load_freezing_data(data_file):
+    """
+    Reload all the computed parameters of a DLC file, arrays included, as saved by save_data
+
+    Parameters
+    ----------
+    data_file: str or Path
+        Path to the DLC file that was analysed
+
+    Returns
+    -------
+    res: dict
+        See load_saved_results
+    """
+    return load_saved_results(data_file).load_all()
+
+
+def validate_saved(data_path, force, cache_key):
+    saved_ok = False
+    res = {}
+    if force:
+        return saved_ok, res
+    meta = read_saved_meta(data_path)
+    if meta is not None and meta['cache_key'] == cache_key:
+        res = load_saved_results(data_path, meta)
+        saved_ok = True
+    return saved_ok, res
+
+
+# =============================================================================
+# Cache keys
+# =============================================================================
+
+# Change it when the analysis changes in a way that is not visible in this file
+# (e.g. a new version of a dependency changes the results)
+ANALYSIS_VERSION = 1
+
+
+# Modules of this folder whose code or defaults change the results, next to this one
+ANALYSIS_MODULES = ('bouts.py', 'events.py', 'polybox.py', 'roi.py', 'spatial_maps.py', 'peth.py')
+
+
+def settings_digest():
+    """
+    SHA1 of the settings of settings.py used by the analysis (frame rate, epoch protocols and
+    stimuli), leaving out the paths of the users
+    """
+    settings = {'video_frame_rate': video_frame_rate, 'epoch_protocols': epoch_protocols,
+                'epoch_protocol': epoch_protocol, 'stimulus_codes': stimulus_codes,
+                'stimulus_durations': stimulus_durations}
+    settings = json.dumps(settings, sort_keys=True, default=to_json_value)
+    return hashlib.sha1(settings.encode()).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def code_digest():
+    """
+    SHA1 of the source of this module, of ANALYSIS_MODULES and of the analysis settings: any
+    change of the analysis code or of the defaults of settings.py invalidates the cache.
+    Computed once per process
+    """
+    folder = Path(__file__).parent
+    sha = hashlib.sha1(file_digest(__file__).encode())
+    for module in ANALYSIS_MODULES:
+        sha.update(file_digest(folder / module).encode())
+    sha.update(settings_digest().encode())
+    return sha.hexdigest()
+
+
+FILE_DIGESTS = {}  # In-memory copy of the digests of the input files, by path
+
+
+def get_file_digests_path(cache_path=upaths['cache_path']):
+    return Path(cache_path) / 'file_digests.json'
+
+
+def load_file_digests():
+    """
+    Digests of the input files already read, from the cache folder on first use
+
+    Returns
+    -------
+    known: dict
+        {file path: {'signature': [size, mtime], 'sha1': str}}
+    """
+    if not FILE_DIGESTS:
+        try:
+            with open(get_file_digests_path(), 'r') as fp:
+                FILE_DIGESTS.update(json.load(fp))
+        except (OSError, ValueError):
+            pass
+    return FILE_DIGESTS
+
+
+def save_file_digests():
+    digests_path = get_file_digests_path()
+    try:
+        digests_path.parent.mkdir(parents=True, exist_ok=True)
+        write_atomically(digests_path, lambda fp: json.dump(FILE_DIGESTS, fp), mode='w')
+    except OSError as err:
+        warnings.warn(f'Could not save the digests of the input files in {digests_path}: {err}')
+
+
+def cached_file_digest(file_path):
+    """
+    SHA1 of an input file (dat, DLC or ROI file), kept by path, size and modification time in
+    memory and in the cache folder: the file is only read again when one of them changed
+    """
+    file_path = Path(file_path)
+    stat = file_path.stat()
+    signature = [stat.st_size, stat.st_mtime]
+    known = load_file_digests()
+    cached = known.get(str(file_path))
+    if cached is not None and cached['signature'] == signature:
+        return cached['sha1']
+    sha1 = file_digest(file_path)
+    known[str(file_path)] = {'signature': signature, 'sha1': sha1}
+    save_file_digests()
+    return sha1
+
+
+def dlc_digest(data_path):
+    """
+    SHA1 of a DLC file, taken from its binary copy (see convert_dlc_file) when the CSV file did
+    not change since, to avoid reading it again
+    """
+    data_path = Path(data_path)
+    _, meta_file = get_tracks_filepaths(data_path)
+    if meta_file.exists():
+        with open(meta_file, 'r') as fp:
+            meta = json.load(fp)
+        stat = data_path.stat()
+        if meta['size'] == stat.st_size and meta['mtime'] == stat.st_mtime:
+            return meta['sha1']
+    return cached_file_digest(data_path)
+
+
+def get_cache_key(data_path, poly_folder, parameters):
+    """
+    Key identifying an analysis: every parameter, the content of the input files (DLC and dat
+    files, frame rate and number of frames of the video, ROI file) and the version of the analysis code.
+    Saved results are only reused if their key is the same.
+    The input files are only read again when their size or modification time changed (see
+    cached_file_digest), and the video only when it changed (see read_video_metadata).
+
+    Parameters
+    ----------
+    data_path: Path
+        DLC file
+    poly_folder: Path or str
+        Folder with the dat files
+    parameters: dict
+        All the parameters of analyze_mouse
+
+    Returns
+    -------
+    cache_key: str
+    """
+    frame_rate, n_frames = get_video_metadata(data_path, parameters.get('trust_dlc', False))
+    key = {'version': ANALYSIS_VERSION, 'code': code_digest(), 'parameters': parameters,
+           'dlc': dlc_digest(data_path),
+           'dat': cached_file_digest(find_dat_file(data_path.stem, Path(poly_folder))),
+           'video': [frame_rate, n_frames]}
+    roi_path = find_roi_file(data_path)
+    if roi_path is not None:
+        key['rois'] = cached_file_digest(roi_path)
+    key = json.dumps(key, sort_keys=True, default=to_json_value)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def get_epochs(protocol=None):
+    """
+    Definition of the epochs of a protocol, from epoch_protocols in settings.py
+
+    Parameters
+    ----------
+    protocol: str or None
+        None for epoch_protocol of settings.py
+
+    Returns
+    -------
+    protocol: str
+    epochs: dict
+        {'windows': {name: (start, end)}, 'groups': {name: [window names]}}, and 'events' for
+        the protocols whose windows of the stimuli are read from the dat files, see mouse_epochs
+    """
+    protocol = epoch_protocol if protocol is None else protocol
+    if protocol not in epoch_protocols:
+        raise ValueError(f'Unknown protocol {protocol}, add it to epoch_protocols in settings.py '
+                         f'(known protocols: {", ".join(epoch_protocols)})')
+    return protocol, epoch_protocols[protocol]
+
+
+def mouse_stimuli(mouse, parameters):
+    """
+    Onsets and offsets of the stimuli of a mouse loaded with load_mouse, see events.stimulus_times
+    """
+    return stimulus_times(mouse['event_times'], parameters['stimulus_codes'], parameters['stimulus_durations'])
+
+
+def mouse_epochs(epochs, stimuli):
+    """
+    Epochs of one session: those of the protocol, with the windows of its stimuli if the protocol
+    has 'events' (see events.event_epochs)
+
+    Parameters
+    ----------
+    epochs: dict
+        See get_epochs
+    stimuli: dict
+        See mouse_stimuli
+    """
+    if 'events' not in epochs:
+        return epochs
+    return event_epochs(stimuli, epochs['events'], epochs.get('windows'), epochs.get('groups'))
+
+
+def row_protocol(mouse_id):
+    """
+    Protocol given in the 'protocol' column of the mice file, None if there is none or if it is
+    not one of epoch_protocols (the column can also hold other names, e.g. habituation)
+    """
+    protocol = mouse_id.get('protocol') if isinstance(mouse_id, dict) else None
+    if protocol is None or pd.isna(protocol) or str(protocol) not in epoch_protocols:
+        return None
+    return str(protocol)
+
+
+def epoch_measurements(time, freezing, framerate, epochs):
+    """
+    Duration and percentage of freezing of all the windows and groups of windows of a protocol.
+    The limits of the windows are found with np.searchsorted in the time vector, and the number
+    of freezing frames before each limit with one np.add.reduceat over the freezing vector, so
+    the cost hardly depends on the number of windows.
+    As with slice_measurement, a window stops at the last frame of the recording
+
+    Parameters
+    ----------
+    time: np.ndarray
+        Time of each position (can be a memmap)
+    freezing: boolean np.ndarray
+        Can be a memmap
+    framerate: float
+    epochs: dict
+        {'windows': {name: (start, end)}, 'groups': {name: [window names]}}, see get_epochs
+
+    Returns
+    -------
+    measurements: dict
+        time_<name> in seconds and meas_<name> in percentage, for each window and group
+    """
+    windows = epochs['windows']
+    groups = epochs.get('groups', {})
+    n_times, n_frames = len(time), len(freezing)
+    last = time[n_times - 1] if n_times else 0
+    limits = np.array([[start, last if end is None else end] for start, end in windows.values()], dtype=float)
+    limits = np.searchsorted(time, limits.ravel()).reshape(limits.shape) if len(windows) else np.zeros((0, 2), int)
+    # Number of freezing frames before each limit
+    points = np.unique(np.clip(np.append(limits.ravel(), 0), 0, n_frames))
+    starts = points[points < n_frames]
+    counts = np.add.reduceat(freezing, starts, dtype=np.int64) if len(starts) else np.zeros(0, np.int64)
+    cumulated = np.append(0, np.cumsum(counts))
+    n_freezing = cumulated[np.searchsorted(points, np.clip(limits, 0, n_frames))]
+    n_freezing = np.maximum(n_freezing[:, 1] - n_freezing[:, 0], 0)
+    durations = np.maximum(np.diff(np.clip(limits, 0, n_times), axis=1)[:, 0], 0)
+    sec = {name: (durations[i] / framerate, n_freezing[i] / framerate) for i, name in enumerate(windows)}
+    for group, names in groups.items():
+        sec[group] = (sum(sec[name][0] for name in names), sum(sec[name][1] for name in names))
+    measurements = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for name, (duration, sec_freezing) in sec.items():
+            measurements[f'time_{name}'] = duration
+            measurements[f'meas_{name}'] = np.float64(sec_freezing) / duration * 100
+    return measurements
+
+
+def add_epoch_measurements(res, framerate, epochs=None):
+    """
+    Add to the results the time (time_*) and the percentage of freezing (meas_*) of the
+    periods of the protocols
+
+    Parameters
+    ----------
+    res: dict
+        Results of analyze_mouse, with time and freezing, and events for the protocols with
+        windows read from the dat files
+    framerate: int
+    epochs: dict or None
+        Windows and groups of the protocol, see get_epochs. None for the default protocol
+    """
+    if epochs is None:
+        _, epochs = get_epochs()
+    epochs = mouse_epochs(epochs, res.get('events', {}))
+    res.update(epoch_measurements(res['time'], res['freezing'], framerate, epochs))
+
+
+def analyze_mouse(data_path, poly_folder, bodypart='center', likelihood_th=0.98,
+                  dist_th=0.02, bin_duration=10, win_duration=20, min_duration=2, force=False,
+                  mouse_id='mouse_id', MFD=None, MAD=None, xscale=20 / 600, yscale=15 / 450,
+                  chunk_size=None, trust_dlc=False, gap_method=None, max_gap=None, protocol=None):
+    if chunk_size is not None:
+        # Very long recordings: see analyze_mouse_chunked. Gaps can only be filled linearly
+        if gap_method not in (None, 'linear'):
+            raise ValueError('The chunked analysis only fills the gaps linearly')
+        return analyze_mouse_chunked(data_path, poly_folder, bodypart, likelihood_th, dist_th,
+                                     bin_duration, win_duration, min_duration, force, mouse_id,
+                                     MFD, MAD, xscale, yscale, chunk_size, trust_dlc, protocol, max_gap)
+    data_path = Path(data_path)
+    if not data_path.exists():
+        return {}
+    parameters = {'bodypart': bodypart, 'likelihood_th': likelihood_th, 'dist_th': dist_th,
+                  'bin_duration': bin_duration, 'win_duration': win_duration,
+                  'min_duration': min_duration, 'MFD': MFD, 'MAD': MAD,
+                  'xscale': xscale, 'yscale': yscale, 'trust_dlc': trust_dlc,
+                  'gap_method': gap_method or 'spline', 'max_gap': max_gap}
+    parameters['protocol'], parameters['epochs'] = get_epochs(protocol)
+    parameters['stimulus_codes'], parameters['stimulus_durations'] = stimulus_codes, stimulus_durations
+    cache_key = get_cache_key(data_path, poly_folder, parameters)
+    saved_ok, res = validate_saved(data_path, force, cache_key)
+    if saved_ok:
+        return res
+    mouse = load_mouse(data_path, poly_folder, trust_dlc=trust_dlc)
+    framerate = mouse['frame_rate']
+    positions, dropped = get_bodyparts(mouse, [bodypart], likelihood_th, parameters['gap_method'], max_gap)
+    x = positions[:, 0, 0].astype(float)
+    y = positions[:, 0, 1].astype(float)
+    dt = 1 / framerate
+    time = np.arange(0, x.shape[0] * dt, dt)
+    x, y = convert_cm(x, y, xscale, yscale)
+    dist = euclidean_distance(x, y)
+    velocity = speed(dist, framerate)
+    distance_var = distance_function(dist)
+    res = freezing_speed_quantif(dist, velocity, distance_var, dist_th, framerate, bin_duration, win_duration,
+                                 min_duration, MFD=MFD, MAD=MAD, mouse_id=mouse_id)
+    # Add coordinates into result dictionary
+    res['x'] = x
+    res['y'] = y
+    # Also, time
+    res['time'] = time
+    # Onsets and offsets of the stimuli, in seconds
+    res['events'] = mouse_stimuli(mouse, parameters)
+    #add a slice of freezing # meas variable in percentage # time variable duration of the slice
+    add_epoch_measurements(res, framerate, parameters['epochs'])
+
+    # Time in the regions of interest, if there is an ROI file for this mouse
+    roi_path = find_roi_file(data_path)
+    if roi_path is not None:
+        roi_stats = roi_measurements(mouse, load_rois(roi_path), likelihood_th, parameters['gap_method'], max_gap,
+                                     bin_edges(bin_duration, win_duration, framerate))
+        add_roi_measurements(res, roi_stats)
+    # Pose analysis
+    pose_res = pose(data_path, poly_folder, dist_th, mouse=mouse, xscale=xscale, yscale=yscale,
+                    gap_method=parameters['gap_method'], max_gap=max_gap)
+    res['pose'] = pose_res
+    fused_pose = merge_pose_freezing(pose_res['pose_freezing'])
+    for k, v in fused_pose.items():
+        res[k] = v
+    add_dropped_frames(res, dropped[bodypart], pose_res['dropped_frames'])
+    # Occupancy, speed and freezing maps, with the same bins for all the mice
+    res['maps'] = spatial_maps(x, y, velocity, res['freezing'], framerate,
+                               extent=arena_extent(xscale=xscale, yscale=yscale))
+
+    # The limits of the bins in seconds, see bin_records
+    parameters['frame_rate'], parameters['n_frames'] = framerate, len(dist)
+    res['params'] = parameters
+    save_data(res, data_path, cache_key)
+    return res
+
+
+def add_dropped_frames(res, dropped_main, dropped_pose):
+    """
+    Quality control: percentage of the frames below the likelihood threshold (filled by
+    interpolation) for the main bodypart and for the bodyparts of the pose, as scalars of the results
+    """
+    res['dropped_frames'] = dropped_main
+    for bp, pct in dropped_pose.items():
+        res[f'dropped_frames_{bp}'] = pct
+
+
+def merge_pose_freezing(pose_freezing):
+    """
+    dictionary fusing the pose data, reduction of hierarchy
+    (Pose-> head -> avg   will be avg_head_pose)
+    Parameters
+    ----------
+    pose_freezing:
+        avg length to each bodypart during freezing and moving
+
+    Returns
+    -------
+    fused: dict
+        the same variables in a dictionary with a reduction of the hierarchy
+    """
+    fused = {}
+    for bodyparts, avgs in pose_freezing.items():
+        for key, value in avgs.items():
+            fused[f'{bodyparts}_{key}'] = value
+    return fused
+
+
+# =============================================================================
+# Chunked analysis of long recordings
+# =============================================================================
+
+def iter_dlc_chunks(data_path, bodyparts, chunk_size=20000):
+    """
+    Read the DLC file by blocks of frames, from its binary copy if it is up to date or else
+    from the csv file, so that the whole file is never in memory
+
+    Parameters
+    ----------
+    data_path: Path or str
+        Path to the DLC file
+    bodyparts: list of str
+        Bodyparts to read
+    chunk_size: int
+        Number of frames of each block
+
+    Returns
+    -------
+    blocks: generator of np.ndarray
+        Arrays of shape (n, len(bodyparts), 3) with (x, y, likelihood) of each bodypart
+    """
+    bodyparts = list(bodyparts)
+    cached_bodyparts, tracks = load_tracks_cache(data_path)
+    if tracks is not None:
+        missing = [bp for bp in bodyparts if bp not in cached_bodyparts]
+        if missing:
+            raise ValueError(f'{missing} not in {cached_bodyparts}')
+        ix = [cached_bodyparts.index(bp) for bp in bodyparts]
+        for start in range(0, tracks.shape[0], chunk_size):
+            yield np.asarray(tracks[start:start + chunk_size, ix, :])
+        return
+    columns, n_header = read_dlc_header(data_path)
+    cols = dlc_columns(columns, bodyparts)
+    reader = pd.read_csv(data_path, header=None, skiprows=n_header, usecols=cols,
+                         dtype=np.float64, chunksize=chunk_size)
+    for block in reader:
+        yield block[cols].to_numpy().reshape((-1, len(bodyparts), 3))
+
+
+# Longest gap filled in chunked mode when no max_gap is given, in frames (10 min at 25 fps).
+# Longer gaps are a bodypart hidden for a long time rather than a tracking error
+CHUNKED_MAX_GAP = 15000
+
+
+def fill_gaps_chunk(values, carry=None, final=False, max_gap=None):
+    """
+    Linear interpolation of the nans of a block of rows, continuing the previous blocks.
+    The rows after the last valid value of a column cannot be filled until the next valid value
+    is read: they are kept in the carry and returned with a later block. When a gap is already
+    longer than max_gap rows, it stays nan whatever comes next and its rows are returned at once,
+    so that at most max_gap rows are kept (e.g. for a bodypart hidden for a long time).
+    Over the whole signal, the result is the same as fill_gaps(values, None, 'linear', max_gap).
+
+    Parameters
+    ----------
+    values: np.ndarray
+        Block of shape (n_rows, n_columns), with nans where values are missing
+    carry: dict or None
+        State returned by the previous call, None for the first block
+    final: bool
+        Last call: all the rows still kept are returned, the trailing nans take the last valid value
+    max_gap: int or None
+        Gaps longer than max_gap rows are not filled and stay nan.
+        If None, all the gaps are filled and the rows of a column without any valid value are
+        kept until the last call
+
+    Returns
+    -------
+    filled: np.ndarray
+        Filled rows, following the ones returned by the previous calls
+    carry: dict
+        State to pass to the next call
+    """
+    if carry is None:
+        carry = {'pending': values[:0], 'start': 0,
+                 'last_t': np.full(values.shape[1], np.nan), 'last_v': np.full(values.shape[1], np.nan)}
+    buf = np.concatenate((carry['pending'], values))
+    start = carry['start']
+    end = start + len(buf)
+    valid = np.logical_not(np.isnan(buf))
+    last_valid = np.max(np.where(valid, np.arange(len(buf))[:, np.newaxis], -1), axis=0, initial=-1)
+    has_valid = last_valid >= 0
+    # Open gap at the end of the block, counted from the last valid row (-1 before any)
+    previous_t = np.where(has_valid, start + last_valid, np.nan_to_num(carry['last_t'], nan=-1))
+    too_long = np.zeros(buf.shape[1], dtype=bool) if max_gap is None else (end - previous_t - 1) > max_gap
+    if final:
+        n_out = len(buf)
+    else:
+        n_out = int(np.min(np.where(too_long, len(buf), last_valid + 1), initial=len(buf)))
+    filled = buf[:n_out].copy()
+    last_t = carry['last_t'].copy()
+    last_v = carry['last_v'].copy()
+    for c in range(buf.shape[1]):
+        ix_valid, = np.nonzero(valid[:, c])
+        ix_nan, = np.nonzero(np.logical_not(valid[:n_out, c]))
+        t_valid = start + ix_valid.astype(float)
+        v_valid = buf[ix_valid, c].astype(float)
+        if not np.isnan(last_t[c]):
+            t_valid = np.hstack((last_t[c], t_valid))
+            v_valid = np.hstack((last_v[c], v_valid))
+        if len(ix_nan) and len(t_valid):
+            t_nan = start + ix_nan
+            filled[ix_nan, c] = np.interp(t_nan, t_valid, v_valid)
+            if max_gap is not None:
+                # Length of the gap of each nan: from the valid row before (-1 if none) to the
+                # valid row after (the end of the signal if none, or still open)
+                ix = np.searchsorted(t_valid, t_nan)
+                before = np.where(ix > 0, t_valid[np.maximum(ix - 1, 0)], -1)
+                after = np.where(ix < len(t_valid), t_valid[np.minimum(ix, len(t_valid) - 1)],
+                                 end if final else np.inf)
+                filled[ix_nan[after - before - 1 > max_gap], c] = np.nan
+        returned = ix_valid[ix_valid < n_out]
+        if len(returned):
+            last_t[c] = start + returned[-1]
+            last_v[c] = buf[returned[-1], c]
+    carry = {'pending': buf[n_out:], 'start': start + n_out, 'last_t': last_t, 'last_v': last_v}
+    return filled, carry
+
+
+def opening_chunk(mask, window, carry=None, final=False):
+    """
+    morphological_opening of a block of a boolean vector, continuing the previous blocks.
+    A run of True reaching the end of the block is kept in the carry until it ends or lasts
+    `window` frames.
+
+    Parameters
+    ----------
+    mask: np.ndarray
+        Block of the boolean vector
+    window: int
+        Length of the structuring segment, in frames
+    carry: dict or None
+        State returned by the previous call, None for the first block
+    final: bool
+        Last call: all the frames still kept are returned
+
+    Returns
+    -------
+    opened: boolean np.ndarray
+        Opened frames, following the ones returned by the previous calls
+    carry: dict
+        State to pass to the next call
+    """
+    if carry is None:
+        carry = {'held': 0, 'run': 0}
+    buf = np.concatenate((np.ones(carry['held'], dtype=bool), np.asarray(mask, dtype=bool)))
+    opened = np.zeros(len(buf), dtype=bool)
+    if window < 1:
+        return opened, carry
+    bouts = find_bouts(buf)
+    starts, stops, lengths = bouts['starts'], bouts['ends'], bouts['durations']
+    if len(starts) and starts[0] == 0:
+        # The first run continues the run open at the end of the previous block
+        lengths[0] += carry['run'] - carry['held']
+    keep = lengths >= window
+    delta = np.zeros(len(buf) + 1, dtype=int)
+    delta[starts[keep]] = 1
+    delta[stops[keep]] = -1
+    opened = np.cumsum(delta[:-1]) > 0
+    n_out = len(buf)
+    carry = {'held': 0, 'run': 0}
+    if not final and len(starts) and stops[-1] == len(buf):
+        if keep[-1]:
+            carry = {'held': 0, 'run': lengths[-1]}
+        else:
+            n_out = starts[-1]
+            carry = {'held': stops[-1] - starts[-1], 'run': lengths[-1]}
+    return opened[:n_out], carry
+
+
+def closing_chunk(mask, window, carry=None, final=False):
+    """
+    morphological_closing of a block of a boolean vector, continuing the previous blocks.
+    See opening_chunk
+    """
+    opened, carry = opening_chunk(np.logical_not(mask), window, carry, final)
+    return np.logical_not(opened), carry
+
+
+def filter_chunked(mask, chunk_filter, window, out, chunk_size=20000):
     """
+    Apply opening_chunk or closing_chunk to a whole vector, by blocks
 
     Parameters
     ----------
-    results: dict
-        Dictionary with computed data as returned from analyze_mouse
-    data_file: Path
+    mask: np.ndarray
+        Boolean vector, can be a memmap
+    chunk_filter: function
+        opening_chunk or closing_chunk
+    window: int
+        Length of the structuring segment, in frames
+    out: np.ndarray
+        Boolean vector of the same length where to write the result, can be a memmap
 
     Returns
     -------
-    outputfile with all this data
-    format .npz
+    out: np.ndarray
+    """
+    carry = None
+    cursor = 0
+    for start in range(0, len(mask) + 1, chunk_size):
+        final = start + chunk_size > len(mask)
+        filtered, carry = chunk_filter(mask[start:start + chunk_size], window, carry, final)
+        out[cursor:cursor + len(filtered)] = filtered
+        cursor += len(filtered)
+    return out
 
-    -------
 
+def scratch_array(folder, name, shape, dtype=float):
     """
-    # Done: Change name according to raw data file name
-    # create a output file with the data
+    Array backed by a .npy file in folder, to keep long vectors out of memory
+    """
+    return np.lib.format.open_memmap(Path(folder) / f'{name}.npy', mode='w+', dtype=dtype,
+                                     shape=tuple(np.atleast_1d(shape)))
+
 
-    output_file = get_saved_filepath(data_file)
-    with open(output_file, 'wb') as pf:
-        pck.dump(results, pf)
+def fill_positions_chunked(mouse, streams, folder, chunk_size=20000, xscale=20 / 600, yscale=15 / 450,
+                           max_gap=None):
+    """
+    Positions in cm of some bodyparts, thresholded by likelihood and gap filled by blocks.
+    The frames missing at the start of the video are nan, as in get_bodypart
 
+    Parameters
+    ----------
+    mouse: dict
+        Output of load_mouse
+    streams: dict
+        {name: (bodypart, likelihood_th)}
+    folder: Path
+        Where the arrays are written
+    max_gap: int or None
+        Longer gaps are not filled, see fill_gaps_chunk
 
-# TODO: Update the docstring
-def load_freezing_data(data_file):
+    Returns
+    -------
+    positions: dict
+        {name: (x, y)} as memmaps of length missing_frames + n_frames
+    dropped: dict
+        {name: percentage of the frames below the threshold}, as in get_bodyparts
+    """
+    bodyparts = sorted({bodypart for bodypart, _ in streams.values()})
+    n_total = mouse['missing_frames'] + mouse['n_frames']
+    positions = {}
+    for name in streams:
+        x = scratch_array(folder, f'{name}_x', n_total)
+        y = scratch_array(folder, f'{name}_y', n_total)
+        x[:mouse['missing_frames']] = np.nan
+        y[:mouse['missing_frames']] = np.nan
+        positions[name] = (x, y)
+    carries = dict.fromkeys(streams)
+    n_dropped = dict.fromkeys(streams, 0)
+    cursors = dict.fromkeys(streams, mouse['missing_frames'])
+    blocks = iter_dlc_chunks(mouse['data_path'], bodyparts, chunk_size)
+    n_read = 0
+    for block in itertools.chain(blocks, [None]):
+        final = block is None
+        if not final:
+            n_read += len(block)
+        for name, (bodypart, likelihood_th) in streams.items():
+            if final:
+                values = np.empty((0, 2))
+            else:
+                bp_data = block[:, bodyparts.index(bodypart)]
+                values = bp_data[:, :2].copy()
+                values[bp_data[:, 2] < likelihood_th, :] = np.nan
+                n_dropped[name] += np.count_nonzero(np.any(np.isnan(values), axis=1))
+            filled, carries[name] = fill_gaps_chunk(values, carries[name], final, max_gap)
+            x_cm, y_cm = convert_cm(filled[:, 0].astype(float), filled[:, 1].astype(float), xscale, yscale)
+            x, y = positions[name]
+            x[cursors[name]:cursors[name] + len(filled)] = x_cm
+            y[cursors[name]:cursors[name] + len(filled)] = y_cm
+            cursors[name] += len(filled)
+    assert n_read == mouse['n_frames']
+    dropped = {name: 100 * n / max(n_read, 1) for name, n in n_dropped.items()}
+    return positions, dropped
+
+
+def quantify_chunked(e_distance, velocity, distance_var, freezing, framerate=25, bin_duration=60,
+                     win_duration=20, min_duration=0.5, chunk_size=20000):
     """
-    Reload computed parameters from NPZ file as saved by the save_data function
+    Same measurements as freezing_speed_quantif, accumulated by blocks of frames
 
     Parameters
     ----------
-    data_file: str or Path
-        PAth to the NPZ file
+    e_distance, velocity, distance_var, freezing: np.ndarray
+        Vectors of the whole session, can be memmaps
 
     Returns
     -------
     res: dict
-        dur_freezing: Total duration of freezing in seconds (float)
-        freezing_bin : freezing by bins - np.array
-        speed: Velocity - np.ndarray
-        speed_bin : speed by bins - np.array
-        speed_freezing : speed during freezing
-        speed_moving : speed out of the freezing period
-        perc_freezing: Percentage of total time spent freezing - float
-        x xx coordinates
-        y yy cooordinates
-        time timecourse
-        pose length of body
-        v_map velocity map
+        See freezing_speed_quantif
     """
-    results = {}
-    with np.load(data_file) as data:
-        for k, v in data.items():
-            results[k] = v
-    return results
+    n_frames = len(e_distance)
+    edges = bin_edges(bin_duration, win_duration, framerate)
+    n_bins = len(edges) - 1
+    acc = {k: np.zeros(n_bins) for k in ('count', 'freezing', 'velocity', 'distance', 'moving', 'n_moving')}
+    totals = dict.fromkeys(('v_freezing', 'n_freezing', 'v_moving', 'n_moving', 'velocity', 'distance'), 0)
+    for start in range(0, n_frames, chunk_size):
+        stop = min(start + chunk_size, n_frames)
+        v = np.asarray(velocity[start:stop])
+        f = np.asarray(freezing[start:stop])
+        frames = np.arange(start, stop)
+        in_bins = (frames >= edges[0]) & (frames < edges[-1])
+        k = np.searchsorted(edges, frames[in_bins], side='right') - 1
+        acc['count'] += np.bincount(k, minlength=n_bins)
+        acc['freezing'] += np.bincount(k, weights=f[in_bins], minlength=n_bins)
+        acc['velocity'] += np.bincount(k, weights=v[in_bins], minlength=n_bins)
+        acc['distance'] += np.bincount(k, weights=distance_var[start:stop][in_bins], minlength=n_bins)
+        moving = np.logical_not(f[in_bins]) & np.logical_not(np.isnan(v[in_bins]))
+        acc['moving'] += np.bincount(k[moving], weights=v[in_bins][moving], minlength=n_bins)
+        acc['n_moving'] += np.bincount(k[moving], minlength=n_bins)
+        totals['v_freezing'] += np.sum(v[f])
+        totals['n_freezing'] += np.count_nonzero(f)
+        totals['v_moving'] += np.sum(v[np.logical_not(f)])
+        totals['n_moving'] += np.count_nonzero(np.logical_not(f))
+        totals['velocity'] += np.sum(v)
+        totals['distance'] += np.sum(e_distance[start:stop])
+    empty_bins = acc['count'] == 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sec_freezing = acc['freezing'] / framerate
+        speed_bin = acc['velocity'] / acc['count']
+        speed_moving_bin = acc['moving'] / acc['n_moving']
+        speed_freezing = totals['v_freezing'] / totals['n_freezing']
+        speed_moving = totals['v_moving'] / totals['n_moving']
+        mean_speed = totals['velocity'] / n_frames
+    distance_bin = acc['distance']
+    for binned in (sec_freezing, speed_bin, distance_bin, speed_moving_bin):
+        binned[empty_bins] = np.nan
+    perc_freezing = 100 * np.nansum(acc['freezing'][np.logical_not(empty_bins)]) / n_frames
+    bouts = find_bouts_chunked(freezing, chunk_size)
+    freeze_periods = freezing_periods(freezing, min_duration, framerate, bouts=bouts)
+    res = {'dur_freezing': np.nansum(sec_freezing), 'freezing_bin': sec_freezing*100/bin_duration,
+           'velocity': velocity, 'speed_bin': speed_bin, 'distance_bin': distance_bin, 'speed_freezing': speed_freezing,
+           'speed_moving': speed_moving, 'perc_freezing': perc_freezing, 'speed': mean_speed,
+           'distance': totals['distance'], 'freezing': freezing, 'dist': e_distance,
+           'freeze_periods': freeze_periods, 'speedmoving_bin': speed_moving_bin, }
+    return res
 
 
-def get_saved_filepath(data_path):
-    output_file = data_path.parent / f'{data_path.stem}.pck'
-    return output_file
+def roi_measurements_chunked(roi_positions, config, folder, framerate=25, xscale=20 / 600, yscale=15 / 450,
+                             edges=None, chunk_size=20000):
+    """
+    Same as roi_measurements, from the positions in cm of fill_positions_chunked: the membership
+    of each ROI is written by blocks in a scratch array
+    """
+    x, y = roi_positions
+    roi_stats = {}
+    for i_roi, roi in enumerate(config['rois']):
+        inside = scratch_array(folder, f'roi_{i_roi}', len(x), dtype=bool)
+        for start in range(0, len(x), chunk_size):
+            stop = min(start + chunk_size, len(x))
+            # Back to pixels, the unit of the ROIs
+            inside[start:stop] = roi_membership(roi, x[start:stop] / xscale, y[start:stop] / yscale)
+        roi_stats[roi['name']] = roi_statistics(inside, framerate, edges)
+    return roi_stats
+
+
+def pose_chunked(positions, folder, n_frames, dist_th=0.02, chunk_size=20000):
+    """
+    Same measurements as pose, computed by blocks of frames
 
+    Parameters
+    ----------
+    positions: dict
+        {bodypart: (x, y)} in cm, for nose, head, center and tail (see fill_positions_chunked)
+    folder: Path
+        Where the arrays are written
+    n_frames: int
+        Number of distances (number of positions - 1)
 
-def validate_saved(data_path, force, parameters):
-    output_file = get_saved_filepath(data_path)
-    saved_ok = False
-    res = {}
-    if not force and output_file.exists():
-        with open(output_file, 'rb') as pf:
-            res = pck.load(pf)
-        saved_ok = True
-        if 'params' in res.keys():
-            for prm_name, value in parameters.items():
-                if res['params'][prm_name] != value:
-                    saved_ok = False
-                    break
-        else:
-            saved_ok = False
-    return saved_ok, res
+    Returns
+    -------
+    pose_results: dict
+        See pose
+    """
+    bodyparts = ('nose', 'head', 'center', 'tail')
+    part_pairs = [f'{bp1}-{bp2}' for bp1, bp2 in zip(bodyparts, bodyparts[1:])]
+    bp_dist = {pair: scratch_array(folder, f'pose_{pair}', n_frames) for pair in part_pairs}
+    total_pose = scratch_array(folder, 'animal_length', n_frames)
+    # Sums and counts of the non nan values, for the averages of split_by_freezing
+    sums = {pair: np.zeros((3, 2)) for pair in part_pairs + ['total']}
+    for start in range(0, n_frames, chunk_size):
+        stop = min(start + chunk_size, n_frames)
+        frames = slice(start + 1, stop + 1)  # Removing first frame, to match freezing length
+        total = np.zeros(stop - start)
+        for pair in part_pairs:
+            p1 = positions[pair.split('-')[0]]
+            p2 = positions[pair.split('-')[1]]
+            dist = np.sqrt((p1[0][frames] - p2[0][frames]) ** 2 + (p1[1][frames] - p2[1][frames]) ** 2)
+            bp_dist[pair][start:stop] = dist
+            total = total + dist
+        total_pose[start:stop] = total
+        center_x, center_y = positions['center']
+        freezing = is_freezing(euclidean_distance(center_x[start:stop + 1], center_y[start:stop + 1]), dist_th)
+        for pair in part_pairs + ['total']:
+            length = total if pair == 'total' else bp_dist[pair][start:stop]
+            valid = np.logical_not(np.isnan(length))
+            for ix, selection in enumerate((valid, valid & freezing, valid & np.logical_not(freezing))):
+                sums[pair][ix] += (np.sum(length[selection]), np.count_nonzero(selection))
+    bp_len_freezing = {}
+    for pair, pair_sums in sums.items():
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = pair_sums[:, 0] / pair_sums[:, 1]
+        bp_len_freezing[pair] = dict(zip(('avg', 'freezing', 'moving'), means))
+    pose_results = {'bodyparts_lengths': bp_dist, 'animal_length': total_pose,
+                    'pose_freezing': bp_len_freezing}
+    return pose_results
 
 
-def analyze_mouse(data_path, poly_folder, bodypart='center', likelihood_th=0.98,
-                  dist_th=0.02, bin_duration=10, win_duration=20, min_duration=2, force=False,
-                  mouse_id='mouse_id'):
+def analyze_mouse_chunked(data_path, poly_folder, bodypart='center', likelihood_th=0.98,
+                          dist_th=0.02, bin_duration=10, win_duration=20, min_duration=2, force=False,
+                          mouse_id='mouse_id', MFD=None, MAD=None, xscale=20 / 600, yscale=15 / 450,
+                          chunk_size=20000, trust_dlc=False, protocol=None, max_gap=None):
+    """
+    Same analysis as analyze_mouse, for recordings too long to be kept in memory.
+    The DLC file is read by blocks of chunk_size frames and the long vectors are written to
+    temporary files, then to the results store, so that only a few blocks are in memory at once.
+    The gaps of the tracking are filled by linear interpolation, instead of the spline of
+    nan_removal, which needs the whole signal. The gaps longer than max_gap frames stay nan,
+    CHUNKED_MAX_GAP if None: the frames of an open gap are kept in memory until it ends.
+
+    Returns
+    -------
+    res: SavedResults
+        Results read back from the results store: the long vectors are only loaded when used
+    """
     data_path = Path(data_path)
-    parameters = {'dist_th': dist_th, 'bin_duration': bin_duration,
-                  'win_duration': win_duration, 'min_duration': min_duration}
-    saved_ok, res = validate_saved(data_path, force, parameters)
-    if saved_ok:
-        return res
     if not data_path.exists():
         return {}
-    _, framerate, _, x, y = open_data(data_path, poly_folder, bodypart, likelihood_th)
-    dt = 1 / framerate
-    time = np.arange(0, x.shape[0] * dt, dt)
-    x, y = convert_cm(x, y)
-    dist = euclidean_distance(x, y)
-    velocity = speed(dist, framerate)
-    distance_var = distance_function(dist)
-    res = freezing_speed_quantif(dist, velocity, distance_var, dist_th, framerate, bin_duration, win_duration,
-                                 min_duration, mouse_id=mouse_id)
-    # Add coordinates into result dictionary
+    parameters = {'bodypart': bodypart, 'likelihood_th': likelihood_th, 'dist_th': dist_th,
+                  'bin_duration': bin_duration, 'win_duration': win_duration,
+                  'min_duration': min_duration, 'MFD': MFD, 'MAD': MAD,
+                  'xscale': xscale, 'yscale': yscale, 'trust_dlc': trust_dlc,
+                  'gap_method': 'linear', 'max_gap': CHUNKED_MAX_GAP if max_gap is None else max_gap}
+    parameters['protocol'], parameters['epochs'] = get_epochs(protocol)
+    parameters['stimulus_codes'], parameters['stimulus_durations'] = stimulus_codes, stimulus_durations
+    cache_key = get_cache_key(data_path, poly_folder, parameters)
+    saved_ok, res = validate_saved(data_path, force, cache_key)
+    if saved_ok:
+        return res
+    mouse = load_mouse(data_path, poly_folder, with_tracks=False, trust_dlc=trust_dlc)
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as folder:
+        # The arrays of the temporary folder are only referenced inside this call, so that
+        # they are closed before the folder is removed
+        run_chunked_analysis(mouse, Path(folder), parameters, cache_key, mouse_id, chunk_size)
+    return load_saved_results(data_path)
+
+
+def run_chunked_analysis(mouse, folder, parameters, cache_key, mouse_id='mouse_id', chunk_size=20000):
+    """
+    Body of analyze_mouse_chunked: compute and save the results of one mouse
+    """
+    framerate = mouse['frame_rate']
+    streams = {'main': (parameters['bodypart'], parameters['likelihood_th'])}
+    streams.update({bp: (bp, 0.99) for bp in ('nose', 'head', 'center', 'tail')})
+    roi_path = find_roi_file(mouse['data_path'])
+    roi_config = None if roi_path is None else load_rois(roi_path)
+    if roi_config is not None:
+        streams['roi'] = (roi_config['bodypart'], parameters['likelihood_th'])
+    positions, dropped = fill_positions_chunked(mouse, streams, folder, chunk_size,
+                                                parameters['xscale'], parameters['yscale'], parameters['max_gap'])
+    x, y = positions.pop('main')
+    dropped_main = dropped.pop('main')
+    roi_positions = positions.pop('roi', None)
+    dropped.pop('roi', None)
+    n_frames = len(x) - 1
+    dist = scratch_array(folder, 'dist', n_frames)
+    velocity = scratch_array(folder, 'velocity', n_frames)
+    distance_var = scratch_array(folder, 'distance_var', n_frames)
+    freezing = scratch_array(folder, 'freezing', n_frames, dtype=bool)
+    for start in range(0, n_frames, chunk_size):
+        stop = min(start + chunk_size, n_frames)
+        block_dist = euclidean_distance(x[start:stop + 1], y[start:stop + 1])
+        dist[start:stop] = block_dist
+        velocity[start:stop] = speed(block_dist, framerate)
+        distance_var[start:stop] = distance_function(block_dist)
+        freezing[start:stop] = is_freezing(block_dist, parameters['dist_th'])
+
+    # Minimum Freeze and Activity Durations, as in freezing_speed_quantif
+    if parameters['MFD'] is not None:
+        freezing = filter_chunked(freezing, opening_chunk, round(parameters['MFD'] * framerate),
+                                  scratch_array(folder, 'freezing_MFD', n_frames, dtype=bool), chunk_size)
+    if parameters['MAD'] is not None:
+        freezing = filter_chunked(freezing, closing_chunk, round(parameters['MAD'] * framerate),
+                                  scratch_array(folder, 'freezing_MAD', n_frames, dtype=bool), chunk_size)
+
+    bout_stats = freezing_bouts(freezing, framerate)
+    my_dicts = freezing_lengths(freezing, framerate, bout_stats)
+    save_freezing_lengths(my_dicts, mouse_id)
+    res = quantify_chunked(dist, velocity, distance_var, freezing, framerate, parameters['bin_duration'],
+                           parameters['win_duration'], parameters['min_duration'], chunk_size)
+    add_bout_measurements(res, bout_stats)
     res['x'] = x
     res['y'] = y
-    # Also, time
+    # Same values as np.arange(0, len(x) * dt, dt)
+    dt = 1 / framerate
+    time = scratch_array(folder, 'time', int(np.ceil(len(x) * dt / dt)))
+    for start in range(0, len(time), chunk_size):
+        stop = min(start + chunk_size, len(time))
+        time[start:stop] = np.arange(start, stop) * dt
     res['time'] = time
-    #add a slice of freezing # meas variable in percentage # time variable duration of the slice
-        
-    
-    # to analyse probe test in SOC or SPC 
-    slice1 = slice_measurement(res['time'], res['freezing'], [180,])
-    res['time_slices1'] = len(slice1[0][0])/framerate
-    res['time_slices2'] = len(slice1[0][1])/framerate
-    res['meas_slices1'] = (((slice1[1][0].sum())/framerate)/res['time_slices1'])*100
-    res['meas_slices2'] = (((slice1[1][1].sum())/framerate)/res['time_slices2'])*100 
-    
-    
-    # to measure boredom, we calculate the freezing in the last 5 min of the habituation phase
-    slice_boredom = slice_measurement(res['time'], res['freezing'], [900,])
-    res['time_slices_boredom'] = len(slice_boredom[0][0])/framerate
-    res['meas_slices_boredom'] = (((slice_boredom[1][0].sum())/framerate)/res['time_slices_boredom'])*100
-
-    # to analyse probe test last 10 seconds OFF, and first 10 seconds ON 
-    slice_1min = slice_measurement(res['time'], res['freezing'], [170,180,190,])
-    res['time_last_10s_off'] = len(slice_1min[0][1])/framerate
-    res['time_first_10s_on'] = len(slice_1min[0][2])/framerate
-    res['meas_last_10s_off'] = (((slice_1min[1][1].sum())/framerate)/res['time_last_10s_off'])*100
-    res['meas_first_10s_on'] = (((slice_1min[1][2].sum())/framerate)/res['time_first_10s_on'])*100
-
-    # to analyse probe test 1st minute OFF, last minute OFF, and 1st minute ON 
-    slice_1min = slice_measurement(res['time'], res['freezing'], [60,120,180,240,300,360])
-    res['time_off_1min'] = len(slice_1min[0][0])/framerate
-    res['time_off_last'] = len(slice_1min[0][2])/framerate
-    res['time_on_1min'] = len(slice_1min[0][3])/framerate
-    res['time_on_last'] = len(slice_1min[0][5])/framerate
-    res['meas_off_1min'] = (((slice_1min[1][0].sum())/framerate)/res['time_off_1min'])*100
-    res['meas_off_last'] = (((slice_1min[1][2].sum())/framerate)/res['time_off_last'])*100
-    res['meas_on_1min'] = (((slice_1min[1][3].sum())/framerate)/res['time_on_1min'])*100
-    res['meas_on_last'] = (((slice_1min[1][5].sum())/framerate)/res['time_on_last'])*100
-
-    # to analyse probe test 2 minute OFF vs 2 minute ON 
-    slice_2min = slice_measurement(res['time'], res['freezing'], [120,180,300,])
-    res['time_off_2min'] = len(slice_2min[0][0])/framerate
-    res['time_on_2min'] = len(slice_2min[0][2])/framerate
-    res['meas_off_2min'] = (((slice_2min[1][0].sum())/framerate)/res['time_off_2min'])*100
-    res['meas_on_2min'] = (((slice_2min[1][2].sum())/framerate)/res['time_on_2min'])*100  
-    
-    # to analyse soc phase (soc1 G1G2 May-2023)
-    slice2 = slice_measurement(res['time'], res['freezing'], [180,210,240,300,330,360,480,510,540,630,660,690,])
-    # to analyse soc phase (soc2 G1G2 May-2023)
-    # slice2 = slice_measurement(res['time'], res['freezing'], [180,210,240,330,360,390,450,480,510,630,660,690,])
-    res['time_off1'] = len(slice2[0][0])/framerate
-    res['time_tone1'] = len(slice2[0][1])/framerate
-    res['time_light1'] = len(slice2[0][2])/framerate
-    res['time_off2'] = len(slice2[0][3])/framerate
-    res['time_tone2'] = len(slice2[0][4])/framerate
-    res['time_light2'] = len(slice2[0][5])/framerate
-    res['time_off3'] = len(slice2[0][6])/framerate
-    res['time_tone3'] = len(slice2[0][7])/framerate
-    res['time_light3'] = len(slice2[0][8])/framerate
-    res['time_off4'] = len(slice2[0][9])/framerate
-    res['time_tone4'] = len(slice2[0][10])/framerate
-    res['time_light4'] = len(slice2[0][11])/framerate
-    # res['time_off5'] = len(slice2[0][12])/framerate
-    
-    res['meas_off1'] = (((slice2[1][0].sum())/framerate)/res['time_off1'])*100
-    res['meas_tone1'] = (((slice2[1][1].sum())/framerate)/res['time_tone1'])*100
-    res['meas_light1'] = (((slice2[1][2].sum())/framerate)/res['time_light1'])*100
-    res['meas_off2'] = (((slice2[1][3].sum())/framerate)/res['time_off2'])*100
-    res['meas_tone2'] = (((slice2[1][4].sum())/framerate)/res['time_tone2'])*100
-    res['meas_light2'] = (((slice2[1][5].sum())/framerate)/res['time_light2'])*100
-    res['meas_off3'] = (((slice2[1][6].sum())/framerate)/res['time_off3'])*100
-    res['meas_tone3'] = (((slice2[1][7].sum())/framerate)/res['time_tone3'])*100
-    res['meas_light3'] = (((slice2[1][8].sum())/framerate)/res['time_light3'])*100
-    res['meas_off4'] = (((slice2[1][9].sum())/framerate)/res['time_off4'])*100
-    res['meas_tone4'] = (((slice2[1][10].sum())/framerate)/res['time_tone4'])*100
-    res['meas_light4'] = (((slice2[1][11].sum())/framerate)/res['time_light4'])*100
-    # res['meas_off5'] = (((slice2[1][12].sum())/framerate)/res['time_off5'])*100
-    
-    res['time_off_all'] =  res['time_off1'] + res['time_off2'] + res['time_off3'] + res['time_off4']
-    res['meas_off_all'] = ( ((slice2[1][0].sum())/framerate) + ((slice2[1][3].sum())/framerate) + 
-                           ((slice2[1][6].sum())/framerate) + ((slice2[1][9].sum())/framerate) ) / res['time_off_all'] * 100
-    
-    
-    res['meas_1st_tone'] = res['meas_tone1']
-    
-    res['time_tone_all'] =  res['time_tone2'] + res['time_tone3'] + res['time_tone4']
-    res['meas_tone_all'] = ( ((slice2[1][4].sum())/framerate) + ((slice2[1][7].sum())/framerate) + 
-                            ((slice2[1][10].sum())/framerate)) / res['time_tone_all'] *100
-    
-    res['time_light_all'] =   res['time_light1'] + res['time_light2'] + res['time_light3'] + res['time_light4']
-    res['meas_light_all'] = ( ((slice2[1][2].sum())/framerate) + ((slice2[1][5].sum())/framerate) + 
-                             ((slice2[1][8].sum())/framerate) + ((slice2[1][11].sum())/framerate))/ res['time_light_all']  * 100
-    
-    
-    # res['time_in_ROI'] = in_ROi(data_path, mice_path, base_path=upaths['datapath'], bp='nose', framerate=25)
-    # Pose analysis
-    pose_res = pose(data_path, poly_folder, dist_th)
+    res['events'] = mouse_stimuli(mouse, parameters)
+    add_epoch_measurements(res, framerate, parameters['epochs'])
+    pose_res = pose_chunked(positions, folder, n_frames, parameters['dist_th'], chunk_size)
+    pose_res['dropped_frames'] = dropped
     res['pose'] = pose_res
     fused_pose = merge_pose_freezing(pose_res['pose_freezing'])
     for k, v in fused_pose.items():
         res[k] = v
-    # v_map = create_velocity_map(res)
-    # res['v_map'] = v_map
-
+    add_dropped_frames(res, dropped_main, dropped)
+    res['maps'] = spatial_maps(x, y, velocity, freezing, framerate,
+                               extent=arena_extent(xscale=parameters['xscale'], yscale=parameters['yscale']),
+                               chunk_size=chunk_size)
+    if roi_config is not None:
+        roi_stats = roi_measurements_chunked(roi_positions, roi_config, folder, framerate, parameters['xscale'],
+                                             parameters['yscale'], bin_edges(parameters['bin_duration'],
+                                                                             parameters['win_duration'], framerate),
+                                             chunk_size)
+        add_roi_measurements(res, roi_stats)
+    parameters['frame_rate'], parameters['n_frames'] = framerate, n_frames
     res['params'] = parameters
-    save_data(res, data_path)
-    return res
+    save_data(res, mouse['data_path'], cache_key)
 
 
-def merge_pose_freezing(pose_freezing):
+def roi_measurements(mouse, config, likelihood_th=0.98, gap_method='spline', max_gap=None, edges=None):
     """
-    dictionary fusing the pose data, reduction of hierarchy
-    (Pose-> head -> avg   will be avg_head_pose)
+    Time spent, entries and latency in each region of interest, see roi.roi_statistics
+
     Parameters
     ----------
-    pose_freezing:
-        avg length to each bodypart during freezing and moving
+    mouse: dict
+        As returned by load_mouse
+    config: dict
+        ROIs in pixels and the bodypart to use, see roi.load_rois
+    likelihood_th, gap_method, max_gap:
+        How the bodypart is thresholded, see get_bodyparts
+    edges: np.ndarray or None
+        Frames limiting the bins, see bin_edges
 
     Returns
     -------
-    fused: dict
-        the same variables in a dictionary with a reduction of the hierarchy
+    roi_stats: dict
+        {ROI name: statistics}
     """
-    fused = {}
-    for bodyparts, avgs in pose_freezing.items():
-        for key, value in avgs.items():
-            fused[f'{bodyparts}_{key}'] = value
-    return fused
+    positions, _ = get_bodyparts(mouse, [config['bodypart']], likelihood_th, gap_method, max_gap)
+    x, y = positions[:, 0, 0], positions[:, 0, 1]
+    return {roi['name']: roi_statistics(roi_membership(roi, x, y), mouse['frame_rate'], edges)
+            for roi in config['rois']}
 
 
-def in_ROi(data_path, mice_path, base_path=upaths['dlcpath'], bp='nose', framerate=25):
-    base_path = Path(base_path)
-    mice_path = Path(mice_path)
-    df = pd.read_csv(mice_path)
-    for ix_row, row in tqdm(df.iterrows()):
-        img_path = base_path / (row['image'] + '.png') #pick the path of each snapshot
-        img = cv2.imread(img_path)
-        xx,yy,ww,hh= cv2.selectROI(img) # extract the xy position of the center of the roi and the weight and height from the center
-        top_left_x = (xx - ww) # top left coordinate in x axis of the roi
-        top_left_y = (yy - hh) # top left coordinate in y axis of the roi
-        top_right_x = (xx + ww) # top right coordinate in x axis of the roi
-        bottom_left_y = (yy + hh) # botton left coordinate in y axis of the roi
-    data_path = Path(data_path) 
-    data = open_data(data_path)
-    x, y = likelihoodtreshold(data)
-    in_roi=[]
-    for ix in x:
-        if ix > top_left_x and ix< top_right_x: #if the coordinate of the animal is higher than top_left_x and lower than top_right_x
-            for iy in y:
-                if iy > top_left_y and iy < bottom_left_y: #also if the coordinate of the animal is higher than top_left_y and lower than bottom_left_y
-                    in_roi.append(1) # I will save the value in the variable in_roi
-                else:
-                    continue
-        else:
-            continue
-    time_in_roi = (len(in_roi))/framerate # time in ROI is the number of frames that the animals was in ROI/framerate
-    return time_in_roi
+def add_roi_measurements(res, roi_stats):
+    """
+    Add the ROI statistics to the results: time_in_<ROI>, entries_<ROI> and latency_<ROI>, and
+    the binned values <ROI>time_bin, <ROI>entries_bin and <ROI>latency_bin (the part of the key before
+    the first _ names the columns of the bins in the table, see flatten_results)
+    """
+    for name, stats in roi_stats.items():
+        res[f'time_in_{name}'] = stats['time']
+        res[f'entries_{name}'] = stats['entries']
+        res[f'latency_{name}'] = stats['latency']
+        column_base = name.replace('_', '')
+        for measure in ('time', 'entries', 'latency'):
+            if f'{measure}_bin' in stats:
+                res[f'{column_base}{measure}_bin'] = stats[f'{measure}_bin']
+
 
+def in_ROi(data_path, poly_folder=upaths['poly'], roi_path=None, likelihood_th=0.98, trust_dlc=False):
+    """
+    Time spent, entries and latency in the regions of interest of a DLC file, without binning.
+    The ROIs are read from a file (see the roi module), no window is opened
+
+    Parameters
+    ----------
+    data_path: Path or str
+        DLC file
+    poly_folder: Path or str
+        Folder with the dat files
+    roi_path: Path or str or None
+        ROI file, if None the one found next to the DLC file (see roi.find_roi_file)
+
+    Returns
+    -------
+    roi_stats: dict
+        {ROI name: {'time', 'entries', 'latency'}}
+    """
+    data_path = Path(data_path)
+    roi_path = find_roi_file(data_path) if roi_path is None else roi_path
+    if roi_path is None:
+        raise FileNotFoundError(f'No ROI file for {data_path.name}')
+    mouse = load_mouse(data_path, poly_folder, trust_dlc=trust_dlc)
+    return roi_measurements(mouse, load_rois(roi_path), likelihood_th)
+
+
+def analyze_mouse_safely(data_path, poly_folder, **kwargs):
+    """
+    Run analyze_mouse, catching any error so that a bad file does not stop a whole batch
+
+    Returns
+    -------
+    results: dict
+        As returned by analyze_mouse, empty if there was an error
+    error: str or None
+        Traceback of the error
+    """
+    try:
+        return analyze_mouse(data_path, poly_folder, **kwargs), None
+    except Exception:
+        return {}, traceback.format_exc()
+
+
+def summarize_mouse_safely(data_path, poly_folder, **kwargs):
+    """
+    Run analyze_mouse_safely and only keep what analyse_all_data needs, so that the worker
+    processes do not send the long vectors of the results back
+
+    Returns
+    -------
+    summary: dict
+        record: row of the table, see flatten_results
+        bins: see bin_records
+    error: str or None
+        Traceback of the error
+    """
+    res, error = analyze_mouse_safely(data_path, poly_folder, **kwargs)
+    return {'record': flatten_results(res), 'bins': bin_records(res)}, error
 
-def analyse_all_data(mice_path, poly_folder=upaths['poly'], base_path=upaths['dlcpath'], force=False):
+
+def analyse_all_data(mice_path, poly_folder=upaths['poly'], base_path=upaths['dlcpath'], force=False,
+                     n_jobs=1, chunk_size=None, trust_dlc=False, gap_method=None, max_gap=None, protocol=None,
+                     formats=('parquet',)):
     """
     Search in a directory csv files and run all the functions inside the for cycle in those files
     export a output_file with FreezingTime,FreezingBinsMin,Velocity,output_file
@@ -1190,11 +3194,31 @@ def analyse_all_data(mice_path, poly_folder=upaths['poly'], base_path=upaths['dl
         Path to the directory where data are to be found
     force: bool
         Recompute or load from disk?
+    n_jobs: int
+        Number of mice analysed in parallel, each one in its own process.
+        -1 to use all the processors
+    chunk_size: int or None
+        If given, analyse the recordings by blocks of chunk_size frames, to bound the memory
+        needed by very long recordings (see analyze_mouse_chunked)
+    trust_dlc: bool
+        Do not read the videos, see get_video_metadata
+    gap_method: str or None
+        How the frames below the likelihood threshold are filled, see nan_removal.
+        None is 'spline', or 'linear' in chunked mode
+    max_gap: int or None
+        Gaps longer than max_gap frames are not filled. None is no limit, or CHUNKED_MAX_GAP in
+        chunked mode. The value used is saved in the 'max_gap' parameter of each mouse
+    protocol: str or None
+        Protocol of the epochs (see get_epochs), for the mice without a value in the 'protocol'
+        column of the mice file. None for epoch_protocol of settings.py
+    formats: tuple of str
+        Formats of the table all_computed_data saved next to the mice file, see tables.save_table
 
     Returns
     -------
     df: pandas.DataFrame
-        Contains input data from the excel file + computed parameters
+        Contains input data from the excel file + computed parameters.
+        If the analysis of some files failed, the error is in the analysis_error column
     -------
 
     """
@@ -1202,17 +3226,64 @@ def analyse_all_data(mice_path, poly_folder=upaths['poly'], base_path=upaths['dl
     # Done: Have a per file framerate (add it to the mice_path file)
     base_path = Path(base_path)
     df = pd.read_csv(mice_path)
-    for ix_row, row in tqdm(df.iterrows()):
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    data_paths = [base_path / (str(f) + '.csv') for f in df['file']]
+    problems = check_input_files(data_paths, poly_folder, check_videos=not trust_dlc)
+    for data_path, problem in problems.items():
+        print(f'Skipping {data_path.name}: {problem}')
+    if n_jobs == 1 and chunk_size is None:
+        # In parallel, each process converts its own files.
+        # In chunked mode, files are read by blocks if not converted yet
+        convert_dlc_files([p for p in data_paths if p not in problems])
+    tasks = {}
+    for ix_row, row in df.iterrows():
         # data_path = base_path / (row['file'] + '.csv') 
         data_path = base_path / (str(row['file']) + '.csv')
+        if data_path in problems:
+            continue
         column_names = df.columns
         row_values = row.values
         mouse_id = dict(zip(column_names, row_values))
-        
-        r = analyze_mouse(data_path, poly_folder, force=force, mouse_id=mouse_id)
-        fill_table(df, ix_row, r)
+        tasks[ix_row] = (data_path, mouse_id)
+
+    results = {}
+    if n_jobs == 1:
+        for ix_row, (data_path, mouse_id) in tqdm(tasks.items()):
+            results[ix_row] = summarize_mouse_safely(data_path, poly_folder, force=force, mouse_id=mouse_id,
+                                                     chunk_size=chunk_size, trust_dlc=trust_dlc,
+                                                     gap_method=gap_method, max_gap=max_gap,
+                                                     protocol=row_protocol(mouse_id) or protocol)
+    else:
+        if not trust_dlc:
+            probe_videos([data_path for data_path, _ in tasks.values()])
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = {executor.submit(summarize_mouse_safely, data_path, poly_folder, force=force,
+                                       mouse_id=mouse_id, chunk_size=chunk_size, trust_dlc=trust_dlc,
+                                       gap_method=gap_method, max_gap=max_gap,
+                                       protocol=row_protocol(mouse_id) or protocol): ix_row
+                       for ix_row, (data_path, mouse_id) in tasks.items()}
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                try:
+                    results[futures[future]] = future.result()
+                except Exception:
+                    # The worker died (BrokenProcessPool) or its results could not be sent back
+                    results[futures[future]] = {'record': {}, 'bins': {}}, traceback.format_exc()
+
+    # Fill the table in the order of the mice file, whatever the order of completion
+    records = {}
+    for ix_row in tasks:
+        summary, error = results[ix_row]
+        records[ix_row] = summary['record']
+        if error is not None:
+            print(f'Analysis of {tasks[ix_row][0].name} failed:\n{error}')
+            records[ix_row]['analysis_error'] = error.strip().splitlines()[-1]
+    bins_table = long_format_table(df, {ix_row: results[ix_row][0]['bins'] for ix_row in tasks})
+    df = fill_table(df, records)
     mice_path = Path(mice_path)
-    df.to_excel(mice_path.parent / 'all_computed_data.xlsx')
+    for fmt in formats:
+        save_table(df, mice_path.parent / f'all_computed_data.{fmt}')
+    save_long_table(bins_table, mice_path.parent / BINS_TABLE_NAME)
     return df
 
 
@@ -1259,86 +3330,288 @@ def slice_measurement(time, meas, event_times):
 
 
 
-def fill_table(df, ix_row, results):
+def table_items(results):
     """
-    Given the results from the analysis of one file, fill them in the global table
-    
+    Items of the results that can be part of the tables: all of them, or only the summary of
+    SavedResults, whose other arrays are not in the tables and do not need to be read
+    """
+    if isinstance(results, SavedResults):
+        return results.summary_items()
+    return results.items()
+
+
+def flatten_results(results):
+    """
+    Flatten the results from the analysis of one file into one row of the global table.
+    Binned arrays (keys containing _bin) give one column per bin, e.g. freezing_bin gives
+    freezing_1, freezing_2... Other arrays and dictionaries are not part of the table.
+
     Parameters
     ----------
-    df
-    ix_row
-    results
+    results: dict
+        As returned by analyze_mouse
 
     Returns
     -------
-
+    record: dict
+        {column name: value}
     """
-    for key, value in results.items():
+    record = {}
+    for key, value in table_items(results):
         if isinstance(value, np.ndarray) and '_bin' in key:
             # Deal with arrays by adding a column in the DF for each column in the array
             column_base = key.split('_')[0]
             for bin_num in range(len(value)):
-                col_name = f'{column_base}_{bin_num + 1}'
-                if col_name not in df.columns:
-                    df[col_name] = np.nan
-                df.loc[ix_row, col_name] = value[bin_num]
+                record[f'{column_base}_{bin_num + 1}'] = value[bin_num]
         elif not isinstance(value, np.ndarray) and not isinstance(value, dict):
-            if key not in df.columns:
-                df[key] = np.nan
-            df.loc[ix_row, key] = value
+            record[key] = value
+    return record
 
 
-if __name__ == '__main__' and True:
-    df = analyse_all_data(upaths['table_path'])
-    # df['group']= df['brain']+df['drug']
+# Long-format table of the binned measures, saved next to the mice file by analyse_all_data
+BINS_TABLE_NAME = 'all_computed_bins.parquet'
 
 
-def create_lengths_df(df=df, lengths_path=upaths['lengths_path']):
-    '''
-    This function reads a collection of CSV files from a specified folder and
-    concatenates them vertically into a single dataframe. It also sets the
-    column names of the concatenated dataframe based on the column names in
-    the first CSV file.
-    '''
+def bin_records(results):
+    """
+    Binned measures of the results of one mouse, as the rows of long_format_table
 
-    lengths_path = Path(lengths_path)  # Convert the folder path to a Path object
+    Parameters
+    ----------
+    results: dict
+        As returned by analyze_mouse
 
-    files = [file.name for file in lengths_path.iterdir() if file.is_file()]  # Get a list of file names in the folder
+    Returns
+    -------
+    bins: dict
+        protocol: protocol of the analysis
+        measure, bin, bin_start_s, bin_end_s, value: np.ndarray with an element per measure and bin.
+        The bins are those of bin_edges, the last one stops at the end of the recording.
+        Empty if the results are empty
+    """
+    if not results:
+        return {}
+    params = results['params']
+    # Limits of the bins in seconds, as binned by bin_measures
+    edges = np.clip(bin_edges(params['bin_duration'], params['win_duration'], params['frame_rate']),
+                    0, params['n_frames']) / params['frame_rate']
+    measures, bins, values = [], [], []
+    for key, value in table_items(results):
+        if isinstance(value, np.ndarray) and '_bin' in key:
+            measures.append(np.full(len(value), key.split('_')[0], dtype=object))
+            bins.append(np.arange(1, len(value) + 1))
+            values.append(value.astype(np.float32))
+    bin_numbers = np.concatenate(bins) if bins else np.zeros(0, dtype=int)
+    return {'protocol': results['params']['protocol'],
+            'measure': np.concatenate(measures) if measures else np.zeros(0, dtype=object),
+            'bin': bin_numbers, 'bin_start_s': edges[bin_numbers - 1], 'bin_end_s': edges[bin_numbers],
+            'value': np.concatenate(values) if values else np.zeros(0, dtype=np.float32)}
+
+
+def long_format_table(df, bins):
+    """
+    Binned measures of all the mice in long format: one row per mouse, measure and bin, with the
+    columns of the mice file. The same values as the <measure>_<n> columns of the wide table
+    (see flatten_results), without the bin number in the column names
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        Table of the mice
+    bins: dict
+        {index of the row in df: bin_records of its results}, the empty ones are left out
+
+    Returns
+    -------
+    bins_table: pandas.DataFrame
+        Columns of the mice file, then measure (e.g. freezing, speed), bin (from 1), bin_start_s,
+        bin_end_s (seconds from the start of the recording) and value (float32).
+        The text columns (e.g. group), protocol and measure are categorical
+    """
+    columns = ('measure', 'bin', 'bin_start_s', 'bin_end_s', 'value')
+    bins = {ix_row: records for ix_row, records in bins.items() if records and len(records['bin'])}
+    if not bins:
+        return pd.DataFrame(columns=[*df.columns, *columns])
+    rows = np.concatenate([np.full(len(records['bin']), ix_row) for ix_row, records in bins.items()])
+    bins_table = df.loc[rows].reset_index(drop=True)
+    if 'protocol' not in bins_table.columns:
+        bins_table['protocol'] = np.concatenate([np.full(len(records['bin']), records['protocol'], dtype=object)
+                                                 for records in bins.values()])
+    for column in columns:
+        bins_table[column] = np.concatenate([records[column] for records in bins.values()])
+    for column in bins_table.columns:
+        if column in ('protocol', 'measure') or pd.api.types.is_string_dtype(bins_table[column]):
+            bins_table[column] = bins_table[column].astype('category')
+    return bins_table
+
+
+def save_long_table(bins_table, table_path):
+    """
+    Write the table of long_format_table in a Parquet file (pyarrow is needed), or in a pickle
+    file next to it without pyarrow. Both keep the categorical columns
 
-    # create an empty dataframe with the same columns as the CSV files
-    df_lengths = pd.read_csv(lengths_path / files[0])
-    df_lengths = df_lengths.iloc[0:0]
+    Returns
+    -------
+    table_path: Path
+    """
+    table_path = Path(table_path)
+    try:
+        bins_table.to_parquet(table_path)
+    except ImportError:
+        table_path = table_path.with_suffix('.pkl')
+        bins_table.to_pickle(table_path)
+    return table_path
 
-    # loop through each CSV file and concatenate the values
-    for file in files:
-        file_path = lengths_path / file  # Create the file path using Path object
-        temp_df = pd.read_csv(file_path, header=0)
-        df_lengths = pd.concat([df_lengths, temp_df], axis=0)
 
-    # reset the index and set the column names
-    df_lengths.reset_index(drop=True, inplace=True)
+def fill_table(df, records):
+    """
+    Given the results from the analysis of all the files, fill them in the global table
     
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        Table of the mice
+    records: dict
+        {index of the row in df: record as returned by flatten_results}
+
+    Returns
+    -------
+    df: pandas.DataFrame
+        New table with the input columns followed by the computed ones, in order of appearance
+    """
+    table = pd.DataFrame(list(records.values()), index=list(records.keys()))
+    existing = [col for col in table.columns if col in df.columns]
+    df = df.copy()
+    df.update(table[existing])
+    return df.join(table.drop(columns=existing))
+
+
+def create_lengths_df(df, lengths_path=upaths['lengths_path']):
+    '''
+    This function reads the CSV files with the freezing lengths of each mouse of the table
+    (see save_freezing_lengths) and adds their "lengths_" columns to the table.
+    The files are matched to the rows by the "file" column, mice without a file get nans.
+    '''
+
+    lengths_path = Path(lengths_path)  # Convert the folder path to a Path object
+
+    rows = []
+    for file in df['file']:
+        file_path = lengths_path / f'lengths_{file}.csv'
+        if file_path.exists():
+            rows.append(pd.read_csv(file_path, header=0).iloc[0])
+        else:
+            rows.append(pd.Series(dtype=object))
+    df_lengths = pd.DataFrame(rows, index=df.index)
+
     # Select the columns starting by "lengths_"
     columns_to_select = [col for col in df_lengths.columns if col.startswith('lengths_')]
     df_lengths = df_lengths[columns_to_select]
-    
-    # Merge both dataframes
-    merged_df = pd.concat([df, df_lengths], axis=1)    
-    
+
+    # Merge both dataframes, replacing the lengths already in the table
+    df = df.drop(columns=[col for col in df.columns if col.startswith('lengths_')])
+    merged_df = pd.concat([df, df_lengths], axis=1)
+
     return merged_df
 
-df = create_lengths_df()
 
-def download_dataframes(df, basepath=upaths['basepath']):
+def download_dataframes(df, basepath=upaths['basepath'], formats=('parquet', 'csv')):
+    """
+    Save the table in files named after basepath, the current date and the date of the first file,
+    one per format (see tables.save_table)
+
+    Returns
+    -------
+    file_paths: list of str
+    """
     directory = str(basepath)
     current_date = datetime.date.today()
     formatted_date = current_date.strftime("%Y%m%d")
     original_date = df.file[0].split('_')[0]
 
-    df.to_csv(directory + '_' + formatted_date + '_' + original_date + '.csv')
+    file_path = directory + '_' + formatted_date + '_' + original_date
+    return [str(save_table(df, f'{file_path}.{fmt}')) for fmt in formats]
+
+
+def collect_saved_data(mice_path, base_path=upaths['dlcpath']):
+    """
+    Build the table of analyse_all_data from the results store only, without analysing anything.
+    Mice without saved results are kept with empty columns
+
+    Parameters
+    ----------
+    mice_path: str or Path
+        Mice file
+    base_path: str or Path
+        Path to the directory with the DLC files and their saved results
+
+    Returns
+    -------
+    df: pandas.DataFrame
+    """
+    base_path = Path(base_path)
+    df = pd.read_csv(mice_path)
+    records = {}
+    for ix_row, row in df.iterrows():
+        data_path = base_path / (str(row['file']) + '.csv')
+        meta = read_saved_meta(data_path)
+        if meta is None:
+            print(f'No saved results for {data_path.name}')
+            continue
+        records[ix_row] = flatten_results(load_saved_results(data_path, meta))
+    return fill_table(df, records)
+
+
+def collect_peth(mice_path, stimulus='tone', pre=30, post=60, bin_size=1, labels=('mouse', 'protocol', 'group'),
+                 base_path=upaths['dlcpath'], measures=PETH_MEASURES):
+    """
+    PETH of all the mice of the mice file around the onsets of a stimulus, from the results store
+    only (see peth.mouse_peth). Mice without saved results or without stimulus events are left out
+
+    Parameters
+    ----------
+    mice_path: str or Path
+        Mice file
+    stimulus: str
+        Stimulus of stimulus_codes in settings.py
+    pre, post, bin_size: float
+        In seconds, see peth.event_matrix
+    labels: tuple of str
+        Columns of the mice file kept with the tensor (the missing ones are ignored)
+    base_path: str or Path
+        Path to the directory with the DLC files and their saved results
+    measures: tuple of str
+
+    Returns
+    -------
+    tensor: dict
+        See peth.peth_tensor
+    """
+    base_path = Path(base_path)
+    df = pd.read_csv(mice_path)
+    labels = [column for column in labels if column in df.columns]
+    peths, rows = [], []
+    for ix_row, row in df.iterrows():
+        data_path = base_path / (str(row['file']) + '.csv')
+        meta = read_saved_meta(data_path)
+        if meta is None:
+            print(f'No saved results for {data_path.name}')
+            continue
+        res = load_saved_results(data_path, meta)
+        events = res.get('events', {})
+        if stimulus not in events:
+            print(f'No {stimulus} events for {data_path.name}, analyse it again')
+            continue
+        peths.append(mouse_peth(res, stimulus, pre, post, bin_size, measures))
+        rows.append(ix_row)
+    return peth_tensor(peths, {column: df.loc[rows, column].tolist() for column in labels}, measures)
+
 
+if __name__ == '__main__':
+    # Command line, see cli.py
+    from cli import main
 
-download_dataframes(df)
+    main()
 
     # manually analyzing one file
     # d = open_data(upaths['datapath'] / '20210808 _ERC project_JP_tone context_habituation ab 2_01_01_1DLC_resnet50_FearDetectionJun17shuffle1_100000.csv')
@@ -0,0 +1,4 @@
+"""
+Benchmarks of behavior_analysis on synthetic data, run with `python -m benchmarks`.
+The synthetic files and trajectories are also used by the tests
+"""
@@ -0,0 +1,111 @@
+"""
+Benchmarks of the readers of DLC files and of the methods filling the gaps of the tracking, on
+synthetic data. Run them from the folder of the scripts:
+    python -m benchmarks [all|dlc-reader|gap-filling]
+"""
+
+from pathlib import Path
+import tempfile
+import time
+import numpy as np
+from behavior_analysis import (GAP_METHODS, dlc_columns, import_pyarrow_csv, nan_removal, read_dlc_columns,
+                               read_dlc_header)
+from benchmarks.synthetic import synthetic_trajectory, write_synthetic_dlc
+
+
+def benchmark_dlc_reader(n_frames=40000, n_bodyparts=8, repeat=3):
+    """
+    Compare the time needed to load one bodypart of a synthetic DLC file with the old
+    np.genfromtxt path (whole matrix, then column selection) and with read_dlc_columns
+
+    Parameters
+    ----------
+    n_frames: int
+    n_bodyparts: int
+    repeat: int
+        Number of repetitions, the best time is kept
+
+    Returns
+    -------
+    timings: dict
+        Best time in seconds for each reading method
+    """
+    engines = ['genfromtxt (all columns)', 'genfromtxt', 'c']
+    if import_pyarrow_csv() is not None:
+        engines.append('pyarrow')
+    timings = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_path = Path(tmp_dir) / 'synthetic_dlc.csv'
+        write_synthetic_dlc(data_path, n_frames, n_bodyparts)
+        columns, n_header = read_dlc_header(data_path)
+        cols = dlc_columns(columns, ['bodypart0'])
+        for engine in engines:
+            best = np.inf
+            for _ in range(repeat):
+                start = time.perf_counter()
+                if engine == 'genfromtxt (all columns)':
+                    dlc_data = np.genfromtxt(data_path, delimiter=',', skip_header=n_header)[:, cols]
+                else:
+                    dlc_data = read_dlc_columns(data_path, cols, n_header, engine=engine)
+                best = min(best, time.perf_counter() - start)
+            assert dlc_data.shape == (n_frames, 3)
+            timings[engine] = best
+    for engine, duration in timings.items():
+        print(f'{engine:>25}: {duration:.3f} s')
+    return timings
+
+
+def benchmark_gap_filling(n_frames=30000, gap_fraction=0.1, mean_gap=10, repeat=3):
+    """
+    Compare the speed and the accuracy of the methods of nan_removal on a synthetic trajectory
+
+    Parameters
+    ----------
+    n_frames: int
+    gap_fraction: float
+    mean_gap: float
+        See synthetic_trajectory
+    repeat: int
+        Number of repetitions, the best time is kept
+
+    Returns
+    -------
+    results: dict
+        {method: {'time': best time in s, 'rmse': root mean square error in the gaps,
+                  'max_error': largest error in the gaps}}
+    """
+    truth, with_gaps = synthetic_trajectory(n_frames, gap_fraction, mean_gap)
+    gaps = np.isnan(with_gaps)
+    t = np.arange(n_frames)
+    results = {}
+    for method in GAP_METHODS:
+        best = np.inf
+        for _ in range(repeat):
+            start = time.perf_counter()
+            filled = nan_removal(with_gaps, t, method)
+            best = min(best, time.perf_counter() - start)
+        error = filled[gaps] - truth[gaps]
+        results[method] = {'time': best, 'rmse': np.sqrt(np.mean(error ** 2)),
+                           'max_error': np.max(np.abs(error))}
+    print(f'{n_frames} frames, {100 * np.mean(gaps):.1f}% in gaps')
+    for method, result in results.items():
+        print(f"{method:>12}: {result['time'] * 1e3:8.2f} ms, rmse {result['rmse']:.3f} px, "
+              f"max error {result['max_error']:.3f} px")
+    return results
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Benchmarks on synthetic data')
+    parser.add_argument('what', nargs='?', choices=['all', 'dlc-reader', 'gap-filling'], default='all',
+                        help='readers of DLC files or methods to fill the gaps')
+    args = parser.parse_args(argv)
+    if args.what in ('all', 'dlc-reader'):
+        benchmark_dlc_reader()
+    if args.what in ('all', 'gap-filling'):
+        benchmark_gap_filling()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Synthetic data for the benchmarks and the tests: DLC files and trajectories with gaps
+"""
+
+import numpy as np
+
+
+def write_synthetic_dlc(data_path, n_frames=40000, n_bodyparts=8, seed=0):
+    """
+    Write a DLC-like CSV file with random trajectories, to benchmark the readers
+
+    Parameters
+    ----------
+    data_path: Path or str
+    n_frames: int
+    n_bodyparts: int
+    seed: int
+    """
+    rng = np.random.default_rng(seed)
+    bodyparts = [f'bodypart{ix}' for ix in range(n_bodyparts)]
+    data = np.empty((n_frames, 3 * n_bodyparts))
+    data[:, 0::3] = 300 + np.cumsum(rng.normal(0, 1, (n_frames, n_bodyparts)), axis=0)
+    data[:, 1::3] = 200 + np.cumsum(rng.normal(0, 1, (n_frames, n_bodyparts)), axis=0)
+    data[:, 2::3] = rng.random((n_frames, n_bodyparts))
+    header = ['scorer,' + ','.join(['DLC_resnet50'] * 3 * n_bodyparts),
+              'bodyparts,' + ','.join(bp for bp in bodyparts for _ in range(3)),
+              'coords,' + ','.join(['x', 'y', 'likelihood'] * n_bodyparts)]
+    frames = np.arange(n_frames)[:, np.newaxis]
+    np.savetxt(data_path, np.hstack((frames, data)), delimiter=',', fmt=['%d'] + ['%.6f'] * data.shape[1],
+               header='\n'.join(header), comments='')
+
+
+def synthetic_trajectory(n_frames=30000, gap_fraction=0.1, mean_gap=10, seed=0):
+    """
+    Smooth random trajectory (one coordinate, in pixels) and a copy with gaps of random lengths.
+    The velocity is an AR(1) process, filtered at once with scipy.signal.lfilter
+
+    Parameters
+    ----------
+    n_frames: int
+    gap_fraction: float
+        Approximate fraction of frames in gaps
+    mean_gap: float
+        Mean length of the gaps, in frames
+    seed: int
+
+    Returns
+    -------
+    truth: np.ndarray
+    with_gaps: np.ndarray
+        Same trajectory, with nans in the gaps
+    """
+    from scipy.signal import lfilter
+
+    rng = np.random.default_rng(seed)
+    noise = rng.normal(0, 0.3, n_frames)
+    noise[0] = 0
+    # velocity[ix] = 0.95 * velocity[ix - 1] + noise[ix]
+    velocity = lfilter([1], [1, -0.95], noise)
+    truth = 300 + np.cumsum(velocity)
+    n_gaps = int(gap_fraction * n_frames / mean_gap)
+    starts = rng.integers(1, n_frames - 1, n_gaps)
+    lengths = rng.geometric(1 / mean_gap, n_gaps)
+    # Number of gaps covering each frame: +1 at their start, -1 after their end
+    covering = np.zeros(n_frames + 1, dtype=int)
+    np.add.at(covering, starts, 1)
+    np.add.at(covering, np.minimum(starts + lengths, n_frames), -1)
+    with_gaps = np.where(np.cumsum(covering[:-1]) > 0, np.nan, truth)
+    return truth, with_gaps
@@ -0,0 +1,127 @@
+"""
+Bouts of a boolean vector (e.g. the freezing frames): run-length encoding in one pass and
+statistics of the bouts in time windows
+"""
+
+import numpy as np
+
+# Edges of the histograms of the bout lengths, in seconds: bins of 0.1 s up to 7 s, and one bin
+# for the longer bouts
+BOUT_HIST_EDGES = np.append(np.linspace(0, 7, 71), np.inf)
+
+
+def bouts_from_edges(starts, ends):
+    """
+    Bouts given by their first frame and the frame following their last frame
+
+    Returns
+    -------
+    bouts: dict
+        starts: np.ndarray
+            First frame of each bout
+        ends: np.ndarray
+            Frame after the last frame of each bout
+        durations: np.ndarray
+            Length of each bout, in frames
+        intervals: np.ndarray
+            Number of frames between each bout and the next one (one less element)
+    """
+    starts = np.asarray(starts, dtype=int)
+    ends = np.asarray(ends, dtype=int)
+    return {'starts': starts, 'ends': ends, 'durations': ends - starts, 'intervals': starts[1:] - ends[:-1]}
+
+
+def find_bouts(mask):
+    """
+    Runs of consecutive True values of a boolean vector
+
+    Parameters
+    ----------
+    mask: boolean np.ndarray
+
+    Returns
+    -------
+    bouts: dict
+        See bouts_from_edges
+    """
+    mask = np.asarray(mask, dtype=bool)
+    edges = np.diff(mask.astype(np.int8), prepend=np.int8(0), append=np.int8(0))
+    starts, = np.nonzero(edges == 1)
+    ends, = np.nonzero(edges == -1)
+    return bouts_from_edges(starts, ends)
+
+
+def find_bouts_chunked(mask, chunk_size=20000):
+    """
+    Same as find_bouts, reading the vector by blocks of frames (e.g. a memmap)
+    """
+    starts, ends = [], []
+    previous = np.int8(0)
+    for start in range(0, len(mask), chunk_size):
+        block = np.asarray(mask[start:start + chunk_size], dtype=bool).astype(np.int8)
+        # The first edge is relative to the last frame of the previous block
+        edges = np.diff(block, prepend=previous)
+        starts.append(start + np.flatnonzero(edges == 1))
+        ends.append(start + np.flatnonzero(edges == -1))
+        previous = block[-1]
+    if previous:
+        ends.append([len(mask)])
+    if not starts:
+        return bouts_from_edges([], [])
+    return bouts_from_edges(np.concatenate(starts), np.concatenate(ends))
+
+
+def long_bouts(bouts, min_frames):
+    """
+    Bouts longer than min_frames, as a (n_bouts, 2) array of [start, end] frames
+    """
+    keep = bouts['durations'] > min_frames
+    return np.column_stack((bouts['starts'][keep], bouts['ends'][keep]))
+
+
+def clip_bouts(bouts, start, stop):
+    """
+    Bouts cut to the frames start to stop (excluded), as if the vector had been sliced first.
+    The bouts are sorted, so the ones overlapping the window are found by binary search
+
+    Returns
+    -------
+    bouts: dict
+        See bouts_from_edges
+    """
+    first = np.searchsorted(bouts['ends'], start, side='right')
+    last = np.searchsorted(bouts['starts'], stop, side='left')
+    starts = np.maximum(bouts['starts'][first:last], start)
+    ends = np.minimum(bouts['ends'][first:last], stop)
+    return bouts_from_edges(starts, ends)
+
+
+def bout_statistics(bouts, windows, framerate=25, hist_edges=BOUT_HIST_EDGES):
+    """
+    Statistics of the bout lengths in some windows of the session
+
+    Parameters
+    ----------
+    bouts: dict
+        Output of find_bouts
+    windows: dict
+        {name: (first frame, last frame excluded)}
+    framerate: int
+    hist_edges: np.ndarray
+        Edges of the histogram of the lengths, in seconds
+
+    Returns
+    -------
+    stats: dict
+        {name: {'lengths': bout lengths in seconds, 'n_bouts': int, 'mean': float,
+        'median': float (nan without bout), 'hist': counts of the lengths in hist_edges}}
+    """
+    stats = {}
+    for name, (start, stop) in windows.items():
+        lengths = clip_bouts(bouts, start, stop)['durations'] / framerate
+        n_bouts = len(lengths)
+        stats[name] = {'lengths': lengths, 'n_bouts': n_bouts,
+                       'mean': np.mean(lengths) if n_bouts else np.nan,
+                       'median': np.median(lengths) if n_bouts else np.nan,
+                       'hist': np.histogram(lengths, hist_edges)[0]}
+    return stats
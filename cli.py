@@ -0,0 +1,98 @@
+"""
+Command line of the analysis, run from the folder of the scripts:
+    python -m cli analyze
+See `python -m cli --help` for the other commands
+"""
+
+from pathlib import Path
+from behavior_analysis import (CHUNKED_MAX_GAP, GAP_METHODS, analyse_all_data, collect_peth, collect_saved_data,
+                               create_lengths_df, deleting_previous_data, download_dataframes)
+from peth import save_peth
+from settings import epoch_protocol, epoch_protocols, upaths
+from tables import TABLE_FORMATS, load_table, save_table
+
+
+def main(argv=None):
+    """
+    Command line entry point, run `python -m cli --help`
+
+    Parameters
+    ----------
+    argv: list of str or None
+        Arguments, sys.argv[1:] if None
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='python -m cli', description='Analysis of immobility from DLC files')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    analyze_parser = subparsers.add_parser('analyze', help='analyse all the mice of the mice file, '
+                                                           'add the freezing lengths and save the table')
+    analyze_parser.add_argument('--mice', type=Path, default=upaths['table_path'], help='mice file')
+    analyze_parser.add_argument('--force', action='store_true', help='recompute the saved results')
+    analyze_parser.add_argument('--jobs', type=int, default=1,
+                                help='mice analysed in parallel, -1 for all the processors')
+    analyze_parser.add_argument('--chunk-size', type=int, default=None,
+                                help='read the DLC files by blocks of this number of frames')
+    analyze_parser.add_argument('--trust-dlc', action='store_true',
+                                help='do not read the videos: use the number of rows of the DLC files')
+    analyze_parser.add_argument('--gap-method', choices=GAP_METHODS, default=None,
+                                help='how to fill the frames below the likelihood threshold (default spline)')
+    analyze_parser.add_argument('--max-gap', type=int, default=None,
+                                help='longer gaps, in frames, are not filled (default: no limit, '
+                                     f'or {CHUNKED_MAX_GAP} with --chunk-size)')
+    analyze_parser.add_argument('--protocol', choices=list(epoch_protocols), default=None,
+                                help='epochs of the mice without a protocol column in the mice file '
+                                     f'(default {epoch_protocol}, see settings.py)')
+    analyze_parser.add_argument('--formats', nargs='+', choices=TABLE_FORMATS, default=['parquet', 'csv'],
+                                help='formats of the saved tables')
+
+    merge_parser = subparsers.add_parser('merge-lengths', help='add the freezing lengths to a saved table')
+    merge_parser.add_argument('table', type=Path, help='table saved by analyze or export')
+    merge_parser.add_argument('--output', type=Path, default=None,
+                              help='where to save the merged table, by default <table>_lengths with the same format')
+
+    export_parser = subparsers.add_parser('export', help='save the table of the saved results, '
+                                                         'without analysing anything')
+    export_parser.add_argument('--mice', type=Path, default=upaths['table_path'], help='mice file')
+    export_parser.add_argument('--formats', nargs='+', choices=TABLE_FORMATS, default=['parquet', 'csv'],
+                               help='formats of the saved tables')
+
+    peth_parser = subparsers.add_parser('peth', help='save the freezing and speed around the onsets of a '
+                                                     'stimulus, from the saved results')
+    peth_parser.add_argument('--mice', type=Path, default=upaths['table_path'], help='mice file')
+    peth_parser.add_argument('--stimulus', default='tone', help='stimulus of stimulus_codes in settings.py')
+    peth_parser.add_argument('--pre', type=float, default=30, help='seconds before the onsets')
+    peth_parser.add_argument('--post', type=float, default=60, help='seconds after the onsets')
+    peth_parser.add_argument('--bin-size', type=float, default=1, help='bins of time, in seconds')
+    peth_parser.add_argument('--output', type=Path, default=None,
+                             help='NPZ file, by default peth_<stimulus>.npz in the basepath folder')
+
+    subparsers.add_parser('clean', help='delete the saved results and the freezing lengths')
+
+    args = parser.parse_args(argv)
+    if args.command == 'analyze':
+        df = analyse_all_data(args.mice, force=args.force, n_jobs=args.jobs, chunk_size=args.chunk_size,
+                              trust_dlc=args.trust_dlc, gap_method=args.gap_method, max_gap=args.max_gap,
+                              protocol=args.protocol, formats=args.formats)
+        # df['group']= df['brain']+df['drug']
+        df = create_lengths_df(df)
+        print(f"Table saved in {', '.join(download_dataframes(df, formats=args.formats))}")
+    elif args.command == 'merge-lengths':
+        df = create_lengths_df(load_table(args.table))
+        output = args.output or args.table.with_name(args.table.stem + '_lengths' + args.table.suffix)
+        print(f'Table saved in {save_table(df, output)}')
+    elif args.command == 'export':
+        df = create_lengths_df(collect_saved_data(args.mice))
+        print(f"Table saved in {', '.join(download_dataframes(df, formats=args.formats))}")
+    elif args.command == 'peth':
+        tensor = collect_peth(args.mice, args.stimulus, args.pre, args.post, args.bin_size)
+        output = args.output or Path(upaths['basepath']) / f'peth_{args.stimulus}.npz'
+        save_peth(tensor, output)
+        print(f"PETH of {len(tensor['n_events'])} mice saved in {output}")
+    elif args.command == 'clean':
+        deleting_previous_data()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Stimuli of the polybox recordings: onsets and offsets of the tones, lights and shocks read from
+the codes of the dat files, and the epochs and peri-event windows built from them, so that the
+schedule of a session does not have to be written by hand
+
+The timestamps of the dat files are in ms from the start of the polybox recording. The vectors of
+the results are padded with the frames missing at the start of the video (see
+behavior_analysis.load_mouse): their index i is at i / framerate seconds of the polybox.
+"""
+
+import numpy as np
+
+
+def stimulus_times(event_times, codes, durations=None):
+    """
+    Onset and offset of every presentation of each stimulus.
+    Each onset is paired with the first offset code after it. When that offset is missing, or
+    comes after the next onset, the stimulus lasts durations[stimulus] seconds if it is given,
+    else until the next onset (the end of the recording, inf, for the last one)
+
+    Parameters
+    ----------
+    event_times: dict
+        {event code: timestamps in ms}, see behavior_analysis.parse_dat_file
+    codes: dict
+        {stimulus: (onset code, offset code or None)}
+    durations: dict or None
+        {stimulus: duration in seconds}, for the stimuli without an offset code
+
+    Returns
+    -------
+    stimuli: dict
+        {stimulus: (n_presentations, 2) array with the onset and offset of each one, in seconds}
+    """
+    durations = durations or {}
+    stimuli = {}
+    for name, (on_code, off_code) in codes.items():
+        onsets = np.sort(np.asarray(event_times.get(on_code, []), dtype=float)) / 1000
+        next_onsets = np.append(onsets[1:], np.inf)[:len(onsets)]
+        fallback = onsets + durations[name] if name in durations else next_onsets
+        off_times = np.sort(np.asarray(event_times.get(off_code, []), dtype=float)) / 1000
+        if off_code is None or len(off_times) == 0:
+            offsets = fallback
+        else:
+            ix = np.searchsorted(off_times, onsets, side='right')
+            offsets = off_times[np.minimum(ix, len(off_times) - 1)]
+            missing = (ix == len(off_times)) | (offsets > next_onsets)
+            offsets = np.where(missing, fallback, offsets)
+        stimuli[name] = np.column_stack((onsets, offsets))
+    return stimuli
+
+
+def to_frames(seconds, framerate):
+    """
+    Index in the vectors of the results of each time of the polybox, in seconds
+
+    Parameters
+    ----------
+    seconds: array-like
+    framerate: float
+
+    Returns
+    -------
+    frames: int np.ndarray
+    """
+    return np.round(np.asarray(seconds, dtype=float) * framerate).astype(int)
+
+
+def off_periods(intervals):
+    """
+    Periods without stimulus before each block of stimuli (overlapping or consecutive
+    presentations form a block), from the start of the recording
+
+    Parameters
+    ----------
+    intervals: np.ndarray
+        (n, 2) onsets and offsets, in seconds
+
+    Returns
+    -------
+    periods: list of (start, end)
+    """
+    periods = []
+    end = 0.
+    for onset, offset in intervals[np.argsort(intervals[:, 0], kind='stable')]:
+        if onset > end:
+            periods.append((float(end), float(onset)))
+        end = max(end, offset)
+    return periods
+
+
+def window_limit(time):
+    """Limit of a window as in epoch_protocols: a float, None for the end of the recording"""
+    return None if np.isinf(time) else float(time)
+
+
+def event_epochs(stimuli, spec, windows=None, groups=None):
+    """
+    Epochs of a session from its stimuli, in the format of settings.epoch_protocols.
+    Raises a ValueError if one of the stimuli has no code, or if none of them was presented:
+    the codes of settings.stimulus_codes are then probably not the ones of the polybox
+
+    Parameters
+    ----------
+    stimuli: dict
+        Output of stimulus_times
+    spec: dict
+        stimuli: names of the stimuli giving windows, in this order (all of them if not given)
+        peri: duration in seconds of the peri-event windows, none if 0 or not given
+    windows: dict or None
+        Fixed windows of the protocol, kept as they are
+    groups: dict or None
+        {name: [window names]}, the windows missing in this session are left out of the groups
+
+    Returns
+    -------
+    epochs: dict
+        {'windows': {name: (start, end)}, 'groups': {name: [window names]}} with, for each
+        stimulus (e.g. tone): tone1, tone2... from onset to offset, pre_tone1, post_tone1...
+        the peri seconds before and after each onset, and off1, off2... the periods without
+        stimulus before each block of stimuli
+    """
+    names = spec.get('stimuli', list(stimuli))
+    missing = [name for name in names if name not in stimuli]
+    if missing:
+        raise ValueError(f'No code for the stimuli {", ".join(missing)}: set them in stimulus_codes of settings.py')
+    if not any(len(stimuli[name]) for name in names):
+        raise ValueError(f'No onset of {", ".join(names)} in the dat file: check stimulus_codes of settings.py')
+    peri = spec.get('peri') or 0
+    windows = dict(windows or {})
+    for name in names:
+        for i, (onset, offset) in enumerate(stimuli[name], start=1):
+            windows[f'{name}{i}'] = (float(onset), window_limit(offset))
+            if peri:
+                windows[f'pre_{name}{i}'] = (max(float(onset) - peri, 0.), float(onset))
+                windows[f'post_{name}{i}'] = (float(onset), float(onset) + peri)
+    for i, period in enumerate(off_periods(np.concatenate([stimuli[name] for name in names])), start=1):
+        windows[f'off{i}'] = period
+    groups = {group: [name for name in members if name in windows] for group, members in (groups or {}).items()}
+    return {'windows': windows, 'groups': groups}
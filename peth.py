@@ -0,0 +1,197 @@
+"""
+Peri-event time histograms (PETH): freezing and speed around each onset of a stimulus, in bins
+of time, as an (n_events, n_bins) matrix per mouse and an (n_mice, n_events, n_bins) tensor for
+a cohort, saved in an NPZ file for the plots (see plots_higher_order.timeseries_peth_plot)
+
+The windows of all the events are views of the same padded vector (sliding_window_view), so
+there is no loop over the events or the bins.
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from events import to_frames
+
+PETH_MEASURES = ('freezing', 'velocity')
+
+
+def peth_edges(pre=30, post=60, bin_size=1):
+    """
+    Edges of the bins, in seconds from the onset: pre seconds before and post seconds after,
+    rounded to whole bins
+    """
+    n_pre, n_post = int(round(pre / bin_size)), int(round(post / bin_size))
+    return np.arange(-n_pre, n_post + 1) * bin_size
+
+
+def event_matrix(signal, onsets, framerate, pre=30, post=60, bin_size=1):
+    """
+    Mean of a signal in bins of time around each onset
+
+    Parameters
+    ----------
+    signal: np.ndarray
+        Value at each frame of the recording (can be a memmap), frame i being at i / framerate
+    onsets: array-like
+        Onsets in seconds, see events.stimulus_times
+    framerate: float
+    pre, post, bin_size: float
+        In seconds, see peth_edges. A bin is round(bin_size * framerate) frames long
+
+    Returns
+    -------
+    matrix: np.ndarray
+        (n_events, n_bins) mean of the signal in each bin, without its nans. nan for the bins
+        out of the recording
+    """
+    n_pre, n_post = int(round(pre / bin_size)), int(round(post / bin_size))
+    bin_frames = max(int(round(bin_size * framerate)), 1)
+    before, width = n_pre * bin_frames, (n_pre + n_post) * bin_frames
+    n_frames = len(signal)
+    # The signal padded with a whole window of nans on each side: window i starts at frame
+    # i - width, so the windows overlapping the recording are all views of this vector
+    padded = np.full(n_frames + 2 * width, np.nan)
+    padded[width:width + n_frames] = signal
+    windows = sliding_window_view(padded, width)
+    ix_windows = to_frames(onsets, framerate) - before + width
+    outside = (ix_windows < 0) | (ix_windows >= len(windows))
+    values = windows[np.clip(ix_windows, 0, len(windows) - 1)].reshape(len(ix_windows), n_pre + n_post, bin_frames)
+    valid = np.logical_not(np.isnan(values))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        matrix = np.where(valid, values, 0).sum(axis=2) / valid.sum(axis=2)
+    matrix[outside] = np.nan
+    return matrix
+
+
+def mouse_peth(res, stimulus='tone', pre=30, post=60, bin_size=1, measures=PETH_MEASURES):
+    """
+    PETH of one mouse
+
+    Parameters
+    ----------
+    res: dict
+        Results of analyze_mouse, with time, events and the measures
+    stimulus: str
+        Name of the stimulus in res['events']
+    pre, post, bin_size: float
+        See event_matrix
+    measures: tuple of str
+        Vectors of the results, freezing being given in percentage
+
+    Returns
+    -------
+    peth: dict
+        edges: edges of the bins in seconds from the onset
+        durations: duration of each event, in seconds
+        and for each measure, its (n_events, n_bins) matrix
+    """
+    time = res['time']
+    framerate = 1 / (time[1] - time[0])
+    stimuli = np.asarray(res['events'][stimulus], dtype=float).reshape(-1, 2)
+    peth = {'edges': peth_edges(pre, post, bin_size), 'durations': stimuli[:, 1] - stimuli[:, 0]}
+    for measure in measures:
+        peth[measure] = event_matrix(res[measure], stimuli[:, 0], framerate, pre, post, bin_size)
+        if measure == 'freezing':
+            peth[measure] *= 100
+    return peth
+
+
+def peth_tensor(peths, labels=None, measures=PETH_MEASURES):
+    """
+    Stack the PETH of several mice, padding with nans the mice with fewer events
+
+    Parameters
+    ----------
+    peths: list of dict
+        Outputs of mouse_peth, with the same bins
+    labels: dict or None
+        {column: list with a value per mouse}, e.g. mouse and group from the mice file
+    measures: tuple of str
+
+    Returns
+    -------
+    tensor: dict
+        edges: np.ndarray
+        n_events: number of events of each mouse
+        durations: (n_mice, n_events) durations of the events
+        each measure: (n_mice, n_events, n_bins) array
+        labels: names of the label columns, and each label column as an array of strings
+    """
+    labels = labels or {}
+    n_events = np.array([len(peth['durations']) for peth in peths], dtype=int)
+    max_events = n_events.max(initial=0)
+    edges = peths[0]['edges'] if peths else np.zeros(1)
+    tensor = {'edges': edges, 'n_events': n_events,
+              'durations': np.full((len(peths), max_events), np.nan), 'labels': np.array(list(labels), dtype=str)}
+    for measure in measures:
+        tensor[measure] = np.full((len(peths), max_events, len(edges) - 1), np.nan)
+    for ix, peth in enumerate(peths):
+        tensor['durations'][ix, :n_events[ix]] = peth['durations']
+        for measure in measures:
+            tensor[measure][ix, :n_events[ix]] = peth[measure]
+    for column, values in labels.items():
+        tensor[column] = np.array([str(value) for value in values])
+    return tensor
+
+
+def mouse_average(tensor, measure='freezing', events=None):
+    """
+    Mean over the events of each mouse
+
+    Parameters
+    ----------
+    tensor: dict
+        See peth_tensor
+    measure: str
+    events: slice, list or None
+        Events to average, e.g. slice(1, None) to leave the first one out. All if None
+
+    Returns
+    -------
+    average: np.ndarray
+        (n_mice, n_bins), nan for a mouse without event
+    """
+    values = tensor[measure] if events is None else tensor[measure][:, events]
+    valid = np.logical_not(np.isnan(values))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(valid, values, 0).sum(axis=1) / valid.sum(axis=1)
+
+
+def group_peth(tensor, measure='freezing', hue='group', events=None):
+    """
+    Mean and standard error of the PETH in each group of mice
+
+    Parameters
+    ----------
+    tensor: dict
+        See peth_tensor, with the label column hue
+    measure: str
+    hue: str
+    events: slice, list or None
+        See mouse_average
+
+    Returns
+    -------
+    groups: dict
+        {group: {'mean': (n_bins,), 'sem': (n_bins,), 'n': number of mice}}
+    """
+    average = mouse_average(tensor, measure, events)
+    groups = {}
+    for group in np.unique(tensor[hue]):
+        values = average[tensor[hue] == group]
+        n = np.sum(np.logical_not(np.isnan(values)), axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.nansum(values, axis=0) / n
+            sem = np.sqrt(np.nansum((values - mean) ** 2, axis=0) / (n - 1)) / np.sqrt(n)
+        groups[str(group)] = {'mean': mean, 'sem': sem, 'n': len(values)}
+    return groups
+
+
+def save_peth(tensor, peth_path):
+    """Write a tensor of peth_tensor in an NPZ file"""
+    np.savez(peth_path, **tensor)
+
+
+def load_peth(peth_path):
+    """Read a tensor written by save_peth"""
+    with np.load(peth_path) as data:
+        return {key: data[key] for key in data.files}
@@ -2,30 +2,103 @@
 Version: 20/12/2022
 @author: mcanela
 """
+from pathlib import Path
 import matplotlib.pyplot as plt
 from matplotlib.collections import PatchCollection
 import matplotlib.patches as mpatches
 import seaborn as sns
 import numpy as np
 import pandas as pd
-import pingouin as pg
-from scipy.stats import pearsonr
-from scipy.integrate import simps
-import statistics
 import copy 
+from peth import load_peth, mouse_average
+from tables import load_table
+# pingouin and scipy are slow to import: they are imported in the functions using them
 
 # =============================================================================
 # TIMESERIES PLOTS
 # =============================================================================
 
+def load_timeseries_table(table_path, protocol=None, measure='freezing', hue='group'):
+    """
+    Read from a table saved by behavior_analysis (Parquet, Feather, CSV or Excel) only the
+    columns of a timeseries plot: mouse, hue, protocol and the <measure>_<bin number> columns,
+    and only the rows of the protocol if given (see tables.load_table)
+    """
+    return load_table(table_path, ['mouse', hue, 'protocol', f'{measure}_[0-9]*'], protocol)
+
+
+def load_bins_table(bins_path, protocol=None, measure=None):
+    """
+    Read the long-format table of the binned measures saved by analyse_all_data
+    (all_computed_bins.parquet next to the mice file), only the rows of one protocol and
+    measure if given. Without pyarrow, the table was saved in a pickle file next to it, which
+    is read instead
+    """
+    filters = [(column, '==', value) for column, value in (('protocol', protocol), ('measure', measure))
+               if value is not None]
+    pickle_path = Path(bins_path).with_suffix('.pkl')
+    if not Path(bins_path).exists() and pickle_path.exists():
+        df = pd.read_pickle(pickle_path)
+        for column, _, value in filters:
+            df = df[df[column] == value]
+        return df
+    return pd.read_parquet(bins_path, filters=filters or None)
+
+
+def timeseries_data(df, protocol, measure='freezing', hue='group', value_name='Freezing percentage',
+                    bin_size=10, in_minutes=False):
+    """
+    One row per mouse and bin of a binned measure, for the timeseries plots
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        Long-format table of the bins (see load_bins_table), or the wide table with the
+        <measure>_<bin number> columns
+    protocol: str
+    measure: str
+        freezing, speed, distance...
+    hue: str
+    value_name: str
+        Name of the column of the values
+    bin_size: float
+        Duration of the bins in seconds, to label them (the limits of the long table are not used:
+        the last bin stops at the end of the recording and can be shorter)
+    in_minutes: bool
+        Label the bins by their end in minutes, else by their end in tens of seconds
+
+    Returns
+    -------
+    df_melted: pandas.DataFrame
+        mouse, hue, protocol, 'Time bin' (labels in the order of the bins) and value_name
+    """
+    if 'measure' in df.columns and 'bin_end_s' in df.columns:
+        df_melted = df[(df['protocol'] == protocol) & (df['measure'] == measure)]
+        df_melted = df_melted.sort_values('bin', kind='stable')
+        df_melted = df_melted[['mouse', hue, 'protocol', 'bin', 'value']].rename(columns={'value': value_name,
+                                                                                       'bin': 'bin_end_s'})
+        df_melted['bin_end_s'] = df_melted['bin_end_s'] * bin_size
+        # Only the mice and groups of this protocol in the legends
+        for column in df_melted.select_dtypes('category').columns:
+            df_melted[column] = df_melted[column].cat.remove_unused_categories()
+    else:
+        # Wide table: one column per bin
+        bin_columns = {c: int(c.split('_')[-1]) for c in df.columns
+                       if c.startswith(f'{measure}_') and c.split('_')[-1].isdigit()}
+        df_melted = df[df['protocol'] == protocol].melt(id_vars=['mouse', hue, 'protocol'], value_vars=list(bin_columns),
+                                                        value_name=value_name, var_name='bin_end_s')
+        df_melted['bin_end_s'] = df_melted['bin_end_s'].map(bin_columns) * bin_size
+    if in_minutes:
+        df_melted['Time bin'] = [str(int(end) / 60) for end in df_melted['bin_end_s']]
+    else:
+        df_melted['Time bin'] = [str(int(end / 10)) for end in df_melted['bin_end_s']]
+    return df_melted.drop(columns='bin_end_s')
+
+
 def timeseries_SOC_rectangles_plot_bin10(df, protocol='soc', ax=None, bin_size=10, hue='group'):
     if ax is None:
         fig, ax = plt.subplots(1, 1)
-    df_proto = df[df['protocol'] == protocol]
-    df_melted = df_proto.melt(id_vars=['mouse', hue, 'protocol'],
-                              value_vars=[c for c in df.columns if 'freezing_' in c],
-                              value_name='Freezing percentage', var_name='Time bin')
-    df_melted['Time bin'] = [str(int(int(timelapse[9:])*(bin_size/10))) for timelapse in df_melted['Time bin']]
+    df_melted = timeseries_data(df, protocol, 'freezing', hue, 'Freezing percentage', bin_size)
     
     sns.set_theme(style="whitegrid")
     sns.lineplot(x='Time bin', y='Freezing percentage', hue=hue, data=df_melted, ax=ax,
@@ -123,11 +196,7 @@ def timeseries_SOC_rectangles_plot_bin10(df, protocol='soc', ax=None, bin_size=1
 def timeseries_simultaneous_SOC_rectangles_plot_bin10(df, protocol='soc', ax=None, bin_size=10, hue='group'):
     if ax is None:
         fig, ax = plt.subplots(1, 1)
-    df_proto = df[df['protocol'] == protocol]
-    df_melted = df_proto.melt(id_vars=['mouse', hue, 'protocol'],
-                              value_vars=[c for c in df.columns if 'freezing_' in c],
-                              value_name='Freezing percentage', var_name='Time bin')
-    df_melted['Time bin'] = [str(int(int(timelapse.split("_")[-1])*(bin_size/1))/60) for timelapse in df_melted['Time bin']]
+    df_melted = timeseries_data(df, protocol, 'freezing', hue, 'Freezing percentage', bin_size, in_minutes=True)
     
     sns.set_theme(style="whitegrid")
     sns.lineplot(x='Time bin', y='Freezing percentage', hue=hue, data=df_melted, ax=ax,
@@ -188,11 +257,7 @@ def timeseries_simultaneous_SOC_rectangles_plot_bin10(df, protocol='soc', ax=Non
 def timeseries_SOC_rectangles_plot_bin30(df, protocol='soc', ax=None, bin_size=30, hue='group'):
     if ax is None:
         fig, ax = plt.subplots(1, 1)
-    df_proto = df[df['protocol'] == protocol]
-    df_melted = df_proto.melt(id_vars=['mouse', hue, 'protocol'],
-                              value_vars=[c for c in df.columns if 'freezing_' in c],
-                              value_name='Freezing percentage', var_name='Time bin')
-    df_melted['Time bin'] = [str(int(int(timelapse[9:])*(bin_size/10))) for timelapse in df_melted['Time bin']]
+    df_melted = timeseries_data(df, protocol, 'freezing', hue, 'Freezing percentage', bin_size)
     
     sns.set_theme(style="whitegrid")
     sns.lineplot(x='Time bin', y='Freezing percentage', hue=hue, data=df_melted, ax=ax,
@@ -276,12 +341,8 @@ def timeseries_SOC_rectangles_plot_bin30(df, protocol='soc', ax=None, bin_size=3
 def timeseries_probetest_rectangles_plot_bin10(df, protocol='light1', ax=None, bin_size=10, hue='group'):
     if ax is None:
         fig, ax = plt.subplots(1, 1)
-    df_proto = df[df['protocol'] == protocol]
-    df_melted = df_proto.melt(id_vars=['mouse', hue, 'protocol'],
-                              value_vars=[c for c in df.columns if 'freezing_' in c],
-                              value_name='Freezing percentage', var_name='Time bin')
     # The numbers of the X axis will be expressed in seconds
-    df_melted['Time bin'] = [str(int(int(timelapse[9:])*(bin_size/1))/60) for timelapse in df_melted['Time bin']]
+    df_melted = timeseries_data(df, protocol, 'freezing', hue, 'Freezing percentage', bin_size, in_minutes=True)
     
     sns.set_theme(style="whitegrid")
     sns.lineplot(x='Time bin', y='Freezing percentage', hue=hue, data=df_melted, ax=ax,
@@ -339,13 +400,8 @@ def timeseries_probetest_rectangles_plot_bin10(df, protocol='light1', ax=None, b
 def new_timeseries_probetest_rectangles_plot_bin10(df, protocol='s2', ax=None, bin_size=10, hue='group'):
     if ax is None:
         fig, ax = plt.subplots(1, 1)
-    df_proto = df[df['protocol'] == protocol]
-    df_melted = df_proto.melt(id_vars=['mouse', hue, 'protocol'],
-                              value_vars=[c for c in df.columns if 'freezing_' in c],
-                              value_name='Freezing percentage', var_name='Time bin')    
-    
     # The numbers of the X axis will be expressed in seconds
-    df_melted['Time bin'] = [str(int(int(timelapse.split("_")[-1])*(bin_size/1))/60) for timelapse in df_melted['Time bin']]
+    df_melted = timeseries_data(df, protocol, 'freezing', hue, 'Freezing percentage', bin_size, in_minutes=True)
     
     sns.set_theme(style="whitegrid")
     sns.lineplot(x='Time bin', y='Freezing percentage', hue=hue, data=df_melted, ax=ax,
@@ -409,14 +465,8 @@ def new_timeseries_probetest_rectangles_plot_bin10(df, protocol='s2', ax=None, b
 def new_timeseries_speed_probetest_rectangles_plot_bin10(df, protocol='s1', ax=None, bin_size=10, hue='group'):
     if ax is None:
         fig, ax = plt.subplots(1, 1)
-    df_proto = df[df['protocol'] == protocol]
-    df_melted = df_proto.melt(id_vars=['mouse', hue, 'protocol'],
-                              value_vars=[c for c in df.columns if 'speed_' in c],
-                              value_name='Mean speed in each bin [mm/s]', var_name='Time bin')
-    df_melted = df_melted[df_melted['Time bin'] != 'speed_freezing']
-    df_melted = df_melted[df_melted['Time bin'] != 'speed_moving']
     # The numbers of the X axis will be expressed in seconds
-    df_melted['Time bin'] = [str(int(int(timelapse.split('_')[-1])*(bin_size/1))/60) for timelapse in df_melted['Time bin']]
+    df_melted = timeseries_data(df, protocol, 'speed', hue, 'Mean speed in each bin [mm/s]', bin_size, in_minutes=True)
     
     sns.set_theme(style="whitegrid")
     sns.lineplot(x='Time bin', y='Mean speed in each bin [mm/s]', hue=hue, data=df_melted, ax=ax,
@@ -480,12 +530,8 @@ def new_timeseries_speed_probetest_rectangles_plot_bin10(df, protocol='s1', ax=N
 def new_timeseries_distance_probetest_rectangles_plot_bin10(df, protocol='s1', ax=None, bin_size=10, hue='group'):
     if ax is None:
         fig, ax = plt.subplots(1, 1)
-    df_proto = df[df['protocol'] == protocol]
-    df_melted = df_proto.melt(id_vars=['mouse', hue, 'protocol'],
-                              value_vars=[c for c in df.columns if 'distance_' in c],
-                              value_name='Total distance moved in each bin [mm]', var_name='Time bin')
     # The numbers of the X axis will be expressed in seconds
-    df_melted['Time bin'] = [str(int(int(timelapse.split("_")[-1])*(bin_size/1))/60) for timelapse in df_melted['Time bin']]
+    df_melted = timeseries_data(df, protocol, 'distance', hue, 'Total distance moved in each bin [mm]', bin_size, in_minutes=True)
     
     sns.set_theme(style="whitegrid")
     sns.lineplot(x='Time bin', y='Total distance moved in each bin [mm]', hue=hue, data=df_melted, ax=ax,
@@ -549,11 +595,7 @@ def new_timeseries_distance_probetest_rectangles_plot_bin10(df, protocol='s1', a
 def timeseries_probetest_rectangles_plot_bin30(df, protocol='tone1', ax=None, bin_size=30, hue='group'):
     if ax is None:
         fig, ax = plt.subplots(1, 1)
-    df_proto = df[df['protocol'] == protocol]
-    df_melted = df_proto.melt(id_vars=['mouse', hue, 'protocol'],
-                              value_vars=[c for c in df.columns if 'freezing_' in c],
-                              value_name='Freezing percentage', var_name='Time bin')
-    df_melted['Time bin'] = [str(int(int(timelapse[9:])*(bin_size/10))) for timelapse in df_melted['Time bin']]
+    df_melted = timeseries_data(df, protocol, 'freezing', hue, 'Freezing percentage', bin_size)
     
     sns.set_theme(style="whitegrid")
     sns.lineplot(x='Time bin', y='Freezing percentage', hue=hue, data=df_melted, ax=ax,
@@ -603,12 +645,8 @@ def timeseries_probetest_rectangles_plot_bin30(df, protocol='tone1', ax=None, bi
 def timeseries_FOC_rectangles_plot_bin10(df, protocol='foc2', ax=None, bin_size=10, hue='group'):
     if ax is None:
         fig, ax = plt.subplots(1, 1)
-    df_proto = df[df['protocol'] == protocol]
-    df_melted = df_proto.melt(id_vars=['mouse', hue, 'protocol'],
-                              value_vars=[c for c in df.columns if 'freezing_' in c],
-                              value_name='Freezing percentage', var_name='Time bin')
     # The numbers of the X axis will be expressed in seconds
-    df_melted['Time bin'] = [str(int(int(timelapse[9:])*(bin_size/1))/60) for timelapse in df_melted['Time bin']]
+    df_melted = timeseries_data(df, protocol, 'freezing', hue, 'Freezing percentage', bin_size, in_minutes=True)
     
     sns.set_theme(style="whitegrid")
     sns.lineplot(x='Time bin', y='Freezing percentage', hue=hue, data=df_melted, ax=ax,
@@ -674,11 +712,7 @@ def timeseries_plot(df, protocol='hab', ax=None, bin_size=10, hue='group'):
     
     if ax is None:
         fig, ax = plt.subplots(1, 1)
-    df_proto = df[df['protocol'] == protocol]
-    df_melted = df_proto.melt(id_vars=['mouse', hue, 'protocol'],
-                              value_vars=[c for c in df.columns if 'freezing_' in c],
-                              value_name='Freezing percentage', var_name='Time bin')
-    df_melted['Time bin'] = [str(int(int(timelapse[9:])*(bin_size/10))) for timelapse in df_melted['Time bin']]
+    df_melted = timeseries_data(df, protocol, 'freezing', hue, 'Freezing percentage', bin_size)
     
     sns.set_theme(style="whitegrid")
     sns.lineplot(x='Time bin', y='Freezing percentage', hue=hue, data=df_melted, ax=ax,
@@ -691,6 +725,58 @@ def timeseries_plot(df, protocol='hab', ax=None, bin_size=10, hue='group'):
     return ax
 
 
+def timeseries_peth_plot(peth, measure='freezing', ax=None, hue='group', events=None, color='blue', label='stimulus'):
+    """
+    Freezing or speed around the onsets of a stimulus, from the PETH saved by
+    `python -m behavior_analysis peth` (see peth.py), averaged over the events of each mouse,
+    with a rectangle for the median duration of the stimulus
+
+    Parameters
+    ----------
+    peth: dict, str or Path
+        Tensor of peth.peth_tensor, or its NPZ file
+    measure: str
+        freezing or velocity
+    hue: str
+        Label column of the tensor
+    events: slice, list or None
+        Events of each mouse to average, e.g. slice(1, None) without the first one. All if None
+    """
+    if not isinstance(peth, dict):
+        peth = load_peth(peth)
+    if ax is None:
+        fig, ax = plt.subplots(1, 1)
+    average = mouse_average(peth, measure, events)
+    starts = peth['edges'][:-1]
+    ylabel = 'Freezing percentage' if measure == 'freezing' else 'Speed'
+    df_long = pd.DataFrame({'mouse': np.repeat(np.arange(len(average)), len(starts)),
+                            hue: np.repeat(peth[hue], len(starts)),
+                            'Time from onset [s]': np.tile(starts, len(average)),
+                            ylabel: average.ravel()})
+    
+    sns.set_theme(style="whitegrid")
+    sns.lineplot(x='Time from onset [s]', y=ylabel, hue=hue, data=df_long, ax=ax,
+                 # To plot individual values:
+                 # units="mouse", estimator=None  
+                 )
+    if measure == 'freezing':
+        ax.set_ylim(0, 100)
+    handles, labels = ax.get_legend_handles_labels()
+    
+    duration = np.nanmedian(peth['durations']) if np.any(~np.isnan(peth['durations'])) else 0
+    if np.isfinite(duration) and duration > 0:
+        ymin, ymax = ax.get_ylim()
+        stimulus_coords = plt.Rectangle((0, ymin), duration, ymax - ymin)
+        stimulus_coll = PatchCollection([stimulus_coords], alpha=0.1, color=color)
+        ax.add_collection(stimulus_coll)
+        stimulus_coll_border = PatchCollection([stimulus_coords], facecolor='none', edgecolor='black', alpha=0.5)
+        ax.add_collection(stimulus_coll_border)
+        handles.append(mpatches.Patch(color=color, label=label, alpha=0.1))
+    ax.legend(handles=handles)
+    
+    return ax
+
+
 # =============================================================================
 
 
@@ -752,6 +838,7 @@ def freezing_duration_hue_comparison(df, ax=None, perc=True, thres=1, hue='group
 
 
 def freezing_duration_comparison_between_two_periods(df, ax=None, perc=False, protocol='light1', specific_hue='G1'):
+    from scipy.integrate import simps
     
     off = 'last_off'
     on = 'first_on' # Also used for the habituation
@@ -1880,6 +1967,7 @@ def SOCphase_bullet_by_hue(df, ax=None, protocol='soc1', subject='mouse', hue='g
 
 
 def correlation_OffOn_by_hue(df, ax=None, s1='s1', s2='s2', subject='mouse', hue='group', specific_hue='G1'):
+    from scipy.stats import pearsonr
     
     # Creating a second type of dataframe with four columns
     s2_off = df[['meas_slices1', subject, hue]][df.protocol == s2]
@@ -1929,6 +2017,7 @@ def correlation_OffOn_by_hue(df, ax=None, s1='s1', s2='s2', subject='mouse', hue
 
 
 def correlation_OffOn_1_mins_by_hue(df, ax=None, s1='s1', s2='s2', subject='mouse', hue='group', specific_hue='light-shock'):
+    from scipy.stats import pearsonr
     
     # Creating a second type of dataframe with four columns
     s2_off = df[['meas_off_1min', subject, hue]][df.protocol == s2]
@@ -1978,6 +2067,7 @@ def correlation_OffOn_1_mins_by_hue(df, ax=None, s1='s1', s2='s2', subject='mous
 
 
 def correlation_OffOn_lastmin_1min_by_hue(df, ax=None, s1='s1', s2='s2', subject='mouse', hue='group', specific_hue='young_male'):
+    from scipy.stats import pearsonr
     
     # Creating a second type of dataframe with four columns
     s2_off = df[['meas_off_last', subject, hue]][df.protocol == s2]
@@ -2417,6 +2507,7 @@ def on_off_filter(df, protocol, column, hue, specific_hue):
 
 
 def barplot_OffOn(df, ax=None, protocol='s1', off_column='freezing_18', on_column='freezing_19', hue='', specific_hue=''):
+    import pingouin as pg
 
     if ax is None:
         fig, ax = plt.subplots()
@@ -2533,6 +2624,7 @@ def multiplot_OffOn(df):
 
 
 def discrimination_index(df, ax=None, index='di', protocol_1='s1', protocol_2='s2', off_column='meas_off_last', on_column='meas_on_1min', hue='group', specific_hue='PU'):
+    import pingouin as pg
 
     if ax is None:
         fig, ax = plt.subplots()
@@ -2661,6 +2753,7 @@ def discrimination_index(df, ax=None, index='di', protocol_1='s1', protocol_2='s
 
 
 def rmsd(df, ax=None, protocol_1='s1', protocol_2='s2', hue='', specific_hue=''):
+    import pingouin as pg
 
     if ax is None:
         fig, ax = plt.subplots()
@@ -0,0 +1,106 @@
+"""
+Dat files of the polyboxes: header, table of events and end of the recording. This module does
+not import settings.py, so that scripts working on the raw files (e.g. video corrector.py) can
+use it without the folders of the analysis
+"""
+
+from pathlib import Path
+import io
+import numpy as np
+import pandas as pd
+
+DAT_FILES = {}  # Parsed dat files, by path, with the size and modification time of the file
+DAT_FILES_MAX = 64  # Parsed dat files kept in memory, the least recently parsed are dropped
+TTL_CODE = 15  # TTL event should be type 15
+
+
+def parse_dat_file(dat_path):
+    """
+    Read a dat file of a polybox in one pass: the header lines, up to the first blank line,
+    then the table of events (tab-separated integers, timestamp in ms and event code first).
+    Blank lines and trailing tabs or spaces are ignored.
+    The last DAT_FILES_MAX parsed files are kept in memory until they change on disk.
+
+    Parameters
+    ----------
+    dat_path: Path or str
+
+    Returns
+    -------
+    dat: dict
+        header: dict
+            {name: value} from the "name<tab>value" lines of the header
+        events: np.ndarray
+            (n_events, n_columns) integer array, as in the file
+        records: np.ndarray
+            Structured array with the fields timestamp and code of each event
+        by_code: dict
+            {event code: np.ndarray with the timestamps of the events with this code}
+    """
+    dat_path = Path(dat_path)
+    stat = dat_path.stat()
+    signature = (stat.st_size, stat.st_mtime)
+    cached = DAT_FILES.get(str(dat_path))
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    with open(dat_path, 'rb') as fp:
+        content = fp.read()
+    header = {}
+    start = 0
+    for line in content.splitlines(keepends=True):
+        start += len(line)
+        line = line.decode(errors='replace').strip()
+        if line == '':
+            break
+        name, _, value = line.partition('\t')
+        header[name] = value
+    try:
+        events = pd.read_csv(io.BytesIO(content[start:]), sep='\t', header=None, skipinitialspace=True,
+                             engine='c')
+        # Trailing tabs give empty columns, lines of tabs or spaces empty rows
+        events = events.dropna(axis=1, how='all').dropna(axis=0, how='all').astype(int).to_numpy()
+    except pd.errors.EmptyDataError:
+        events = np.empty((0, 2), dtype=int)
+    if events.size == 0:
+        # Only blank lines after the header
+        events = np.empty((0, 2), dtype=int)
+    records = np.empty(len(events), dtype=[('timestamp', int), ('code', int)])
+    records['timestamp'] = events[:, 0]
+    records['code'] = events[:, 1]
+    order = np.argsort(records['code'], kind='stable')
+    codes, first = np.unique(records['code'][order], return_index=True)
+    by_code = dict(zip(codes.tolist(), np.split(records['timestamp'][order], first[1:])))
+    dat = {'header': header, 'events': events, 'records': records, 'by_code': by_code}
+    DAT_FILES.pop(str(dat_path), None)
+    while len(DAT_FILES) >= DAT_FILES_MAX:
+        DAT_FILES.pop(next(iter(DAT_FILES)))
+    DAT_FILES[str(dat_path)] = (signature, dat)
+    return dat
+
+
+def get_events(dat_path):
+    return parse_dat_file(dat_path)['events']
+
+
+def read_rec_duration(events, event_num=11):
+    """
+    Timestamps of the last two events event_num (end of the recording) and presence of TTL events
+
+    Parameters
+    ----------
+    events: dict or np.ndarray
+        Output of parse_dat_file, or table of events as given by get_events
+    event_num: int
+
+    Returns
+    -------
+    last_ts: np.ndarray
+    is_ttl: bool
+    """
+    if isinstance(events, dict):
+        by_code = events['by_code']
+        return by_code.get(event_num, np.array([], dtype=int))[-2:], TTL_CODE in by_code
+    eleven = events[events[:, 1] == event_num]
+    last_ts = eleven[-2:, 0]
+    is_ttl = np.any(events[:, 1] == TTL_CODE)
+    return last_ts, is_ttl
@@ -0,0 +1,162 @@
+"""
+Regions of interest (ROI) of the arena: definitions read from JSON files, membership of the
+positions of a bodypart in each ROI, and time spent, entries and latency in each ROI
+
+An ROI file is a JSON file, in pixels of the video:
+{"bodypart": "nose",
+ "rois": [{"name": "center", "shape": "rectangle", "x": 200, "y": 150, "width": 200, "height": 150},
+          {"name": "corner", "shape": "circle", "center": [50, 50], "radius": 40},
+          {"name": "wall", "shape": "polygon", "points": [[0, 0], [600, 0], [600, 40], [0, 40]]}]}
+It is either next to the DLC file (<DLC file name>.rois.json), for one mouse, or named
+rois.json in the folder of the DLC files, for all the mice of the folder.
+"""
+
+from pathlib import Path
+import json
+import numpy as np
+from bouts import find_bouts
+
+ROI_SHAPES = ('rectangle', 'circle', 'polygon')
+DEFAULT_ROI_FILE = 'rois.json'
+
+
+def find_roi_file(data_path):
+    """
+    ROI file of a DLC file: its own file if it exists, else the one of its folder, else None
+    """
+    data_path = Path(data_path)
+    for roi_path in (data_path.parent / f'{data_path.stem}.rois.json', data_path.parent / DEFAULT_ROI_FILE):
+        if roi_path.exists():
+            return roi_path
+    return None
+
+
+def load_rois(roi_path):
+    """
+    Read and check an ROI file
+
+    Returns
+    -------
+    config: dict
+        {'bodypart': str, 'rois': [dict of each ROI]}
+    """
+    with open(roi_path) as f:
+        config = json.load(f)
+    config.setdefault('bodypart', 'nose')
+    names = [roi.get('name') for roi in config.get('rois', [])]
+    if len(set(names)) != len(names) or None in names:
+        raise ValueError(f'{roi_path}: each ROI needs a different name')
+    for roi in config['rois']:
+        if roi.get('shape') not in ROI_SHAPES:
+            raise ValueError(f"{roi_path}: unknown shape {roi.get('shape')} for {roi['name']}, use one of {ROI_SHAPES}")
+    return config
+
+
+def save_rois(rois, roi_path, bodypart='nose'):
+    """
+    Write an ROI file, see load_rois
+    """
+    with open(roi_path, 'w') as f:
+        json.dump({'bodypart': bodypart, 'rois': rois}, f, indent=1)
+
+
+def select_rectangle_rois(img_path, names, roi_path, bodypart='nose'):
+    """
+    Draw rectangle ROIs on a snapshot of the video, once, and write them in an ROI file.
+    Opens a window for each name (cv2.selectROI: drag the rectangle, then press enter)
+    """
+    import cv2
+
+    img = cv2.imread(str(img_path))
+    rois = []
+    for name in names:
+        x, y, width, height = cv2.selectROI(name, img)  # Top left corner, width and height
+        cv2.destroyWindow(name)
+        rois.append({'name': name, 'shape': 'rectangle', 'x': int(x), 'y': int(y),
+                     'width': int(width), 'height': int(height)})
+    save_rois(rois, roi_path, bodypart)
+    return rois
+
+
+def points_in_polygon(x, y, points):
+    """
+    Even-odd rule (ray casting) for all the positions at once: a position is inside if a
+    horizontal ray from it crosses the edges of the polygon an odd number of times.
+    The loop is over the edges of the polygon, the positions are vectorized
+
+    Parameters
+    ----------
+    x, y: np.ndarray
+    points: array-like
+        (n_vertices, 2) vertices of the polygon
+
+    Returns
+    -------
+    inside: boolean np.ndarray
+    """
+    points = np.asarray(points, dtype=float)
+    inside = np.zeros(np.shape(x), dtype=bool)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for (x0, y0), (x1, y1) in zip(points, np.roll(points, -1, axis=0)):
+            crosses = (y0 > y) != (y1 > y)
+            x_cross = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+            inside ^= crosses & (x < x_cross)
+    return inside
+
+
+def roi_membership(roi, x, y):
+    """
+    Whether each position is in the ROI (False for the nan positions)
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    with np.errstate(invalid='ignore'):
+        if roi['shape'] == 'rectangle':
+            return ((x >= roi['x']) & (x < roi['x'] + roi['width'])
+                    & (y >= roi['y']) & (y < roi['y'] + roi['height']))
+        if roi['shape'] == 'circle':
+            cx, cy = roi['center']
+            return (x - cx) ** 2 + (y - cy) ** 2 <= roi['radius'] ** 2
+    return points_in_polygon(x, y, roi['points'])
+
+
+def roi_statistics(inside, framerate=25, edges=None):
+    """
+    Time spent, entries and latency of the first entry in an ROI, in total and by bins
+
+    Parameters
+    ----------
+    inside: boolean np.ndarray
+        Membership of each frame, see roi_membership
+    framerate: float
+    edges: np.ndarray or None
+        Frames limiting the bins, see behavior_analysis.bin_edges
+
+    Returns
+    -------
+    stats: dict
+        time: time in the ROI, in seconds
+        entries: number of entries in the ROI (being in it at the first frame counts as one)
+        latency: time before the first frame in the ROI, in seconds, nan if never in it
+        and, if edges is given, time_bin, entries_bin and latency_bin: the same in each bin,
+        the latency being counted from the start of the bin. nan for the bins after the end
+    """
+    inside = np.asarray(inside, dtype=bool)
+    entries = find_bouts(inside)['starts']
+    frames_inside = np.flatnonzero(inside)
+    stats = {'time': len(frames_inside) / framerate, 'entries': len(entries),
+             'latency': frames_inside[0] / framerate if len(frames_inside) else np.nan}
+    if edges is not None:
+        edges = np.clip(np.asarray(edges, dtype=int), 0, len(inside))
+        starts, stops = edges[:-1], edges[1:]
+        empty_bins = stops == starts
+        n_inside = np.searchsorted(frames_inside, stops) - np.searchsorted(frames_inside, starts)
+        # First frame in the ROI from the start of each bin, if it is before the end of the bin
+        ix_first = np.searchsorted(frames_inside, starts)
+        first = frames_inside[np.minimum(ix_first, len(frames_inside) - 1)] if len(frames_inside) else starts
+        has_entry = (ix_first < len(frames_inside)) & (first < stops)
+        stats['time_bin'] = np.where(empty_bins, np.nan, n_inside / framerate)
+        stats['entries_bin'] = np.where(empty_bins, np.nan,
+                                        np.searchsorted(entries, stops) - np.searchsorted(entries, starts))
+        stats['latency_bin'] = np.where(has_entry, (first - starts) / framerate, np.nan)
+    return stats
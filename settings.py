@@ -4,6 +4,7 @@ Version: 20/12/2022
 """
 from getpass import getuser
 from pathlib import Path
+import os
 
 # the user_name should be the name of your session
 user_name = getuser()
@@ -13,9 +14,73 @@ paths = {'mcanela': {'basepath': Path('C:/Users/mcanela/Desktop/Python'), # Fold
                      'figures': Path('C:/Users/mcanela/Desktop/Python/Figures'), # Folder where to save your images
                      'poly': Path('C:/Users/mcanela/Desktop/Python/Data/dat'), # Folder with the DAT files from the polybox
                      'video_path': Path('C:/Users/mcanela/Desktop/Python/Data/videos'), # Folder with the AVI videos from the polybox
-                     'lengths_path': Path('C:/Users/mcanela/Desktop/Python/Freezing periods') # Folder where to store your freezing lengths.
+                     'lengths_path': Path('C:/Users/mcanela/Desktop/Python/Freezing periods'), # Folder where to store your freezing lengths.
+                     'cache_path': Path('C:/Users/mcanela/Desktop/Python/Cache') # Folder where to store the file indexes (created if needed)
                      }}
 
-upaths = paths[user_name]
+
+
+def default_paths(basepath):
+    """Folders of a user without an entry in paths, with the same layout inside basepath"""
+    basepath = Path(basepath)
+    return {'basepath': basepath, 'dlcpath': basepath / 'Data' / 'dlc', 'table_path': basepath / 'Mice.txt',
+            'figures': basepath / 'Figures', 'poly': basepath / 'Data' / 'dat',
+            'video_path': basepath / 'Data' / 'videos', 'lengths_path': basepath / 'Freezing periods',
+            'cache_path': basepath / 'Cache'}
+
+
+# Without an entry in paths, the folders are inside the IMMOBILITY_PATH environment variable
+# (e.g. for the tests, see tests/conftest.py)
+if user_name in paths:
+    upaths = paths[user_name]
+elif 'IMMOBILITY_PATH' in os.environ:
+    upaths = default_paths(os.environ['IMMOBILITY_PATH'])
+else:
+    raise KeyError(f'No folders for the user {user_name}: add them to paths in settings.py, '
+                   f'or set the IMMOBILITY_PATH environment variable')
+
+# Frame rate of the polybox videos, used when the videos are not read (trust_dlc option)
+video_frame_rate = 25
+
+# Epochs of the protocols: windows (start, end) in seconds from the start of the recording, None
+# being the end of the recording. Each window gives time_<name> (duration in s) and meas_<name>
+# (percentage of freezing) in the results, each group the same over several windows.
+# epoch_protocol is the protocol of the analysis, unless the mice file has a 'protocol' column
+probe_windows = {'slices1': (0, 180), 'slices2': (180, None),  # probe test in SOC or SPC
+                 'slices_boredom': (0, 900),  # freezing in the last 5 min of the habituation phase
+                 'last_10s_off': (170, 180), 'first_10s_on': (180, 190),
+                 'off_1min': (0, 60), 'off_last': (120, 180), 'on_1min': (180, 240), 'on_last': (300, 360),
+                 'off_2min': (0, 120), 'on_2min': (180, 300)}
+soc_groups = {'off_all': ['off1', 'off2', 'off3', 'off4'], '1st_tone': ['tone1'],
+              'tone_all': ['tone2', 'tone3', 'tone4'], 'light_all': ['light1', 'light2', 'light3', 'light4']}
+epoch_protocols = {
+    # soc phase (soc1 G1G2 May-2023)
+    'soc1': {'windows': {**probe_windows,
+                         'off1': (0, 180), 'tone1': (180, 210), 'light1': (210, 240),
+                         'off2': (240, 300), 'tone2': (300, 330), 'light2': (330, 360),
+                         'off3': (360, 480), 'tone3': (480, 510), 'light3': (510, 540),
+                         'off4': (540, 630), 'tone4': (630, 660), 'light4': (660, 690)},
+             'groups': soc_groups},
+    # soc phase (soc2 G1G2 May-2023)
+    'soc2': {'windows': {**probe_windows,
+                         'off1': (0, 180), 'tone1': (180, 210), 'light1': (210, 240),
+                         'off2': (240, 330), 'tone2': (330, 360), 'light2': (360, 390),
+                         'off3': (390, 450), 'tone3': (450, 480), 'light3': (480, 510),
+                         'off4': (510, 630), 'tone4': (630, 660), 'light4': (660, 690)},
+             'groups': soc_groups},
+    # soc phase with the tones and lights read from the dat files (see events.py): tone1, light1...
+    # off1, off2... before each tone, and pre_tone1, post_tone1... the 10 s around each onset
+    'soc_events': {'windows': probe_windows, 'events': {'stimuli': ('tone', 'light'), 'peri': 10},
+                   'groups': soc_groups},
+}
+epoch_protocol = 'soc1'
+
+# Codes of the stimuli in the dat files of the polyboxes: {stimulus: (onset code, offset code)},
+# e.g. {'tone': (13, 14), 'light': (16, 17), 'shock': (18, None)}. Take them from the program of
+# your polyboxes: the protocols with 'events' (soc_events) need the codes of their stimuli.
+# The offset code is None for a stimulus of fixed duration, given in seconds in stimulus_durations,
+# e.g. {'shock': 2}. Codes 11 (end of the recording) and 15 (TTL) are used by the analysis
+stimulus_codes = {}
+stimulus_durations = {}
 
 sites_names={1: 'dHipp', 2: 'vHipp'}
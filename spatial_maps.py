@@ -0,0 +1,108 @@
+"""
+Maps of the arena: time spent, mean speed and fraction of freezing in square spatial bins,
+accumulated with np.bincount in one pass over the frames
+"""
+
+import numpy as np
+
+
+def arena_extent(width=600, height=450, xscale=20 / 600, yscale=15 / 450):
+    """
+    Extent of the whole video frame in cm, (xmin, xmax, ymin, ymax), to have the same bins
+    for all the mice
+
+    Parameters
+    ----------
+    width, height: int
+        Size of the video frames in pixels
+    xscale, yscale: float
+        Conversion from pixels to cm, see convert_cm
+    """
+    return 0, width * xscale, 0, height * yscale
+
+
+def map_edges(extent, bin_size=.5):
+    """
+    Edges of the spatial bins covering extent = (xmin, xmax, ymin, ymax), the last bins can
+    go beyond xmax and ymax
+
+    Returns
+    -------
+    xedges, yedges: np.ndarray
+    """
+    xmin, xmax, ymin, ymax = extent
+    n_x = max(int(np.ceil((xmax - xmin) / bin_size)), 1)
+    n_y = max(int(np.ceil((ymax - ymin) / bin_size)), 1)
+    return xmin + np.arange(n_x + 1) * bin_size, ymin + np.arange(n_y + 1) * bin_size
+
+
+def bin_indexes(x, y, xedges, yedges):
+    """
+    Flat index (row y, column x) of the spatial bin of each position, -1 outside the edges or for nans.
+    As in np.histogram, the last bins include their right edge, so that the maximum position
+    is kept when the extent is a whole number of bins
+    """
+    bin_size = xedges[1] - xedges[0]
+    n_x, n_y = len(xedges) - 1, len(yedges) - 1
+    with np.errstate(invalid='ignore'):
+        ix = np.minimum(np.floor((x - xedges[0]) / bin_size), n_x - 1)
+        iy = np.minimum(np.floor((y - yedges[0]) / bin_size), n_y - 1)
+        inside = (x >= xedges[0]) & (x <= xedges[-1]) & (y >= yedges[0]) & (y <= yedges[-1])
+    return np.where(inside, iy * n_x + ix, -1).astype(int)
+
+
+def spatial_maps(x, y, velocity, freezing, framerate=25, bin_size=.5, extent=None, chunk_size=None):
+    """
+    Occupancy, speed and freezing maps of a mouse
+
+    Parameters
+    ----------
+    x, y: np.ndarray
+        Positions in cm, x[i] and y[i] at the frame of velocity[i], the extra positions at the
+        end are ignored (can be memmaps)
+    velocity: np.ndarray
+        Speed at each frame
+    freezing: boolean np.ndarray
+    framerate: float
+    bin_size: float
+        Side of the spatial bins, in cm
+    extent: tuple or None
+        (xmin, xmax, ymin, ymax) in cm, e.g. from arena_extent. If None, the extent of the
+        positions of this mouse, and the maps cannot be compared between mice
+    chunk_size: int or None
+        Frames are read by blocks of chunk_size frames, all at once if None
+
+    Returns
+    -------
+    maps: dict
+        occupancy: time spent in each bin, in seconds
+        speed: mean speed in each bin, nan where the mouse never went
+        freezing: fraction of the time in each bin spent freezing, nan where the mouse never went
+        xedges, yedges: edges of the bins, rows of the maps are along y and columns along x
+    """
+    n_frames = len(velocity)
+    if extent is None:
+        extent = (np.nanmin(x[:n_frames]), np.nanmax(x[:n_frames]),
+                  np.nanmin(y[:n_frames]), np.nanmax(y[:n_frames]))
+    xedges, yedges = map_edges(extent, bin_size)
+    n_bins = (len(xedges) - 1) * (len(yedges) - 1)
+    sums = {k: np.zeros(n_bins) for k in ('frames', 'speed_frames', 'speed', 'freezing')}
+    chunk_size = chunk_size or max(n_frames, 1)
+    for start in range(0, n_frames, chunk_size):
+        stop = min(start + chunk_size, n_frames)
+        ix = bin_indexes(np.asarray(x[start:stop]), np.asarray(y[start:stop]), xedges, yedges)
+        inside = ix >= 0
+        ix = ix[inside]
+        v = np.asarray(velocity[start:stop])[inside]
+        has_speed = np.logical_not(np.isnan(v))
+        sums['frames'] += np.bincount(ix, minlength=n_bins)
+        sums['speed_frames'] += np.bincount(ix[has_speed], minlength=n_bins)
+        sums['speed'] += np.bincount(ix[has_speed], weights=v[has_speed], minlength=n_bins)
+        sums['freezing'] += np.bincount(ix, weights=np.asarray(freezing[start:stop])[inside], minlength=n_bins)
+    shape = (len(yedges) - 1, len(xedges) - 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        maps = {'occupancy': (sums['frames'] / framerate).reshape(shape),
+                'speed': (sums['speed'] / sums['speed_frames']).reshape(shape),
+                'freezing': (sums['freezing'] / sums['frames']).reshape(shape),
+                'xedges': xedges, 'yedges': yedges}
+    return maps
@@ -0,0 +1,149 @@
+"""
+Files of the tables of results: Parquet or Feather (columnar, typed, fast to reload), with CSV
+and Excel as optional views. Parquet and Feather need pyarrow, without it the tables are saved
+in CSV files instead (see fallback_path), which load_table reads when the file asked for is
+not there
+
+In the columnar files, the label columns (TABLE_CATEGORIES) are categorical, the measures are
+float32 and the freezing lengths (lengths_* columns) are lists of durations instead of text.
+"""
+
+from pathlib import Path
+import fnmatch
+import importlib.util
+import json
+import warnings
+import numpy as np
+import pandas as pd
+
+TABLE_FORMATS = ('parquet', 'feather', 'csv', 'xlsx')
+TABLE_CATEGORIES = ('protocol', 'group')
+
+
+def parse_lengths(value):
+    """
+    Durations of the freezing events as a float32 array, from a list or from its text in the
+    CSV files of the lengths ("[1.2, 0.4]"). None if there is no value
+    """
+    if isinstance(value, str):
+        value = json.loads(value)
+    elif value is None or (np.ndim(value) == 0 and pd.isna(value)):
+        return None
+    return np.asarray(value, dtype=np.float32)
+
+
+def typed_table(df):
+    """
+    Copy of a table with the types of the columnar files: categorical TABLE_CATEGORIES,
+    float32 measures and lists for the lengths_* columns
+    """
+    df = df.copy()
+    for column in df.columns:
+        if column in TABLE_CATEGORIES:
+            df[column] = df[column].astype('category')
+        elif column.startswith('lengths_'):
+            df[column] = [parse_lengths(value) for value in df[column]]
+        elif pd.api.types.is_float_dtype(df[column]):
+            df[column] = df[column].astype(np.float32)
+    return df
+
+
+def has_pyarrow():
+    """Whether pyarrow is installed, without importing it (which is slow)"""
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def fallback_path(table_path):
+    """Path of the CSV file written by save_table instead of a Parquet or Feather file without pyarrow"""
+    return Path(table_path).with_suffix('.csv')
+
+
+def save_table(df, table_path):
+    """
+    Write a table in the format given by the suffix of table_path, see TABLE_FORMATS.
+    The index is kept as a column in Feather files, which cannot store it. Without pyarrow,
+    Parquet and Feather tables are written in a CSV file next to table_path (see fallback_path),
+    with a warning
+
+    Returns
+    -------
+    table_path: Path
+        Path of the file written
+    """
+    table_path = Path(table_path)
+    fmt = table_path.suffix.lstrip('.')
+    if fmt in ('parquet', 'feather') and not has_pyarrow():
+        table_path = fallback_path(table_path)
+        warnings.warn(f'pyarrow is not installed, the {fmt} table is saved in {table_path} instead')
+        fmt = 'csv'
+    if fmt == 'parquet':
+        typed_table(df).to_parquet(table_path)
+    elif fmt == 'feather':
+        typed_table(df).reset_index().to_feather(table_path)
+    elif fmt == 'csv':
+        df.to_csv(table_path)
+    elif fmt == 'xlsx':
+        df.to_excel(table_path)
+    else:
+        raise ValueError(f'Unknown table format {fmt}, use one of {TABLE_FORMATS}')
+    return table_path
+
+
+def table_columns(table_path):
+    """Names of the columns of a table file, without reading its values (but in Excel files)"""
+    table_path = Path(table_path)
+    fmt = table_path.suffix.lstrip('.')
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.read_schema(table_path).names
+    if fmt == 'feather':
+        import pyarrow.ipc as ipc
+        with ipc.open_file(table_path) as reader:
+            return reader.schema.names
+    if fmt == 'csv':
+        return pd.read_csv(table_path, nrows=0).columns.tolist()
+    return pd.read_excel(table_path, nrows=0).columns.tolist()
+
+
+def load_table(table_path, columns=None, protocol=None):
+    """
+    Read a table, only some columns of it if given
+
+    Parameters
+    ----------
+    table_path: str or Path
+        File written by save_table. If a Parquet or Feather file is not there, the CSV file
+        written instead without pyarrow is read (see fallback_path)
+    columns: list of str or None
+        Names or patterns (e.g. 'freezing_*') of the columns to read, all if None
+    protocol: str or None
+        Only keep the rows of this protocol
+
+    Returns
+    -------
+    df: pandas.DataFrame
+    """
+    table_path = Path(table_path)
+    if (table_path.suffix in ('.parquet', '.feather') and not table_path.exists()
+            and fallback_path(table_path).exists()):
+        table_path = fallback_path(table_path)
+    fmt = table_path.suffix.lstrip('.')
+    if columns is not None:
+        # The index of the Feather files is their column 'index'
+        names = table_columns(table_path)
+        if protocol is not None:
+            columns = [*columns, 'protocol']
+        columns = [name for name in names if any(fnmatch.fnmatchcase(name, pattern) for pattern in columns)
+                   or (fmt == 'feather' and name == 'index')]
+    if fmt == 'parquet':
+        filters = None if protocol is None else [('protocol', '==', protocol)]
+        return pd.read_parquet(table_path, columns=columns, filters=filters)
+    if fmt == 'feather':
+        df = pd.read_feather(table_path, columns=columns)
+        if 'index' in df.columns:
+            df = df.set_index('index').rename_axis(None)
+    elif fmt == 'csv':
+        df = pd.read_csv(table_path, usecols=columns, index_col=0 if columns is None else None)
+    else:
+        df = pd.read_excel(table_path, usecols=columns, index_col=0 if columns is None else None)
+    return df if protocol is None else df[df['protocol'] == protocol]
@@ -0,0 +1,13 @@
+"""
+The modules of the analysis are at the root of the repository. The tests do not need the folders
+of settings.py: users without an entry in its paths get folders in a temporary directory
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+DATA_FOLDER = tempfile.TemporaryDirectory(prefix='immobility_')
+os.environ.setdefault('IMMOBILITY_PATH', DATA_FOLDER.name)
@@ -0,0 +1,24 @@
+"""
+Digests of the input files used in the cache keys
+"""
+
+import os
+
+from behavior_analysis import FILE_DIGESTS, cached_file_digest, file_digest
+
+
+def test_digest_is_kept_until_the_file_changes(tmp_path):
+    dat_path = tmp_path / 'mouse1.dat'
+    dat_path.write_text('1\t2\n')
+    digest = cached_file_digest(dat_path)
+    assert digest == file_digest(dat_path)
+    # Same size and modification time: the file is not read again
+    stat = dat_path.stat()
+    dat_path.write_text('3\t4\n')
+    os.utime(dat_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert cached_file_digest(dat_path) == digest
+    # And from the digests saved on disk
+    FILE_DIGESTS.clear()
+    assert cached_file_digest(dat_path) == digest
+    os.utime(dat_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert cached_file_digest(dat_path) == file_digest(dat_path) != digest
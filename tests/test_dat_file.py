@@ -0,0 +1,34 @@
+"""
+Dat files of the polyboxes read by parse_dat_file
+"""
+
+import numpy as np
+
+import polybox
+from polybox import DAT_FILES, parse_dat_file, read_rec_duration
+
+
+def test_trailing_tabs_and_blank_lines(tmp_path):
+    dat_path = tmp_path / 'mouse1.dat'
+    dat_path.write_text('Box\t3\nDate\t2023-01-01\n\n'
+                        '0\t11\t0\t\n'
+                        '1000\t15\t1\t\n'
+                        '\t\n'
+                        '2500\t 15\t1 \t\n'
+                        '600000\t11\t0\t\n\n')
+    dat = parse_dat_file(dat_path)
+    assert dat['header'] == {'Box': '3', 'Date': '2023-01-01'}
+    np.testing.assert_array_equal(dat['events'], [[0, 11, 0], [1000, 15, 1], [2500, 15, 1], [600000, 11, 0]])
+    np.testing.assert_array_equal(dat['by_code'][15], [1000, 2500])
+    last_ts, is_ttl = read_rec_duration(dat)
+    np.testing.assert_array_equal(last_ts, [0, 600000])
+    assert is_ttl
+
+
+def test_cache_is_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(polybox, 'DAT_FILES_MAX', 2)
+    DAT_FILES.clear()
+    for name in ('mouse1', 'mouse2', 'mouse3'):
+        tmp_path.joinpath(f'{name}.dat').write_text('Box\t1\n\n0\t11\n')
+        parse_dat_file(tmp_path / f'{name}.dat')
+    assert list(DAT_FILES) == [str(tmp_path / 'mouse2.dat'), str(tmp_path / 'mouse3.dat')]
@@ -0,0 +1,35 @@
+"""
+Readers of the DLC files, on a synthetic file (see write_synthetic_dlc)
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from behavior_analysis import dlc_columns, read_dlc_columns, read_dlc_header
+from benchmarks.synthetic import write_synthetic_dlc
+
+
+@pytest.fixture(scope='module')
+def dlc_file(tmp_path_factory):
+    data_path = tmp_path_factory.mktemp('dlc') / 'synthetic_dlc.csv'
+    write_synthetic_dlc(data_path, n_frames=2000, n_bodyparts=4)
+    return data_path
+
+
+def test_header(dlc_file):
+    columns, n_header = read_dlc_header(dlc_file)
+    assert n_header == 3
+    assert dlc_columns(columns, ['bodypart1']) == [4, 5, 6]
+
+
+@pytest.mark.parametrize('engine', ['pyarrow', 'c', 'genfromtxt'])
+def test_engines_match_pandas(dlc_file, engine):
+    if engine == 'pyarrow':
+        pytest.importorskip('pyarrow.csv')
+    columns, n_header = read_dlc_header(dlc_file)
+    cols = dlc_columns(columns, ['bodypart2', 'bodypart0'])
+    expected = pd.read_csv(dlc_file, header=[0, 1, 2], index_col=0).to_numpy()[:, np.subtract(cols, 1)]
+    dlc_data = read_dlc_columns(dlc_file, cols, n_header, engine=engine)
+    assert dlc_data.shape == (2000, 6)
+    np.testing.assert_array_equal(dlc_data, expected)
@@ -0,0 +1,17 @@
+"""
+Indexes of the dat and video folders
+"""
+
+from behavior_analysis import FILE_INDEXES, load_file_index
+
+
+def test_index_of_a_missing_folder_is_rebuilt(tmp_path):
+    folder, cache_path = tmp_path / 'dat', tmp_path / 'cache'
+    assert load_file_index(folder, cache_path=cache_path)['files'] == {}
+    folder.mkdir()
+    (folder / 'mouse1.dat').write_text('')
+    assert list(load_file_index(folder, cache_path=cache_path, refresh=True)['files']) == ['mouse1']
+    # And from the index saved on disk
+    FILE_INDEXES.clear()
+    folder.joinpath('mouse2.dat').write_text('')
+    assert sorted(load_file_index(folder, cache_path=cache_path)['files']) == ['mouse1', 'mouse2']
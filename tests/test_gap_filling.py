@@ -0,0 +1,88 @@
+"""
+Gap filling of the tracks, in one block and by chunks
+"""
+
+import numpy as np
+import pytest
+
+from behavior_analysis import (convert_cm, fill_gaps, fill_gaps_chunk, fill_positions_chunked, get_bodyparts,
+                               read_dlc_tracks)
+from benchmarks.synthetic import write_synthetic_dlc
+from bouts import find_bouts
+
+
+@pytest.fixture(scope='module')
+def dlc_file(tmp_path_factory):
+    data_path = tmp_path_factory.mktemp('dlc') / 'synthetic_dlc.csv'
+    write_synthetic_dlc(data_path, n_frames=5000, n_bodyparts=3)
+    return data_path
+
+
+def fill_by_chunks(values, chunk_size, max_gap=None):
+    """fill_gaps_chunk over the blocks of values, with the largest number of rows it kept"""
+    carry, blocks, max_pending = None, [], 0
+    for start in range(0, len(values), chunk_size):
+        filled, carry = fill_gaps_chunk(values[start:start + chunk_size], carry, max_gap=max_gap)
+        blocks.append(filled)
+        max_pending = max(max_pending, len(carry['pending']))
+    filled, carry = fill_gaps_chunk(values[:0], carry, final=True, max_gap=max_gap)
+    blocks.append(filled)
+    return np.concatenate(blocks), max_pending
+
+
+@pytest.mark.parametrize('max_gap', [None, 0, 3, 20])
+@pytest.mark.parametrize('chunk_size', [1, 7, 100])
+def test_chunks_match_fill_gaps(max_gap, chunk_size):
+    rng = np.random.default_rng(chunk_size)
+    values = rng.normal(size=(500, 3))
+    values[rng.random(values.shape) < 0.3] = np.nan
+    values[100:160, 1] = np.nan
+    filled, _ = fill_by_chunks(values, chunk_size, max_gap)
+    np.testing.assert_allclose(filled, fill_gaps(values, None, 'linear', max_gap), rtol=0, atol=1e-12)
+
+
+def test_column_without_values_is_not_kept():
+    # A bodypart hidden during the whole recording, read by several chunks
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=(1000, 2))
+    values[:, 0] = np.nan
+    filled, max_pending = fill_by_chunks(values, chunk_size=100, max_gap=50)
+    assert len(filled) == len(values)
+    assert max_pending <= 50
+    assert np.all(np.isnan(filled[:, 0]))
+    np.testing.assert_array_equal(filled[:, 1], values[:, 1])
+
+
+@pytest.mark.parametrize('method', ['linear', 'local-cubic'])
+@pytest.mark.parametrize('max_gap', [0, 2, 5])
+def test_max_gap(dlc_file, method, max_gap):
+    _, tracks = read_dlc_tracks(dlc_file)
+    values = tracks[:, :, :2].reshape(len(tracks), -1)
+    # The likelihoods are uniform: gaps of all lengths up to about 20 frames
+    values[np.repeat(tracks[:, :, 2] < 0.6, 2, axis=1)] = np.nan
+    is_nan = np.isnan(values)
+    filled = fill_gaps(values, None, method, max_gap)
+    np.testing.assert_array_equal(filled[~is_nan], values[~is_nan])
+    for col in range(values.shape[1]):
+        gaps = find_bouts(is_nan[:, col])
+        assert np.any(gaps['durations'] > max_gap)
+        for start, end, duration in zip(gaps['starts'], gaps['ends'], gaps['durations']):
+            if duration > max_gap:
+                assert np.all(np.isnan(filled[start:end, col]))
+            else:
+                assert not np.any(np.isnan(filled[start:end, col]))
+
+
+@pytest.mark.parametrize('max_gap', [None, 5])
+def test_chunked_positions_match_in_memory(dlc_file, tmp_path, max_gap):
+    bodyparts, tracks = read_dlc_tracks(dlc_file)
+    mouse = {'data_path': dlc_file, 'bodyparts': bodyparts, 'tracks': tracks,
+             'missing_frames': 10, 'n_frames': len(tracks)}
+    streams = {'main': ('bodypart0', 0.9), 'tail': ('bodypart2', 0.99)}
+    positions, dropped = fill_positions_chunked(mouse, streams, tmp_path, chunk_size=700, max_gap=max_gap)
+    for name, (bodypart, likelihood_th) in streams.items():
+        expected, expected_dropped = get_bodyparts(mouse, [bodypart], likelihood_th, 'linear', max_gap)
+        x, y = convert_cm(expected[:, 0, 0], expected[:, 0, 1])
+        np.testing.assert_allclose(positions[name][0], x, rtol=1e-6)
+        np.testing.assert_allclose(positions[name][1], y, rtol=1e-6)
+        assert dropped[name] == pytest.approx(expected_dropped[bodypart])
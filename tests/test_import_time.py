@@ -0,0 +1,52 @@
+"""
+Import time of the modules, against IMPORT_TIME_BUDGETS
+"""
+
+import importlib.util
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# Time budget, in seconds, of a bare import of each module in a fresh interpreter, and modules
+# that must not be imported by it
+IMPORT_TIME_BUDGETS = {'behavior_analysis': 1.5, 'plots_higher_order': 4.0}
+# (pyarrow is not listed: recent pandas versions import it themselves)
+LAZY_MODULES = {'behavior_analysis': ('matplotlib.pyplot', 'scipy.interpolate', 'cv2', 'pims'),
+                'plots_higher_order': ('pingouin', 'scipy.stats', 'scipy.integrate')}
+# Optional dependencies imported at the top of a module: without them, its test is skipped
+OPTIONAL_DEPENDENCIES = {'plots_higher_order': ('matplotlib', 'seaborn')}
+
+
+def missing_dependencies(module):
+    """Modules of OPTIONAL_DEPENDENCIES[module] that are not installed"""
+    return [name for name in OPTIONAL_DEPENDENCIES.get(module, ()) if importlib.util.find_spec(name) is None]
+
+
+def import_times(module):
+    """
+    {imported module: cumulative import time in seconds} of a bare import of a module in a fresh
+    interpreter, from the report of python -X importtime
+    """
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                         capture_output=True, text=True, check=True, cwd=ROOT)
+    times = {}
+    for line in out.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line.split('|')
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+@pytest.mark.parametrize('module', sorted(IMPORT_TIME_BUDGETS))
+def test_import_time(module):
+    missing = missing_dependencies(module)
+    if missing:
+        pytest.skip(f'{", ".join(missing)} not installed')
+    times = import_times(module)
+    assert times[module] <= IMPORT_TIME_BUDGETS[module]
+    assert not [name for name in LAZY_MODULES.get(module, ()) if name in times]
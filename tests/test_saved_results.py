@@ -0,0 +1,27 @@
+"""
+Results saved by save_data and reloaded lazily by load_saved_results
+"""
+
+import numpy as np
+
+from behavior_analysis import flatten_results, load_saved_results, save_data
+
+
+def test_lazy_arrays_are_keys(tmp_path):
+    data_path = tmp_path / 'mouse1.csv'
+    results = {'perc_freezing': 12.5, 'freezing_bin': np.array([10., 20.]), 'freezing': np.array([True, False]),
+               'pose': {'head': {'x': np.arange(3.)}}, 'params': {'bin_duration': 60}}
+    save_data(results, data_path)
+    res = load_saved_results(data_path)
+    expected = {'perc_freezing', 'freezing_bin', 'freezing', 'pose', 'params'}
+    # Before loading anything
+    assert 'freezing' in res and 'pose' in res and 'speed' not in res
+    assert len(res) == len(expected) and set(res) == expected and set(res.keys()) == expected
+    assert flatten_results(res) == {'perc_freezing': 12.5, 'freezing_1': 10., 'freezing_2': 20.}
+    assert dict.__len__(res) == 3
+    # Reading the arrays
+    assert res.get('speed') is None
+    np.testing.assert_array_equal(res.get('freezing'), results['freezing'])
+    items = dict(res.items())
+    np.testing.assert_array_equal(items['pose']['head']['x'], results['pose']['head']['x'])
+    assert len(list(res.values())) == len(expected) and len(res) == len(expected)
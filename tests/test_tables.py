@@ -0,0 +1,28 @@
+"""
+Tables of results written by save_table and read by load_table
+"""
+
+import pandas as pd
+import pytest
+
+import tables
+from tables import load_table, save_table
+
+
+@pytest.fixture
+def table():
+    return pd.DataFrame({'mouse': ['m1', 'm2'], 'protocol': ['soc1', 'soc2'], 'freezing_1': [10., 20.],
+                         'freezing_2': [30., 40.], 'speed_1': [1., 2.]})
+
+
+def test_csv_instead_of_parquet_without_pyarrow(table, tmp_path, monkeypatch):
+    monkeypatch.setattr(tables, 'has_pyarrow', lambda: False)
+    table_path = tmp_path / 'all_computed_data.parquet'
+    with pytest.warns(UserWarning, match='pyarrow is not installed'):
+        saved_path = save_table(table, table_path)
+    assert saved_path == tmp_path / 'all_computed_data.csv' and saved_path.exists()
+    assert not table_path.exists()
+    pd.testing.assert_frame_equal(load_table(table_path), table)
+    df = load_table(table_path, ['mouse', 'freezing_*'], protocol='soc2')
+    assert df.columns.tolist() == ['mouse', 'protocol', 'freezing_1', 'freezing_2']
+    assert df['mouse'].tolist() == ['m2']
@@ -9,26 +9,10 @@ import numpy as np
 from pims import Video
 import cv2
 import shutil
+from polybox import parse_dat_file, read_rec_duration
 
 directory = '//FOLDER/becell/Lab Projects/ERCstG_HighMemory/Data/Marc/1) SOC/2023-09 - Young males/Python Immobility/Data/corrected videos/'
 
-def get_events(dat_path):
-    with open(dat_path, 'r') as fp:
-        n_lines_header = 0
-        for line in fp:
-            n_lines_header += 1
-            line = line.strip()
-            if line == '':
-                break
-    events = np.genfromtxt(dat_path, delimiter='\t', skip_header=n_lines_header, dtype=int)
-    return events
-
-def read_rec_duration(events, event_num=11):
-    eleven = events[events[:, 1] == event_num]
-    last_ts = eleven[-2:, 0]
-    is_ttl = np.any(events[:, 1] == 15)  # TTL event should be type 15
-    return last_ts, is_ttl
-
 
 def add_blank_frames(video_path, missing_frames):
     # Create a temporary file to store the modified video
@@ -88,8 +72,7 @@ for filename in os.listdir(directory):
         dat_tag = tag + '.dat'
         dat_path = os.path.join(directory, dat_tag)
     
-        events = get_events(dat_path)
-        last_ts, is_ttl = read_rec_duration(events)
+        last_ts, is_ttl = read_rec_duration(parse_dat_file(dat_path))
         missing_frames = int((last_ts[0] / 1000) * frame_rate - n_frames)
         
         add_blank_frames(video_path, missing_frames)